@@ -1 +1,13 @@
-from chorus_engine.math import decompose_votes, cluster_users, get_comment_consensus
+from chorus_engine.math import (
+    ClusterPrior,
+    CompactVotes,
+    IncrementalVoteDecomposition,
+    VoteCounts,
+    decompose_votes,
+    cluster_users,
+    get_cluster_candidates,
+    get_comment_consensus,
+    get_comment_loadings,
+    get_comment_statistics,
+    get_top_k_indices,
+)
@@ -1,43 +1,836 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import partial
+from itertools import repeat
+import os
 import numpy as np
-from sklearn.cluster import KMeans
+from scipy import sparse
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.decomposition import PCA
 from sklearn.metrics import silhouette_score
+from sklearn.utils.extmath import svd_flip
+from threadpoolctl import threadpool_limits
 
 
 random_state = 42
+minibatch_threshold = 250_000
+randomized_svd_threshold = 1000
 
 
-def decompose_votes(vote_matrix: np.ndarray, random_state: int = random_state):
-    pca = PCA(n_components=2, random_state=random_state, svd_solver="covariance_eigh")
+@dataclass
+class CompactVotes:
+    """
+    A (users x comments) vote matrix stored in about 9 bits per cell instead of
+    the 64 of a float matrix with NaN for missing votes: vote values as int8,
+    with missing votes as 0, and a separate bit-packed mask of observed votes,
+    so that a skip and a missing vote remain distinguishable.
 
-    vote_matrix_nonan = np.nan_to_num(vote_matrix, nan=0)
-    transformed = pca.fit_transform(vote_matrix_nonan)
+    Vote values must be integers in [-128, 127].
+    """
 
-    total_votes = np.sum(~np.isnan(vote_matrix_nonan), axis=1)
-    vote_scale = np.sum(~np.isnan(vote_matrix_nonan), axis=1)
-    vote_scale = np.sqrt(total_votes / (vote_scale + 1e-10))
+    values: np.ndarray
+    observed_bits: np.ndarray
 
-    return transformed * vote_scale[:, None]
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.values.shape
 
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.observed_bits.nbytes
 
-def cluster_users(
-    reduced: np.ndarray, random_state: int = random_state, n_init: int = 100
+    @property
+    def observed(self) -> sparse.csr_array:
+        """
+        Returns the boolean mask of observed votes as a sparse matrix.
+        """
+        users, comments = self.get_observed_indices()
+        return sparse.csr_array(
+            (np.ones(len(users), dtype=bool), (users, comments)), shape=self.shape
+        )
+
+    def get_observed_indices(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the (user, comment) indices of observed votes. The packed mask
+        is scanned once, at one byte per 8 cells, and only the bytes with a
+        bit set are unpacked, so no array of one entry per cell is allocated.
+        """
+        users, blocks = np.nonzero(self.observed_bits)
+        bits = np.unpackbits(self.observed_bits[users, blocks][:, None], axis=1)
+        entries, offsets = np.nonzero(bits)
+        comments = blocks[entries] * 8 + offsets
+        return users[entries], comments
+
+    @classmethod
+    def from_triples(
+        cls,
+        users: np.ndarray,
+        comments: np.ndarray,
+        values: np.ndarray,
+        shape: tuple[int, int],
+    ):
+        """
+        Builds the matrix from (user, comment, value) triples of observed votes.
+        """
+        users, comments = np.asarray(users, dtype=int), np.asarray(comments, dtype=int)
+        compact_values = np.zeros(shape, dtype=np.int8)
+        compact_values[users, comments] = values
+
+        observed_bits = np.zeros((shape[0], (shape[1] + 7) // 8), dtype=np.uint8)
+        # bits are packed big-endian, matching np.packbits
+        np.bitwise_or.at(
+            observed_bits,
+            (users, comments // 8),
+            np.left_shift(1, 7 - comments % 8).astype(np.uint8),
+        )
+
+        return cls(values=compact_values, observed_bits=observed_bits)
+
+    @classmethod
+    def from_votes(
+        cls, vote_matrix: "VoteMatrix", observed: "VoteMatrix | None" = None
+    ):
+        """
+        Converts a dense or sparse vote matrix, read as in `get_observed_votes`.
+        """
+        users, comments, values = get_observed_votes(vote_matrix, observed)
+        return cls.from_triples(users, comments, values, vote_matrix.shape)
+
+    def to_dense(self) -> np.ndarray:
+        """
+        Returns the float vote matrix with NaN for missing votes.
+        """
+        users, comments = self.get_observed_indices()
+        dense = np.full(self.shape, np.nan)
+        dense[users, comments] = self.values[users, comments]
+        return dense
+
+    def to_sparse(self) -> sparse.csr_array:
+        """
+        Returns the float vote matrix as a sparse matrix, with skips as
+        explicit zeros and missing votes as implicit ones.
+        """
+        users, comments = self.get_observed_indices()
+        values = self.values[users, comments].astype(float)
+        return sparse.csr_array((values, (users, comments)), shape=self.shape)
+
+
+VoteMatrix = np.ndarray | sparse.sparray | sparse.spmatrix | CompactVotes
+
+
+def get_observed_votes(
+    vote_matrix: VoteMatrix, observed: VoteMatrix | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the (user, comment, value) triples of all observed votes.
+
+    Dense vote matrices mark missing votes with NaN. Sparse vote matrices store
+    every observed vote, including explicit zeros for skips, unless a boolean
+    `observed` mask of the same shape is given; observed entries that are not
+    stored are then read as skips. Compact vote matrices carry their own mask.
+    """
+    if isinstance(vote_matrix, CompactVotes):
+        users, comments = vote_matrix.get_observed_indices()
+        return users, comments, vote_matrix.values[users, comments].astype(float)
+
+    if not sparse.issparse(vote_matrix):
+        if observed is None:
+            observed = ~np.isnan(vote_matrix)
+        users, comments = np.nonzero(observed)
+        return users, comments, vote_matrix[users, comments]
+
+    vote_matrix = sparse.csr_array(vote_matrix)
+    if observed is None:
+        votes = vote_matrix.tocoo()
+        return votes.row, votes.col, votes.data
+
+    mask = sparse.coo_array(observed)
+    users, comments = mask.row[mask.data != 0], mask.col[mask.data != 0]
+    return users, comments, np.asarray(vote_matrix[users, comments]).ravel()
+
+
+def get_randomized_projections(
+    vote_matrix: VoteMatrix,
+    n_components: int = 2,
+    n_oversamples: int = 10,
+    n_iter: int = 7,
+    random_state: int = random_state,
 ):
-    best_silhouette = -1
-    best_kmeans = None
-    for n_clusters in range(2, min(4, len(reduced))):
-        kmeans = KMeans(n_clusters=n_clusters, random_state=random_state, n_init=n_init)
-        kmeans.fit(reduced)
-        silhouette = silhouette_score(
-            reduced, kmeans.labels_, random_state=random_state
+    """
+    Projects the rows of a dense or sparse matrix onto its principal components
+    with a randomized SVD (Halko, Martinsson & Tropp, 2011, Algorithm 4.4).
+    Columns are centered implicitly, so sparse input is never densified, and
+    the cost is O((nnz + (rows + columns) l) l n_iter) for l = n_components +
+    n_oversamples, instead of the O(rows columns^2 + columns^3) of an exact
+    covariance eigendecomposition.
+
+    For the centered matrix A with singular values s_1 >= s_2 >= ..., the basis
+    Q of the sampled range satisfies (ibid., Corollary 10.10)
+
+        E ||A - Q Q^T A|| <= (1 + 4 sqrt(l / (p - 1)) sqrt(min(rows, columns)))
+                             ^ (1 / (2 n_iter + 1)) s_(k + 1)
+
+    in the spectral norm, with k = n_components and p = n_oversamples >= 2.
+    Vote matrices have a few dominant opinion axes, so a handful of power
+    iterations brings the projections within floating point noise of PCA.
+    Signs follow the same convention as scikit-learn's PCA.
+    """
+    rng = np.random.default_rng(random_state)
+    num_users, num_comments = vote_matrix.shape
+    size = min(n_components + n_oversamples, num_users, num_comments)
+
+    mean = np.asarray(vote_matrix.sum(axis=0)).ravel() / num_users
+
+    def centered_matmul(block):
+        return vote_matrix @ block - mean @ block
+
+    def centered_rmatmul(block):
+        return vote_matrix.T @ block - np.outer(mean, block.sum(axis=0))
+
+    basis, _ = np.linalg.qr(centered_matmul(rng.normal(size=(num_comments, size))))
+    for _ in range(n_iter):
+        basis, _ = np.linalg.qr(centered_rmatmul(basis))
+        basis, _ = np.linalg.qr(centered_matmul(basis))
+
+    u, singular_values, vt = np.linalg.svd(
+        centered_rmatmul(basis).T, full_matrices=False
+    )
+    u, vt = svd_flip(
+        basis @ u[:, :n_components], vt[:n_components], u_based_decision=False
+    )
+
+    return u * singular_values[:n_components]
+
+
+def fill_missing_votes(vote_matrix: VoteMatrix):
+    """
+    Returns the vote matrix as floats with missing votes as zeros, keeping
+    sparse matrices sparse and converting compact ones to sparse.
+    """
+    if sparse.issparse(vote_matrix):
+        # missing votes are implicit zeros, which PCA centers without densifying
+        return sparse.csr_array(vote_matrix, dtype=float)
+    if isinstance(vote_matrix, CompactVotes):
+        # only observed votes are converted, so no dense float matrix is built
+        return vote_matrix.to_sparse()
+    return np.nan_to_num(vote_matrix, nan=0)
+
+
+def decompose_votes(
+    vote_matrix: VoteMatrix, random_state: int = random_state, solver: str = "auto"
+):
+    """
+    Projects users onto the first two principal components of their votes.
+    With solver="auto", conversations with more than `randomized_svd_threshold`
+    comments use `get_randomized_projections`, and the rest an exact
+    covariance eigendecomposition.
+    """
+    if solver == "auto":
+        if vote_matrix.shape[1] > randomized_svd_threshold:
+            solver = "randomized"
+        else:
+            solver = "covariance_eigh"
+
+    vote_matrix_nonan = fill_missing_votes(vote_matrix)
+
+    if solver == "covariance_eigh":
+        pca = PCA(n_components=2, random_state=random_state, svd_solver=solver)
+        transformed = pca.fit_transform(vote_matrix_nonan)
+    elif solver == "randomized":
+        transformed = get_randomized_projections(
+            vote_matrix_nonan, random_state=random_state
+        )
+    else:
+        raise ValueError(
+            f"Unknown solver: {solver}. Use 'auto', 'covariance_eigh' or 'randomized'."
+        )
+
+    return transformed
+
+
+def get_comment_loadings(vote_matrix: VoteMatrix, projections: np.ndarray):
+    """
+    Returns the (comments x components) loadings of every comment on the axes
+    of the user projections returned by `decompose_votes`.
+
+    The projections P = X_c W of the centered votes X_c onto orthonormal
+    components W have centered columns, so X^T P = X_c^T P = W diag(|P_k|^2)
+    and the components are recovered without refitting or densifying X.
+    Loadings are scaled by sqrt(comments), so that their mean squared norm is
+    the number of components whatever the size of the conversation.
+    """
+    vote_matrix = fill_missing_votes(vote_matrix)
+    squared_norms = np.sum(projections**2, axis=0)
+    squared_norms[squared_norms == 0] = 1
+
+    loadings = np.asarray(vote_matrix.T @ projections) / squared_norms
+    return loadings * np.sqrt(vote_matrix.shape[1])
+
+
+class IncrementalVoteDecomposition:
+    """
+    Keeps the column sums and Gram matrix of a vote matrix up to date as votes
+    arrive, so that the projections of `decompose_votes` can be refreshed
+    without refitting. A vote costs O(votes by its user); a refresh runs
+    subspace iterations on the covariance matrix, warm-started from the last
+    components, and falls back to a full eigendecomposition if they stall.
+
+    Users and comments are identified by arbitrary keys, and rows and columns
+    are ordered by first appearance.
+    """
+
+    def __init__(
+        self,
+        n_components: int = 2,
+        oversampling: int = 8,
+        tol: float = 1e-8,
+        max_iter: int = 100,
+        random_state: int = random_state,
+    ):
+        self.n_components = n_components
+        self.oversampling = oversampling
+        self.tol = tol
+        self.max_iter = max_iter
+        self.rng = np.random.default_rng(random_state)
+
+        self.user_keys = []
+        self.comment_keys = []
+        self.user_index = {}
+        self.comment_index = {}
+        self.user_votes = []
+
+        self.column_sums = np.zeros(0)
+        self.gram = np.zeros((0, 0))
+        self.basis = None
+
+    @classmethod
+    def from_votes(
+        cls,
+        vote_matrix: VoteMatrix,
+        observed: VoteMatrix | None = None,
+        **kwargs,
+    ):
+        """
+        Initializes the decomposition from a batch vote matrix, keyed by row
+        and column indices. Users without votes are not included.
+        """
+        decomposition = cls(**kwargs)
+        users, comments, values = get_observed_votes(vote_matrix, observed)
+
+        user_keys = np.unique(users)
+        decomposition.user_keys = user_keys.tolist()
+        decomposition.user_index = {key: i for i, key in enumerate(user_keys.tolist())}
+        decomposition.user_votes = [{} for _ in user_keys]
+        for user, comment, value in zip(
+            np.searchsorted(user_keys, users).tolist(),
+            comments.tolist(),
+            values.tolist(),
+        ):
+            decomposition.user_votes[user][comment] = value
+
+        num_comments = vote_matrix.shape[1]
+        decomposition.comment_keys = list(range(num_comments))
+        decomposition.comment_index = {key: key for key in range(num_comments)}
+
+        votes = sparse.csr_array(
+            (values, (np.searchsorted(user_keys, users), comments)),
+            shape=(len(user_keys), num_comments),
+        )
+        decomposition.column_sums = np.asarray(votes.sum(axis=0)).ravel()
+        decomposition.gram = (votes.T @ votes).toarray()
+
+        return decomposition
+
+    def add_vote(self, user, comment, value: float):
+        """
+        Records a new or changed vote. Skips count as zero, like missing votes.
+        """
+        if user not in self.user_index:
+            self.user_index[user] = len(self.user_keys)
+            self.user_keys.append(user)
+            self.user_votes.append({})
+
+        if comment not in self.comment_index:
+            self.comment_index[comment] = len(self.comment_keys)
+            self.comment_keys.append(comment)
+            self.column_sums = np.pad(self.column_sums, (0, 1))
+            self.gram = np.pad(self.gram, ((0, 1), (0, 1)))
+
+        row = self.user_votes[self.user_index[user]]
+        j = self.comment_index[comment]
+        delta = value - row.get(j, 0.0)
+
+        if delta != 0 and row:
+            # (x + d e_j)(x + d e_j)^T - x x^T = d (e_j x^T + x e_j^T) + d^2 e_j e_j^T
+            columns = np.fromiter(row.keys(), dtype=int, count=len(row))
+            values = np.fromiter(row.values(), dtype=float, count=len(row))
+            self.gram[j, columns] += delta * values
+            self.gram[columns, j] += delta * values
+        self.gram[j, j] += delta**2
+        self.column_sums[j] += delta
+        row[j] = value
+
+    def get_vote_matrix(self):
+        users = [i for i, row in enumerate(self.user_votes) for _ in row]
+        comments = [j for row in self.user_votes for j in row]
+        values = [value for row in self.user_votes for value in row.values()]
+        return sparse.csr_array(
+            (values, (users, comments)),
+            shape=(len(self.user_keys), len(self.comment_keys)),
+        )
+
+    def get_covariance(self):
+        num_users = len(self.user_keys)
+        if num_users < 2:
+            raise ValueError("At least two users are needed to decompose votes.")
+
+        mean = self.column_sums / num_users
+        covariance = self.gram - num_users * np.outer(mean, mean)
+        return mean, covariance / (num_users - 1)
+
+    def update_components(self):
+        """
+        Returns the mean and the principal components of the current votes.
+        """
+        mean, covariance = self.get_covariance()
+        num_comments = len(self.comment_keys)
+        num_components = min(self.n_components, num_comments)
+        block_size = min(num_comments, num_components + self.oversampling)
+
+        components = None
+        if self.basis is not None and block_size < num_comments:
+            basis = np.pad(self.basis, ((0, num_comments - len(self.basis)), (0, 0)))
+            basis = basis[:, :block_size]
+            if basis.shape[1] < block_size:
+                extra = self.rng.normal(
+                    size=(num_comments, block_size - basis.shape[1])
+                )
+                basis = np.hstack([basis, extra])
+
+            scale = max(np.linalg.norm(covariance, ord=1), np.finfo(float).tiny)
+            for _ in range(self.max_iter):
+                basis, _ = np.linalg.qr(covariance @ basis)
+                ritz_values, ritz_vectors = np.linalg.eigh(basis.T @ covariance @ basis)
+                basis = basis @ ritz_vectors[:, ::-1]
+                eigenvalues = ritz_values[::-1][:num_components]
+                vectors = basis[:, :num_components]
+
+                residual = covariance @ vectors - vectors * eigenvalues
+                if np.max(np.linalg.norm(residual, axis=0)) <= self.tol * scale:
+                    components = vectors.T
+                    break
+
+        if components is None:
+            _, eigenvectors = np.linalg.eigh(covariance)
+            basis = eigenvectors[:, ::-1][:, :block_size]
+            components = basis[:, :num_components].T
+
+        self.basis = basis
+        _, components = svd_flip(None, components.copy(), u_based_decision=False)
+
+        return mean, components
+
+    def transform(self):
+        """
+        Returns the user projections, as `decompose_votes` would, with rows
+        ordered as `user_keys`.
+        """
+        mean, components = self.update_components()
+        return self.get_vote_matrix() @ components.T - mean @ components.T
+
+
+@dataclass
+class ClusterPrior:
+    centroids: np.ndarray
+    # scores of the last full search, which warm starts are compared against
+    inertia: float
+    silhouette: float
+
+
+@dataclass
+class ClusterCandidate:
+    kmeans: KMeans
+    inertia: float
+    silhouette: float
+    warm_started: bool = False
+    # the prior a warm start was accepted against, whose scores it carries on
+    baseline: ClusterPrior | None = None
+
+    @property
+    def prior(self):
+        """
+        Returns the prior to warm-start the next fit from: these centroids,
+        with the scores of the last full search, so that a slow drift over
+        many accepted warm starts still triggers a new full search.
+        """
+        baseline = self.baseline or self
+        return ClusterPrior(
+            centroids=self.kmeans.cluster_centers_,
+            inertia=baseline.inertia,
+            silhouette=baseline.silhouette,
+        )
+
+
+def get_stratified_sample(
+    labels: np.ndarray, sample_size: int | None, random_state: int = random_state
+):
+    """
+    Returns sorted indices of a sample of about `sample_size` points, drawn from
+    each cluster in proportion to its size but with at least two points per
+    cluster where available.
+    """
+    labels = np.asarray(labels)
+    if sample_size is None or len(labels) <= sample_size:
+        return np.arange(len(labels))
+
+    rng = np.random.default_rng(random_state)
+    clusters, counts = np.unique(labels, return_counts=True)
+    allocation = np.maximum(np.minimum(counts, 2), counts * sample_size // len(labels))
+
+    return np.sort(
+        np.concatenate(
+            [
+                rng.choice(np.flatnonzero(labels == cluster), size=size, replace=False)
+                for cluster, size in zip(clusters, allocation)
+            ]
+        )
+    )
+
+
+def get_simplified_silhouette(
+    reduced: np.ndarray, labels: np.ndarray, centroids: np.ndarray
+):
+    """
+    Silhouette computed against cluster centroids instead of all other points,
+    which takes O(N k) rather than O(N^2) time and memory.
+    """
+    distances = np.linalg.norm(reduced[:, None, :] - centroids[None, :, :], axis=2)
+    users = np.arange(len(reduced))
+
+    own_distance = distances[users, labels]
+    distances[users, labels] = np.inf
+    nearest_distance = np.min(distances, axis=1)
+
+    scale = np.maximum(np.maximum(own_distance, nearest_distance), np.finfo(float).tiny)
+    return float(np.mean((nearest_distance - own_distance) / scale))
+
+
+def get_cluster_score(
+    reduced: np.ndarray,
+    kmeans: KMeans,
+    criterion: str = "silhouette",
+    sample_size: int | None = 5000,
+    random_state: int = random_state,
+):
+    if criterion == "silhouette":
+        sample = get_stratified_sample(kmeans.labels_, sample_size, random_state)
+        return silhouette_score(
+            reduced[sample], kmeans.labels_[sample], random_state=random_state
+        )
+
+    elif criterion == "simplified_silhouette":
+        return get_simplified_silhouette(
+            reduced, kmeans.labels_, kmeans.cluster_centers_
+        )
+
+    else:
+        raise ValueError(
+            f"Unknown criterion: {criterion}. "
+            "Use 'silhouette' or 'simplified_silhouette'."
+        )
+
+
+def get_cluster_method(
+    num_users: int,
+    n_features: int = 2,
+    n_jobs: int = 1,
+    max_memory: int | None = None,
+):
+    """
+    Chooses mini-batch k-means for conversations past `minibatch_threshold`
+    users, or when the full-batch working set of roughly (features + 4) floats
+    per user and worker would exceed `max_memory` bytes.
+    """
+    if num_users >= minibatch_threshold:
+        return "minibatch"
+
+    full_batch_memory = num_users * (n_features + 4) * 8 * max(n_jobs, 1)
+    if max_memory is not None and full_batch_memory > max_memory:
+        return "minibatch"
+
+    return "kmeans"
+
+
+def fit_kmeans(
+    reduced: np.ndarray,
+    n_clusters: int,
+    random_state: int = random_state,
+    n_init: int = 100,
+    init: np.ndarray | None = None,
+    method: str = "kmeans",
+):
+    if method == "kmeans":
+        estimator = KMeans
+    elif method == "minibatch":
+        # larger batches than the default converge in far fewer steps
+        estimator = partial(MiniBatchKMeans, batch_size=4096)
+    else:
+        raise ValueError(f"Unknown method: {method}. Use 'kmeans' or 'minibatch'.")
+
+    if init is None:
+        kmeans = estimator(
+            n_clusters=n_clusters, random_state=random_state, n_init=n_init
         )
-        if silhouette > best_silhouette:
-            best_silhouette = silhouette
-            best_kmeans = kmeans
+    else:
+        kmeans = estimator(
+            n_clusters=n_clusters, random_state=random_state, init=init, n_init=1
+        )
+    return kmeans.fit(reduced)
+
+
+class StreamingKMeans:
+    """
+    Clusters new users' projections against a fitted model without reclustering
+    everyone: each new point joins its nearest centroid, which then moves to
+    the running mean of all its members.
+    """
+
+    def __init__(self, centroids: np.ndarray, counts: np.ndarray):
+        self.cluster_centers_ = np.array(centroids, dtype=float)
+        self.counts = np.array(counts, dtype=int)
+
+    @classmethod
+    def from_kmeans(cls, kmeans: KMeans):
+        counts = np.bincount(kmeans.labels_, minlength=len(kmeans.cluster_centers_))
+        return cls(kmeans.cluster_centers_, counts)
+
+    def predict(self, points: np.ndarray):
+        distances = np.linalg.norm(
+            points[:, None, :] - self.cluster_centers_[None, :, :], axis=2
+        )
+        return np.argmin(distances, axis=1)
+
+    def partial_fit(self, points: np.ndarray):
+        labels = self.predict(points)
+        num_clusters, n_features = self.cluster_centers_.shape
+
+        batch_counts = np.bincount(labels, minlength=num_clusters)
+        batch_sums = np.zeros((num_clusters, n_features))
+        np.add.at(batch_sums, labels, points)
+
+        self.counts += batch_counts
+        updated = batch_counts > 0
+        self.cluster_centers_[updated] += (
+            batch_sums[updated]
+            - batch_counts[updated, None] * self.cluster_centers_[updated]
+        ) / self.counts[updated, None]
+
+        return labels
+
+
+def limit_threads(num_threads: int):
+    threadpool_limits(limits=num_threads)
+
+
+def search_kmeans(
+    reduced: np.ndarray,
+    cluster_counts: list[int],
+    random_state: int = random_state,
+    n_init: int = 100,
+    init_batches: int = 1,
+    n_jobs: int | None = 1,
+    backend: str = "threads",
+    method: str = "kmeans",
+) -> dict[int, KMeans]:
+    """
+    Runs the multi-init k-means search for each number of clusters, split into
+    (k, init batch) tasks and keeping the lowest inertia per k. The tasks and
+    their seeds only depend on `random_state` and `init_batches`, so results
+    are the same whether the tasks run serially or on `n_jobs` workers. Each
+    worker is limited to an equal share of the cores for BLAS and OpenMP.
+    """
+    if init_batches < 1 or init_batches > n_init:
+        raise ValueError("init_batches must be between 1 and n_init.")
+
+    # the first batch uses random_state itself, so one batch is a plain fit
+    seeds = [random_state] + np.random.SeedSequence(random_state).generate_state(
+        init_batches - 1
+    ).tolist()
+    batch_sizes = [len(batch) for batch in np.array_split(range(n_init), init_batches)]
+    tasks = [
+        (n_clusters, seed, batch_size, None, method)
+        for n_clusters in cluster_counts
+        for seed, batch_size in zip(seeds, batch_sizes)
+    ]
+
+    n_jobs = os.cpu_count() if n_jobs is None or n_jobs < 0 else n_jobs
+    n_jobs = min(n_jobs, len(tasks))
+    if n_jobs <= 1:
+        results = [fit_kmeans(reduced, *task) for task in tasks]
+    else:
+        num_threads = max(1, os.cpu_count() // n_jobs)
+        if backend == "threads":
+            executor = ThreadPoolExecutor(max_workers=n_jobs)
+            limits = threadpool_limits(limits=num_threads)
+        elif backend == "processes":
+            executor = ProcessPoolExecutor(
+                max_workers=n_jobs, initializer=limit_threads, initargs=(num_threads,)
+            )
+            limits = nullcontext()
+        else:
+            raise ValueError(
+                f"Unknown backend: {backend}. Use 'threads' or 'processes'."
+            )
+
+        with limits, executor:
+            results = list(executor.map(fit_kmeans, repeat(reduced), *zip(*tasks)))
+
+    best_kmeans = {}
+    for (n_clusters, *_), kmeans in zip(tasks, results):
+        if (
+            n_clusters not in best_kmeans
+            or kmeans.inertia_ < best_kmeans[n_clusters].inertia_
+        ):
+            best_kmeans[n_clusters] = kmeans
 
     return best_kmeans
 
 
+def score_cluster_candidate(
+    reduced: np.ndarray,
+    kmeans: KMeans,
+    warm_started: bool = False,
+    criterion: str = "silhouette",
+    sample_size: int | None = 5000,
+    random_state: int = random_state,
+):
+    return ClusterCandidate(
+        kmeans=kmeans,
+        # mean rather than total inertia, so that it stays comparable as users join
+        inertia=kmeans.inertia_ / len(reduced),
+        silhouette=get_cluster_score(
+            reduced, kmeans, criterion, sample_size, random_state
+        ),
+        warm_started=warm_started,
+    )
+
+
+def get_cluster_candidates(
+    reduced: np.ndarray,
+    random_state: int = random_state,
+    n_init: int = 100,
+    priors: dict[int, ClusterPrior] | None = None,
+    tolerance: float = 0.1,
+    criterion: str = "silhouette",
+    sample_size: int | None = 5000,
+    init_batches: int = 1,
+    n_jobs: int | None = 1,
+    backend: str = "threads",
+    method: str = "auto",
+    max_memory: int | None = None,
+) -> dict[int, ClusterCandidate]:
+    """
+    Fits k-means for each candidate number of clusters. When a prior for k is
+    given, a single run is started from its centroids, and the full multi-init
+    search is only run if the result's mean inertia grows by more than
+    `tolerance` (relative) or its silhouette drops by more than `tolerance`,
+    compared with the scores of the last full search that the prior carries.
+    The full searches are run by `search_kmeans`, with full-batch or
+    mini-batch k-means as `method` says; "auto" lets `get_cluster_method`
+    decide from the number of users and `max_memory`.
+
+    Candidates are scored with `criterion`: the silhouette of a stratified
+    sample of at most about `sample_size` users (None for all users), or the
+    simplified silhouette against the centroids.
+    """
+    scoring = {
+        "criterion": criterion,
+        "sample_size": sample_size,
+        "random_state": random_state,
+    }
+    priors = priors or {}
+    if method == "auto":
+        method = get_cluster_method(
+            len(reduced), reduced.shape[1], n_jobs or os.cpu_count(), max_memory
+        )
+
+    candidates = {}
+    for n_clusters in range(2, min(4, len(reduced))):
+        prior = priors.get(n_clusters)
+        if prior is not None and np.shape(prior.centroids) == (
+            n_clusters,
+            reduced.shape[1],
+        ):
+            kmeans = fit_kmeans(
+                reduced,
+                n_clusters,
+                random_state,
+                init=np.asarray(prior.centroids),
+                method=method,
+            )
+            candidate = score_cluster_candidate(
+                reduced, kmeans, warm_started=True, **scoring
+            )
+            if (
+                candidate.inertia <= prior.inertia * (1 + tolerance)
+                and candidate.silhouette >= prior.silhouette - tolerance
+            ):
+                candidate.baseline = prior
+                candidates[n_clusters] = candidate
+
+    searches = search_kmeans(
+        reduced,
+        [k for k in range(2, min(4, len(reduced))) if k not in candidates],
+        random_state,
+        n_init,
+        init_batches,
+        n_jobs,
+        backend,
+        method,
+    )
+    for n_clusters, kmeans in searches.items():
+        candidates[n_clusters] = score_cluster_candidate(reduced, kmeans, **scoring)
+
+    return dict(sorted(candidates.items()))
+
+
+def select_cluster_candidate(candidates: dict[int, ClusterCandidate]):
+    best_silhouette = -1
+    best_candidate = None
+    for candidate in candidates.values():
+        if candidate.silhouette > best_silhouette:
+            best_silhouette = candidate.silhouette
+            best_candidate = candidate
+
+    return best_candidate
+
+
+def cluster_users(
+    reduced: np.ndarray,
+    random_state: int = random_state,
+    n_init: int = 100,
+    priors: dict[int, ClusterPrior] | None = None,
+    criterion: str = "silhouette",
+    sample_size: int | None = 5000,
+    init_batches: int = 1,
+    n_jobs: int | None = 1,
+):
+    candidates = get_cluster_candidates(
+        reduced,
+        random_state,
+        n_init,
+        priors,
+        criterion=criterion,
+        sample_size=sample_size,
+        init_batches=init_batches,
+        n_jobs=n_jobs,
+    )
+    best_candidate = select_cluster_candidate(candidates)
+
+    return best_candidate.kmeans if best_candidate is not None else None
+
+
 def get_group_comment_representativeness(
     comment_votes: np.ndarray, cluster_labels: np.ndarray, cluster_index: int
 ):
@@ -96,3 +889,259 @@ def get_comment_consensus(
 
     else:
         raise ValueError(f"Unknown kind: {kind}. Use 'group_aware' or 'simple'.")
+
+
+def get_top_k_indices(values: np.ndarray, k: int | None = None):
+    """
+    Returns the indices of the k largest values in descending order, breaking
+    ties by index like a stable sort. Uses a partial selection, so only the
+    selected values are sorted.
+    """
+    values = np.asarray(values)
+    if k is None or k >= len(values):
+        return np.argsort(-values, kind="stable")
+    if k <= 0:
+        return np.array([], dtype=int)
+
+    threshold = np.partition(values, len(values) - k)[len(values) - k]
+    above = np.flatnonzero(values > threshold)
+    ties = np.flatnonzero(values == threshold)[: k - len(above)]
+
+    indices = np.sort(np.concatenate([above, ties]))
+    return indices[np.argsort(-values[indices], kind="stable")]
+
+
+@dataclass
+class CommentStatistics:
+    clusters: np.ndarray
+    cluster_sizes: np.ndarray
+
+    agree: np.ndarray
+    disagree: np.ndarray
+    skip: np.ndarray
+    total: np.ndarray
+
+    cluster_agree: np.ndarray
+    cluster_disagree: np.ndarray
+    cluster_skip: np.ndarray
+    cluster_total: np.ndarray
+
+    consensus: np.ndarray
+    participation: np.ndarray
+    representativeness: np.ndarray
+
+
+class VoteCounts:
+    """
+    The sufficient statistics of `get_comment_statistics`: agree, disagree and
+    skip counts for every (cluster, comment) pair, and the size of every
+    cluster. Counts are built once, in time linear in the number of votes, and
+    then kept up to date in O(1) per vote, so statistics never have to go back
+    to the vote matrix.
+
+    Users labelled -1 are counted in an extra, last row. Clusters are kept in
+    ascending order.
+    """
+
+    vote_values = (1, -1, 0)
+
+    def __init__(
+        self,
+        clusters: np.ndarray,
+        cluster_sizes: np.ndarray,
+        counts: np.ndarray,
+        num_unclustered: int = 0,
+    ):
+        self.clusters = np.asarray(clusters, dtype=int)
+        self.cluster_sizes = np.asarray(cluster_sizes, dtype=int)
+        self.counts = np.asarray(counts, dtype=int)
+        self.num_unclustered = int(num_unclustered)
+        self.cluster_rows = {
+            cluster: i for i, cluster in enumerate(self.clusters.tolist())
+        }
+
+    @classmethod
+    def empty(cls, cluster_labels: np.ndarray, num_comments: int):
+        """
+        Initializes zero counts for users with the given cluster labels.
+        """
+        cluster_labels = np.asarray(cluster_labels, dtype=int)
+        clustered = cluster_labels != -1
+        clusters, cluster_sizes = np.unique(
+            cluster_labels[clustered], return_counts=True
+        )
+        counts = np.zeros(
+            (len(clusters) + 1, num_comments, len(cls.vote_values)), dtype=int
+        )
+        return cls(clusters, cluster_sizes, counts, np.sum(~clustered))
+
+    @classmethod
+    def from_votes(
+        cls,
+        vote_matrix: VoteMatrix,
+        cluster_labels: np.ndarray,
+        observed: VoteMatrix | None = None,
+    ):
+        """
+        Counts the votes of a dense, sparse or compact (users x comments) vote
+        matrix, with users labelled by `cluster_labels`.
+        """
+        vote_counts = cls.empty(cluster_labels, vote_matrix.shape[1])
+        users, comments, values = get_observed_votes(vote_matrix, observed)
+
+        cluster_labels = np.asarray(cluster_labels, dtype=int)
+        vote_counts.add_votes(cluster_labels[users], comments, values)
+        return vote_counts
+
+    def get_row(self, cluster: int):
+        if cluster == -1:
+            return len(self.clusters)
+        return self.cluster_rows[cluster]
+
+    def add_votes(
+        self,
+        clusters: np.ndarray,
+        comments: np.ndarray,
+        values: np.ndarray,
+        counts: np.ndarray | None = None,
+    ):
+        """
+        Adds many votes at once, optionally as (cluster, comment, value, count)
+        rows of a grouped count. Values other than 1, -1 and 0 are ignored.
+        """
+        clusters = np.asarray(clusters, dtype=int)
+        rows = np.full(len(clusters), len(self.clusters))
+        clustered = clusters != -1
+        rows[clustered] = np.searchsorted(self.clusters, clusters[clustered])
+
+        values = np.asarray(values)
+        for kind, value in enumerate(self.vote_values):
+            mask = values == value
+            keys = rows[mask] * self.counts.shape[1] + np.asarray(comments)[mask]
+            self.counts[..., kind] += (
+                np.bincount(
+                    keys,
+                    weights=None if counts is None else np.asarray(counts)[mask],
+                    minlength=self.counts.shape[0] * self.counts.shape[1],
+                )
+                .reshape(self.counts.shape[:2])
+                .astype(int)
+            )
+
+    def add_vote(
+        self, cluster: int, comment: int, value: int, previous: int | None = None
+    ):
+        """
+        Records a new vote, or a changed one when its `previous` value is given.
+        """
+        row = self.get_row(cluster)
+        if previous is not None:
+            self.counts[row, comment, self.vote_values.index(previous)] -= 1
+        self.counts[row, comment, self.vote_values.index(value)] += 1
+
+    def add_user(self, cluster: int = -1):
+        """
+        Records a new user, adding their cluster if it is not known yet.
+        """
+        if cluster == -1:
+            self.num_unclustered += 1
+            return
+
+        if cluster not in self.cluster_rows:
+            row = np.searchsorted(self.clusters, cluster)
+            self.clusters = np.insert(self.clusters, row, cluster)
+            self.cluster_sizes = np.insert(self.cluster_sizes, row, 0)
+            self.counts = np.insert(self.counts, row, 0, axis=0)
+            self.cluster_rows = {
+                cluster: i for i, cluster in enumerate(self.clusters.tolist())
+            }
+        self.cluster_sizes[self.cluster_rows[cluster]] += 1
+
+    def add_comment(self):
+        """
+        Appends a comment without votes and returns its index.
+        """
+        self.counts = np.pad(self.counts, ((0, 0), (0, 1), (0, 0)))
+        return self.counts.shape[1] - 1
+
+    def to_dict(self) -> dict:
+        return {
+            "clusters": self.clusters.tolist(),
+            "cluster_sizes": self.cluster_sizes.tolist(),
+            "num_unclustered": self.num_unclustered,
+            "counts": self.counts.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        counts = np.array(data["counts"], dtype=int).reshape(
+            len(data["clusters"]) + 1, -1, len(cls.vote_values)
+        )
+        return cls(
+            data["clusters"],
+            data["cluster_sizes"],
+            counts,
+            data["num_unclustered"],
+        )
+
+    def statistics(self) -> CommentStatistics:
+        """
+        Computes per-comment statistics from the counts, in time linear in the
+        number of (cluster, comment) pairs.
+        """
+        # copied, so that later votes do not change the returned statistics
+        agree, disagree, skip = np.moveaxis(self.counts.copy(), -1, 0)
+        total = agree + disagree + skip
+        num_users = self.cluster_sizes.sum() + self.num_unclustered
+
+        cluster_agree_prob = (1 + agree[:-1]) / (2 + total[:-1])
+        not_cluster_agree_prob = (1 + agree.sum(axis=0) - agree[:-1]) / (
+            2 + total.sum(axis=0) - total[:-1]
+        )
+
+        consensus = np.prod(cluster_agree_prob, axis=0)
+        if self.num_unclustered > 0:
+            # get_comment_consensus leaves a zero factor for unclustered users
+            consensus = np.zeros_like(consensus)
+
+        participation = (
+            total.sum(axis=0) / num_users
+            if num_users > 0
+            else np.zeros(self.counts.shape[1])
+        )
+
+        return CommentStatistics(
+            clusters=self.clusters.copy(),
+            cluster_sizes=self.cluster_sizes.copy(),
+            agree=agree.sum(axis=0),
+            disagree=disagree.sum(axis=0),
+            skip=skip.sum(axis=0),
+            total=total.sum(axis=0),
+            cluster_agree=agree[:-1],
+            cluster_disagree=disagree[:-1],
+            cluster_skip=skip[:-1],
+            cluster_total=total[:-1],
+            consensus=consensus,
+            participation=participation,
+            representativeness=cluster_agree_prob / not_cluster_agree_prob,
+        )
+
+
+def get_comment_statistics(
+    vote_matrix: VoteMatrix,
+    cluster_labels: np.ndarray,
+    observed: VoteMatrix | None = None,
+):
+    """
+    Computes per-comment statistics for a whole (users x comments) vote matrix
+    at once, dense or sparse, in time and memory linear in the number of votes.
+    Per-cluster arrays are (clusters x comments), with rows ordered as
+    `clusters`; users labelled -1 count towards the totals but not any cluster.
+
+    `consensus` and `representativeness` match `get_comment_consensus` and
+    `get_group_comment_representativeness` applied to every comment.
+    """
+    if cluster_labels is None:
+        raise ValueError("Cluster labels must be provided for group-aware consensus.")
+
+    return VoteCounts.from_votes(vote_matrix, cluster_labels, observed).statistics()
@@ -1,9 +1,26 @@
+import tracemalloc
 import numpy as np
+import pytest
+from scipy import sparse
+from sklearn.decomposition import PCA
+from sklearn.metrics import adjusted_rand_score, silhouette_score
 from chorus_engine.math import (
+    CompactVotes,
+    StreamingKMeans,
+    VoteCounts,
+    ClusterPrior,
+    IncrementalVoteDecomposition,
     decompose_votes,
     cluster_users,
     get_comment_consensus,
+    get_comment_loadings,
+    get_cluster_candidates,
+    get_cluster_method,
+    get_comment_statistics,
+    get_simplified_silhouette,
+    get_stratified_sample,
     get_group_comment_representativeness,
+    get_top_k_indices,
 )
 
 
@@ -15,6 +32,18 @@ def test_decompose_votes():
     assert not np.isnan(transformed).any()
 
 
+def test_get_comment_loadings():
+    rng = np.random.default_rng(0)
+    votes_matrix = rng.choice([1, -1, 0, np.nan], size=(60, 20), p=[0.3] * 3 + [0.1])
+    filled = np.nan_to_num(votes_matrix, nan=0)
+
+    pca = PCA(n_components=2, svd_solver="covariance_eigh").fit(filled)
+    loadings = get_comment_loadings(votes_matrix, decompose_votes(votes_matrix))
+
+    assert loadings.shape == (20, 2)
+    assert np.allclose(loadings / np.sqrt(20), pca.components_.T)
+
+
 def test_cluster_users():
     reduced = np.array([[1, 2], [1.1, 2.1], [3, 4], [3.1, 4.1]])
     kmeans = cluster_users(reduced, random_state=42)
@@ -45,3 +74,308 @@ def test_get_comment_consensus():
 
     assert np.isclose(consensus_group_aware, 0.33333, atol=1e-5)
     assert np.isclose(consensus_simple, 0.66666, atol=1e-5)
+
+
+def test_get_comment_statistics():
+    rng = np.random.default_rng(0)
+    votes_matrix = rng.choice([1, -1, 0, np.nan], size=(40, 25))
+
+    for cluster_labels in [rng.integers(0, 3, 40), rng.integers(-1, 3, 40)]:
+        stats = get_comment_statistics(votes_matrix, cluster_labels)
+
+        assert stats.cluster_agree.shape == (3, 25)
+        assert np.all(stats.total == np.sum(~np.isnan(votes_matrix), axis=0))
+        assert np.all(stats.agree + stats.disagree + stats.skip == stats.total)
+        assert np.all(stats.cluster_sizes == np.bincount(cluster_labels + 1)[-3:])
+
+        for idx in range(votes_matrix.shape[1]):
+            votes = votes_matrix[:, idx]
+            assert np.isclose(
+                stats.consensus[idx], get_comment_consensus(votes, cluster_labels)
+            )
+            for cluster_idx, cluster in enumerate(stats.clusters):
+                assert np.isclose(
+                    stats.representativeness[cluster_idx, idx],
+                    get_group_comment_representativeness(
+                        votes, cluster_labels, cluster
+                    ),
+                )
+
+
+def test_get_top_k_indices():
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 5, 50).astype(float)
+    expected = np.argsort(-values, kind="stable")
+
+    for k in [0, 1, 3, 10, 49, 50, 100, None]:
+        indices = get_top_k_indices(values, k)
+        assert np.all(indices == expected[:k])
+
+
+def test_sparse_vote_matrix():
+    rng = np.random.default_rng(0)
+    votes_matrix = rng.choice([1, -1, 0, np.nan], size=(40, 25), p=[0.2] * 3 + [0.4])
+    cluster_labels = rng.integers(0, 3, 40)
+
+    users, comments = np.nonzero(~np.isnan(votes_matrix))
+    sparse_matrix = sparse.csr_array(
+        (votes_matrix[users, comments], (users, comments)), shape=votes_matrix.shape
+    )
+
+    assert np.allclose(decompose_votes(sparse_matrix), decompose_votes(votes_matrix))
+
+    expected = get_comment_statistics(votes_matrix, cluster_labels)
+    stats = get_comment_statistics(sparse_matrix, cluster_labels)
+    assert np.all(stats.total == expected.total)
+    assert np.all(stats.cluster_skip == expected.cluster_skip)
+    assert np.allclose(stats.consensus, expected.consensus)
+    assert np.allclose(stats.representativeness, expected.representativeness)
+
+    # skips dropped from the matrix are recovered from the observed mask
+    observed = sparse.csr_array(
+        (np.ones(len(users), dtype=bool), (users, comments)), shape=votes_matrix.shape
+    )
+    sparse_matrix.eliminate_zeros()
+    stats = get_comment_statistics(sparse_matrix, cluster_labels, observed)
+    assert np.all(stats.skip == expected.skip)
+
+
+def test_compact_vote_matrix():
+    rng = np.random.default_rng(0)
+    votes_matrix = rng.choice([1, -1, 0, np.nan], size=(40, 25), p=[0.2] * 3 + [0.4])
+    cluster_labels = rng.integers(0, 3, 40)
+
+    compact = CompactVotes.from_votes(votes_matrix)
+    assert compact.values.dtype == np.int8
+    assert compact.nbytes < votes_matrix.nbytes / 6
+    assert np.array_equal(compact.to_dense(), votes_matrix, equal_nan=True)
+
+    assert np.allclose(decompose_votes(compact), decompose_votes(votes_matrix))
+
+    expected = get_comment_statistics(votes_matrix, cluster_labels)
+    stats = get_comment_statistics(compact, cluster_labels)
+    assert np.all(stats.skip == expected.skip)
+    assert np.all(stats.cluster_total == expected.cluster_total)
+    assert np.allclose(stats.consensus, expected.consensus)
+    assert np.allclose(stats.representativeness, expected.representativeness)
+
+
+def test_compact_vote_matrix_stays_sparse():
+    rng = np.random.default_rng(0)
+    num_users, num_comments, votes_per_user = 5000, 2000, 5
+    users = np.repeat(np.arange(num_users), votes_per_user)
+    comments = rng.integers(0, num_comments, len(users))
+    values = rng.choice([1, -1, 0], size=len(users))
+    compact = CompactVotes.from_triples(
+        users, comments, values, (num_users, num_comments)
+    )
+    expected = decompose_votes(compact.to_dense())
+
+    # even a boolean (users x comments) matrix would take one byte per cell
+    tracemalloc.start()
+    projections = decompose_votes(compact)
+    get_comment_loadings(compact, projections)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert peak < num_users * num_comments
+    assert np.allclose(projections, expected)
+
+
+def test_vote_counts():
+    rng = np.random.default_rng(0)
+    votes_matrix = rng.choice([1, -1, 0, np.nan], size=(40, 25), p=[0.2] * 3 + [0.4])
+    cluster_labels = rng.integers(0, 3, 40)
+
+    # replay the votes one by one, starting without users or comments
+    vote_counts = VoteCounts.empty(np.array([], dtype=int), 0)
+    for user in range(40):
+        vote_counts.add_user(cluster_labels[user])
+    for comment in range(25):
+        assert vote_counts.add_comment() == comment
+    for user, comment in zip(*np.nonzero(~np.isnan(votes_matrix))):
+        vote_counts.add_vote(
+            cluster_labels[user], comment, -votes_matrix[user, comment]
+        )
+        vote_counts.add_vote(
+            cluster_labels[user],
+            comment,
+            votes_matrix[user, comment],
+            previous=-votes_matrix[user, comment],
+        )
+
+    expected = get_comment_statistics(votes_matrix, cluster_labels)
+    vote_counts = VoteCounts.from_dict(vote_counts.to_dict())
+    stats = vote_counts.statistics()
+    assert np.all(stats.clusters == expected.clusters)
+    assert np.all(stats.cluster_sizes == expected.cluster_sizes)
+    assert np.all(stats.cluster_disagree == expected.cluster_disagree)
+    assert np.all(stats.total == expected.total)
+    assert np.allclose(stats.participation, expected.participation)
+    assert np.allclose(stats.consensus, expected.consensus)
+    assert np.allclose(stats.representativeness, expected.representativeness)
+
+
+def test_incremental_vote_decomposition():
+    rng = np.random.default_rng(0)
+    groups = rng.integers(0, 2, 200)
+    opinions = rng.choice([1, -1], size=(2, 40))
+    noise = rng.choice([1, -1, 0], size=(200, 40))
+    votes_matrix = np.where(rng.random((200, 40)) < 0.8, opinions[groups], noise)
+    votes_matrix = np.where(rng.random((200, 40)) < 0.5, np.nan, votes_matrix)
+
+    initial_votes = np.where(rng.random((200, 40)) < 0.2, np.nan, votes_matrix)
+    decomposition = IncrementalVoteDecomposition.from_votes(initial_votes[:, :-5])
+    decomposition.transform()
+
+    # change some votes, then stream in all votes including new comments
+    for user, comment in list(zip(*np.nonzero(~np.isnan(initial_votes))))[:100]:
+        decomposition.add_vote(user, comment, -initial_votes[user, comment])
+    decomposition.transform()
+    for user, comment in zip(*np.nonzero(~np.isnan(votes_matrix))):
+        decomposition.add_vote(user, comment, votes_matrix[user, comment])
+
+    expected = decompose_votes(votes_matrix)
+    transformed = decomposition.transform()[np.argsort(decomposition.user_keys)]
+    assert np.allclose(transformed, expected, atol=1e-5)
+
+
+def test_warm_started_cluster_candidates():
+    rng = np.random.default_rng(0)
+    reduced = np.vstack(
+        [rng.normal(0, 1, (50, 2)) + [5, 0], rng.normal(0, 1, (50, 2)) - [5, 0]]
+    )
+    candidates = get_cluster_candidates(reduced)
+    assert not any(candidate.warm_started for candidate in candidates.values())
+
+    priors = {k: candidate.prior for k, candidate in candidates.items()}
+    warm_candidates = get_cluster_candidates(reduced, priors=priors)
+    assert all(candidate.warm_started for candidate in warm_candidates.values())
+    assert np.all(warm_candidates[2].kmeans.labels_ == candidates[2].kmeans.labels_)
+
+    # a warm start that is much worse than the previous fit falls back
+    priors[2] = ClusterPrior(
+        centroids=priors[2].centroids,
+        inertia=priors[2].inertia / 2,
+        silhouette=priors[2].silhouette,
+    )
+    warm_candidates = get_cluster_candidates(reduced, priors=priors)
+    assert not warm_candidates[2].warm_started
+    assert warm_candidates[3].warm_started
+
+
+def test_cluster_candidates_drift_from_full_search():
+    rng = np.random.default_rng(0)
+    noise = rng.normal(0, 1, (100, 2))
+    centers = np.repeat([[5, 0], [-5, 0]], 50, axis=0)
+
+    # the clusters spread by 3% per refresh, so the mean inertia grows by about
+    # 6%: within tolerance of the previous refresh, but not two refreshes apart
+    priors = None
+    warm_started = []
+    for step in range(6):
+        candidates = get_cluster_candidates(
+            centers + noise * 1.03**step, priors=priors
+        )
+        warm_started.append(candidates[2].warm_started)
+        priors = {k: candidate.prior for k, candidate in candidates.items()}
+
+    assert warm_started == [False, True, False, True, False, True]
+
+
+def test_stratified_sample():
+    labels = np.repeat([0, 1, 2], [900, 99, 1])
+
+    sample = get_stratified_sample(labels, 100)
+    assert np.all(np.diff(sample) > 0)
+    assert np.all(np.bincount(labels[sample]) == [90, 9, 1])
+    assert np.all(get_stratified_sample(labels, 100) == sample)
+
+    assert len(get_stratified_sample(labels, None)) == len(labels)
+
+
+def test_cluster_selection_criteria():
+    rng = np.random.default_rng(0)
+    reduced = np.vstack(
+        [rng.normal(0, 1, (10000, 2)) + [5, 0], rng.normal(0, 1, (10000, 2)) - [5, 0]]
+    )
+
+    for criterion in ["silhouette", "simplified_silhouette"]:
+        candidates = get_cluster_candidates(
+            reduced, n_init=1, criterion=criterion, sample_size=1000
+        )
+        assert candidates[2].silhouette > candidates[3].silhouette
+
+    kmeans = candidates[2].kmeans
+    simplified = get_simplified_silhouette(
+        reduced, kmeans.labels_, kmeans.cluster_centers_
+    )
+    sample = get_stratified_sample(kmeans.labels_, 2000)
+    exact = silhouette_score(reduced[sample], kmeans.labels_[sample])
+    assert np.isclose(simplified, exact, atol=0.1)
+
+
+def test_parallel_cluster_candidates():
+    rng = np.random.default_rng(0)
+    reduced = np.vstack([rng.normal(0, 1, (100, 2)) + [i, 0] for i in range(3)])
+
+    serial = get_cluster_candidates(reduced, n_init=12, init_batches=4)
+    for backend in ["threads", "processes"]:
+        parallel = get_cluster_candidates(
+            reduced, n_init=12, init_batches=4, n_jobs=3, backend=backend
+        )
+        assert list(parallel) == list(serial)
+        for n_clusters, candidate in serial.items():
+            assert np.all(
+                parallel[n_clusters].kmeans.labels_ == candidate.kmeans.labels_
+            )
+            assert np.isclose(parallel[n_clusters].inertia, candidate.inertia)
+
+
+def test_minibatch_and_streaming_clustering():
+    rng = np.random.default_rng(0)
+    centers = np.array([[5, 0], [-5, 0], [0, 5]])
+    reduced = np.vstack([rng.normal(0, 1, (2000, 2)) + center for center in centers])
+    rng.shuffle(reduced)
+
+    assert get_cluster_method(len(reduced)) == "kmeans"
+    assert get_cluster_method(len(reduced), max_memory=1000) == "minibatch"
+    assert get_cluster_method(1_000_000) == "minibatch"
+
+    full = get_cluster_candidates(reduced, n_init=10, method="kmeans")
+    minibatch = get_cluster_candidates(reduced, n_init=10, method="minibatch")
+    assert adjusted_rand_score(
+        full[3].kmeans.labels_, minibatch[3].kmeans.labels_
+    ) == pytest.approx(1, abs=0.05)
+
+    # stream the last users into a model fitted on the others
+    initial = get_cluster_candidates(reduced[:5000], n_init=10)[3].kmeans
+    streaming = StreamingKMeans.from_kmeans(initial)
+    labels = np.concatenate(
+        [initial.labels_]
+        + [streaming.partial_fit(batch) for batch in np.split(reduced[5000:], 10)]
+    )
+    assert adjusted_rand_score(full[3].kmeans.labels_, labels) == pytest.approx(
+        1, abs=0.05
+    )
+    assert np.all(streaming.counts == np.bincount(labels))
+
+
+def test_randomized_decompose_votes():
+    rng = np.random.default_rng(0)
+    groups = rng.integers(0, 3, 300)
+    opinions = rng.choice([1, -1], size=(3, 1500))
+    noise = rng.choice([1, -1, 0], size=(300, 1500))
+    votes_matrix = np.where(rng.random((300, 1500)) < 0.7, opinions[groups], noise)
+    votes_matrix = np.where(rng.random((300, 1500)) < 0.9, np.nan, votes_matrix)
+
+    users, comments = np.nonzero(~np.isnan(votes_matrix))
+    sparse_matrix = sparse.csr_array(
+        (votes_matrix[users, comments], (users, comments)), shape=votes_matrix.shape
+    )
+
+    expected = decompose_votes(votes_matrix, solver="covariance_eigh")
+    for matrix in [votes_matrix, sparse_matrix]:
+        # wide conversations use the randomized solver by default
+        transformed = decompose_votes(matrix)
+        assert np.allclose(transformed, expected, atol=1e-3 * np.abs(expected).max())
@@ -0,0 +1,113 @@
+from time import perf_counter
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+from chorus_engine.math import StreamingKMeans, fit_kmeans
+
+
+def make_projections(num_users: int, num_groups: int, random_state: int):
+    """
+    Returns 2-D points shaped like vote projections: a few opinion groups of
+    different sizes and spreads.
+    """
+    rng = np.random.default_rng(random_state)
+    sizes = rng.multinomial(num_users, rng.dirichlet(np.ones(num_groups) * 5))
+    angles = 2 * np.pi * (np.arange(num_groups) + rng.uniform(0, 0.5)) / num_groups
+    centers = 4 * np.column_stack([np.cos(angles), np.sin(angles)])
+    spreads = rng.uniform(0.5, 1.2, num_groups)
+
+    points = np.vstack(
+        [
+            rng.normal(center, spread, (size, 2))
+            for center, spread, size in zip(centers, spreads, sizes)
+        ]
+    )
+    rng.shuffle(points)
+    return points
+
+
+def timed(func, *args, **kwargs):
+    start = perf_counter()
+    result = func(*args, **kwargs)
+    return result, perf_counter() - start
+
+
+def benchmark_clustering(
+    num_users: int,
+    n_clusters: int = 3,
+    n_init: int = 10,
+    stream_fraction: float = 0.1,
+    random_state: int = 42,
+):
+    reduced = make_projections(num_users, n_clusters, random_state)
+    kmeans, kmeans_time = timed(
+        fit_kmeans, reduced, n_clusters, random_state, n_init, method="kmeans"
+    )
+    minibatch, minibatch_time = timed(
+        fit_kmeans, reduced, n_clusters, random_state, n_init, method="minibatch"
+    )
+
+    # fit on the first users, then stream the rest in batches of 1000
+    num_initial = int(num_users * (1 - stream_fraction))
+    initial = fit_kmeans(reduced[:num_initial], n_clusters, random_state, n_init)
+    streaming = StreamingKMeans.from_kmeans(initial)
+    batches = np.array_split(
+        reduced[num_initial:], max(1, (num_users - num_initial) // 1000)
+    )
+    streamed, streaming_time = timed(
+        lambda: [streaming.partial_fit(batch) for batch in batches]
+    )
+    streaming_labels = np.concatenate([initial.labels_] + streamed)
+
+    return {
+        "num_users": num_users,
+        "kmeans_seconds": kmeans_time,
+        "minibatch_seconds": minibatch_time,
+        "minibatch_agreement": adjusted_rand_score(kmeans.labels_, minibatch.labels_),
+        "streaming_seconds": streaming_time,
+        "streaming_agreement": adjusted_rand_score(kmeans.labels_, streaming_labels),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Compare full, mini-batch and streaming k-means on synthetic projections."
+    )
+    parser.add_argument(
+        "--num_users",
+        type=int,
+        nargs="+",
+        default=[10_000, 100_000, 250_000, 1_000_000],
+        help="Numbers of users to benchmark.",
+    )
+    parser.add_argument(
+        "--n_init",
+        type=int,
+        default=10,
+        help="Number of k-means initializations (default: 10).",
+    )
+    parser.add_argument(
+        "--random_state",
+        type=int,
+        default=42,
+        help="Random state for reproducibility (default: 42).",
+    )
+
+    args = parser.parse_args()
+
+    print(
+        f"{'users':>10} {'kmeans (s)':>11} {'minibatch (s)':>14} {'ARI':>6}"
+        f" {'streaming (s)':>14} {'ARI':>6}"
+    )
+    for num_users in args.num_users:
+        result = benchmark_clustering(
+            num_users, n_init=args.n_init, random_state=args.random_state
+        )
+        print(
+            f"{result['num_users']:>10} {result['kmeans_seconds']:>11.3f}"
+            f" {result['minibatch_seconds']:>14.3f}"
+            f" {result['minibatch_agreement']:>6.3f}"
+            f" {result['streaming_seconds']:>14.3f}"
+            f" {result['streaming_agreement']:>6.3f}"
+        )
@@ -0,0 +1,52 @@
+"""unique user pca and cluster rows
+
+Revision ID: 3b9f2c1d8e47
+Revises: 1e8fa719ca11
+Create Date: 2026-10-18 17:30:12.481950
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9f2c1d8e47'
+down_revision: Union[str, None] = '1e8fa719ca11'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def deduplicate(table: str) -> None:
+    # keep only the most recently updated row for each (user, conversation)
+    op.execute(
+        f"""
+        DELETE FROM {table}
+        WHERE EXISTS (
+            SELECT 1 FROM {table} AS newer
+            WHERE newer.user_id = {table}.user_id
+            AND newer.conversation_id = {table}.conversation_id
+            AND (
+                newer.date_updated > {table}.date_updated
+                OR (
+                    newer.date_updated = {table}.date_updated
+                    AND newer.id > {table}.id
+                )
+            )
+        )
+        """
+    )
+
+
+def upgrade() -> None:
+    deduplicate('user_pca')
+    deduplicate('user_cluster')
+
+    op.create_unique_constraint('uq_user_pca_user_id_conversation_id', 'user_pca', ['user_id', 'conversation_id'])
+    op.create_unique_constraint('uq_user_cluster_user_id_conversation_id', 'user_cluster', ['user_id', 'conversation_id'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_user_cluster_user_id_conversation_id', 'user_cluster', type_='unique')
+    op.drop_constraint('uq_user_pca_user_id_conversation_id', 'user_pca', type_='unique')
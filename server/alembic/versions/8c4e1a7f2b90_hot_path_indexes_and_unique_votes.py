@@ -0,0 +1,54 @@
+"""hot path indexes and unique votes
+
+Revision ID: 8c4e1a7f2b90
+Revises: 3b9f2c1d8e47
+Create Date: 2026-10-18 18:02:44.193027
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c4e1a7f2b90'
+down_revision: Union[str, None] = '3b9f2c1d8e47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # keep only the most recent vote for each (comment, user)
+    op.execute(
+        """
+        DELETE FROM votes
+        WHERE EXISTS (
+            SELECT 1 FROM votes AS newer
+            WHERE newer.comment_id = votes.comment_id
+            AND newer.user_id = votes.user_id
+            AND (
+                newer.date_created > votes.date_created
+                OR (
+                    newer.date_created = votes.date_created
+                    AND newer.id > votes.id
+                )
+            )
+        )
+        """
+    )
+
+    # the unique key also covers lookups by comment_id alone
+    op.create_unique_constraint('uq_votes_comment_id_user_id', 'votes', ['comment_id', 'user_id'])
+    op.create_index(op.f('ix_votes_user_id'), 'votes', ['user_id'], unique=False)
+    op.create_index(op.f('ix_comments_conversation_id'), 'comments', ['conversation_id'], unique=False)
+    op.create_index(op.f('ix_user_pca_conversation_id'), 'user_pca', ['conversation_id'], unique=False)
+    op.create_index(op.f('ix_user_cluster_conversation_id'), 'user_cluster', ['conversation_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_user_cluster_conversation_id'), table_name='user_cluster')
+    op.drop_index(op.f('ix_user_pca_conversation_id'), table_name='user_pca')
+    op.drop_index(op.f('ix_comments_conversation_id'), table_name='comments')
+    op.drop_index(op.f('ix_votes_user_id'), table_name='votes')
+    op.drop_constraint('uq_votes_comment_id_user_id', 'votes', type_='unique')
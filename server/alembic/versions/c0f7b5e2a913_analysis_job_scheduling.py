@@ -0,0 +1,55 @@
+"""analysis job scheduling
+
+Revision ID: c0f7b5e2a913
+Revises: a61d3e9c5f28
+Create Date: 2026-10-18 19:21:37.058812
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c0f7b5e2a913'
+down_revision: Union[str, None] = 'a61d3e9c5f28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('analysis_jobs', sa.Column('trigger_count', sa.Integer(), server_default=sa.text('1'), nullable=False))
+    op.add_column('analysis_jobs', sa.Column('run_after', sa.DateTime(), nullable=True))
+    op.add_column('analysis_jobs', sa.Column('deadline', sa.DateTime(), nullable=True))
+
+    # keep the oldest pending job per conversation before enforcing uniqueness
+    op.execute(
+        """
+        DELETE FROM analysis_jobs
+        WHERE status = 'pending'
+        AND EXISTS (
+            SELECT 1 FROM analysis_jobs AS older
+            WHERE older.conversation_id = analysis_jobs.conversation_id
+            AND older.status = 'pending'
+            AND (
+                older.date_created < analysis_jobs.date_created
+                OR (
+                    older.date_created = analysis_jobs.date_created
+                    AND older.id < analysis_jobs.id
+                )
+            )
+        )
+        """
+    )
+
+    op.create_index('uq_analysis_jobs_pending_conversation_id', 'analysis_jobs', ['conversation_id'], unique=True, postgresql_where=sa.text("status = 'pending'"), sqlite_where=sa.text("status = 'pending'"))
+    op.create_index('uq_analysis_jobs_running_conversation_id', 'analysis_jobs', ['conversation_id'], unique=True, postgresql_where=sa.text("status = 'running'"), sqlite_where=sa.text("status = 'running'"))
+
+
+def downgrade() -> None:
+    op.drop_index('uq_analysis_jobs_running_conversation_id', table_name='analysis_jobs', postgresql_where=sa.text("status = 'running'"), sqlite_where=sa.text("status = 'running'"))
+    op.drop_index('uq_analysis_jobs_pending_conversation_id', table_name='analysis_jobs', postgresql_where=sa.text("status = 'pending'"), sqlite_where=sa.text("status = 'pending'"))
+    op.drop_column('analysis_jobs', 'deadline')
+    op.drop_column('analysis_jobs', 'run_after')
+    op.drop_column('analysis_jobs', 'trigger_count')
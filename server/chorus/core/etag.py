@@ -0,0 +1,53 @@
+import hashlib
+from uuid import UUID
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from chorus import models
+
+
+def get_data_version(db: Session, conversation_id: UUID) -> tuple[int, int] | None:
+    """
+    Reads the conversation's data version, bumped by writes to its comments or
+    analysis, and its vote version, the sum of its comments' vote counter
+    versions. Together they change on every write that can change what its
+    endpoints return.
+    """
+    vote_version = (
+        select(func.coalesce(func.sum(models.CommentVoteCount.version), 0))
+        .where(models.CommentVoteCount.conversation_id == conversation_id)
+        .scalar_subquery()
+    )
+    versions = db.execute(
+        select(models.Conversation.data_version, vote_version).where(
+            models.Conversation.id == conversation_id
+        )
+    ).first()
+    return None if versions is None else tuple(versions)
+
+
+def get_queue_version(db: Session, conversation_id: UUID) -> int | None:
+    """
+    Reads only the conversation's queue version, which is bumped when the set
+    of comments participants can see changes, but not by votes.
+    """
+    return db.scalar(
+        select(models.Conversation.queue_version).where(
+            models.Conversation.id == conversation_id
+        )
+    )
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha256(":".join(str(part) for part in parts).encode())
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    # If-None-Match uses the weak comparison function
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags
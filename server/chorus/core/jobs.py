@@ -0,0 +1,200 @@
+from datetime import datetime, timedelta, timezone
+from uuid import UUID, uuid4
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from chorus import models
+from chorus.core.routines import dialect_insert, update_conversation_analysis
+from chorus.models import AnalysisJob, JobStatus
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def enqueue_analysis(
+    db: Session,
+    conversation_id: UUID,
+    delay_seconds: float = 0,
+    max_staleness_seconds: float = 0,
+):
+    """
+    Adds a pending analysis job for the conversation, or coalesces into the one
+    that is already pending. Each trigger pushes the job back by delay_seconds,
+    but never past max_staleness_seconds after the first trigger. The caller is
+    responsible for committing.
+    """
+    now = utcnow()
+    run_after = now + timedelta(seconds=delay_seconds)
+    deadline = now + timedelta(seconds=max(delay_seconds, max_staleness_seconds))
+
+    stmt = dialect_insert(db)(AnalysisJob).values(
+        id=uuid4(),
+        conversation_id=conversation_id,
+        status=JobStatus.PENDING,
+        trigger_count=1,
+        run_after=run_after,
+        deadline=deadline,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["conversation_id"],
+        index_where=AnalysisJob.status == JobStatus.PENDING,
+        set_={
+            "trigger_count": AnalysisJob.trigger_count + 1,
+            "run_after": case(
+                (
+                    stmt.excluded.run_after < AnalysisJob.deadline,
+                    stmt.excluded.run_after,
+                ),
+                else_=AnalysisJob.deadline,
+            ),
+        },
+    )
+    db.execute(stmt)
+
+
+def claim_job(db: Session, job_id: UUID) -> bool:
+    # conditional update so that concurrent workers never claim the same job
+    try:
+        result = db.execute(
+            update(AnalysisJob)
+            .where(AnalysisJob.id == job_id, AnalysisJob.status == JobStatus.PENDING)
+            .values(status=JobStatus.RUNNING, date_started=utcnow())
+        )
+        db.commit()
+    except IntegrityError:
+        # another job for the same conversation is already running
+        db.rollback()
+        return False
+    return result.rowcount == 1
+
+
+def claim_next_job(
+    db: Session, conversation_id: UUID | None = None, due_only: bool = True
+):
+    query = select(AnalysisJob.id).where(AnalysisJob.status == JobStatus.PENDING)
+    if conversation_id is not None:
+        query = query.where(AnalysisJob.conversation_id == conversation_id)
+    if due_only:
+        query = query.where(AnalysisJob.run_after <= utcnow())
+    query = query.order_by(AnalysisJob.run_after)
+
+    for job_id in db.scalars(query).all():
+        if claim_job(db, job_id):
+            return db.get(AnalysisJob, job_id)
+
+    return None
+
+
+finished_statuses = [JobStatus.COMPLETED, JobStatus.FAILED]
+
+
+def get_job_totals(db: Session, conversation_id: UUID) -> tuple[int, int]:
+    """
+    Returns the numbers of triggers processed and computations run for the
+    conversation. The totals only grow, so the largest ones recorded on its
+    finished jobs are current, even if a stale job failed since.
+    """
+    totals = db.execute(
+        select(
+            func.coalesce(func.max(AnalysisJob.triggers_processed), 0),
+            func.coalesce(func.max(AnalysisJob.computations_run), 0),
+        ).where(
+            AnalysisJob.conversation_id == conversation_id,
+            AnalysisJob.status.in_(finished_statuses),
+        )
+    ).one()
+    return tuple(totals)
+
+
+def run_job(db: Session, job: AnalysisJob):
+    # only one job runs per conversation, so the totals cannot race
+    triggers_processed, computations_run = get_job_totals(db, job.conversation_id)
+    trigger_count = job.trigger_count
+
+    try:
+        conversation = db.get(models.Conversation, job.conversation_id)
+        update_conversation_analysis(conversation, db)
+        job.status = JobStatus.COMPLETED
+    except Exception as e:
+        db.rollback()
+        job.status = JobStatus.FAILED
+        job.error = str(e)
+
+    job.date_finished = utcnow()
+    job.triggers_processed = triggers_processed + trigger_count
+    job.computations_run = computations_run + 1
+
+    # only the latest completed and latest failed job per conversation are kept
+    db.execute(
+        delete(AnalysisJob).where(
+            AnalysisJob.conversation_id == job.conversation_id,
+            AnalysisJob.status == job.status,
+            AnalysisJob.id != job.id,
+        )
+    )
+    db.commit()
+
+
+def fail_stale_jobs(db: Session, timeout_seconds: float) -> int:
+    """
+    Marks jobs left running by a crashed worker as failed so that the
+    conversation can be analyzed again.
+    """
+    now = utcnow()
+    result = db.execute(
+        update(AnalysisJob)
+        .where(
+            AnalysisJob.status == JobStatus.RUNNING,
+            AnalysisJob.date_started < now - timedelta(seconds=timeout_seconds),
+        )
+        .values(status=JobStatus.FAILED, error="Timed out", date_finished=now)
+    )
+    db.commit()
+    return result.rowcount
+
+
+def get_analysis_status(db: Session, conversation_id: UUID):
+    """
+    Returns the status of the conversation's analysis (running or pending if
+    there is queued work, otherwise the outcome of the last job) and the time
+    the persisted results were computed.
+    """
+    jobs = db.execute(
+        select(AnalysisJob.status, AnalysisJob.date_finished).where(
+            AnalysisJob.conversation_id == conversation_id
+        )
+    ).all()
+    statuses = {status: date_finished for status, date_finished in jobs}
+
+    computed_at = statuses.get(JobStatus.COMPLETED)
+
+    for status in [
+        JobStatus.RUNNING,
+        JobStatus.PENDING,
+        JobStatus.FAILED,
+        JobStatus.COMPLETED,
+    ]:
+        if status in statuses:
+            return status, computed_at
+
+    return None, computed_at
+
+
+def get_analysis_stats(db: Session, conversation_id: UUID) -> dict:
+    """
+    Returns the conversation's trigger and computation counts. Triggers still
+    coalesced into a pending or running job count as received only.
+    """
+    triggers_processed, computations_run = get_job_totals(db, conversation_id)
+    triggers_queued = db.scalar(
+        select(func.coalesce(func.sum(AnalysisJob.trigger_count), 0)).where(
+            AnalysisJob.conversation_id == conversation_id,
+            AnalysisJob.status.in_([JobStatus.PENDING, JobStatus.RUNNING]),
+        )
+    )
+    return {
+        "triggers_received": triggers_processed + triggers_queued,
+        "triggers_processed": triggers_processed,
+        "computations_run": computations_run,
+    }
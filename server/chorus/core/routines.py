@@ -1,74 +1,550 @@
+from uuid import UUID, uuid4
+from sqlalchemy import (
+    case,
+    cast,
+    delete,
+    func,
+    literal_column,
+    select,
+    true,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
 from chorus import models
+from chorus.database import Base
+from chorus.settings import settings
 import numpy as np
-from chorus_engine import decompose_votes, cluster_users
+import scipy.sparse
+from chorus_engine.math import (
+    ClusterPrior,
+    CompactVotes,
+    VoteCounts,
+    decompose_votes,
+    get_comment_loadings,
+    get_cluster_candidates,
+    select_cluster_candidate,
+)
 
 
-def get_vote_matrix(conversation: models.Conversation):
-    comments = conversation.comments
+def get_vote_matrix(
+    conversation: models.Conversation,
+    db: Session,
+    sparse: bool = False,
+    compact: bool = False,
+):
+    # A single columnar query: one (comment_id, user_id, value) row per vote,
+    # plus a (comment_id, NULL, NULL) row for every comment without votes.
+    rows = db.execute(
+        select(models.Comment.id, models.Vote.user_id, models.Vote.value)
+        .outerjoin(models.Vote, models.Vote.comment_id == models.Comment.id)
+        .where(models.Comment.conversation_id == conversation.id)
+        .order_by(models.Comment.date_created, models.Comment.id)
+    ).all()
 
-    users = set()
-    for comment in comments:
-        for vote in comment.votes:
-            users.add(vote.user)
+    if rows:
+        comment_col, user_col, value_col = (
+            np.array(column, dtype=object) for column in zip(*rows)
+        )
+    else:
+        comment_col = user_col = value_col = np.empty(0, dtype=object)
+
+    voted = np.not_equal(user_col, None)
 
-    vote_matrix = np.full((len(users), len(comments)), fill_value=np.nan)
-    user_index = {user: i for i, user in enumerate(users)}
-    comment_index = {comment: i for i, comment in enumerate(comments)}
+    comment_ids, first_seen, comment_codes = np.unique(
+        comment_col, return_index=True, return_inverse=True
+    )
+    # np.unique sorts by id, columns keep the comments' creation order
+    order = np.argsort(first_seen)
+    comment_ids = comment_ids[order]
+    comment_codes = np.argsort(order)[comment_codes]
+    user_ids, user_codes = np.unique(user_col[voted], return_inverse=True)
 
-    for comment in comments:
-        for vote in comment.votes:
-            vote_matrix[user_index[vote.user], comment_index[comment]] = vote.value
+    rows_idx = user_codes
+    cols_idx = comment_codes[voted]
+    values = value_col[voted].astype(float)
+    shape = (len(user_ids), len(comment_ids))
+
+    if compact:
+        # int8 values and a bit-packed observed mask, about 9 bits per cell
+        vote_matrix = CompactVotes.from_triples(rows_idx, cols_idx, values, shape)
+    elif sparse:
+        vote_matrix = scipy.sparse.csr_array(
+            (values, (rows_idx, cols_idx)), shape=shape
+        )
+    else:
+        vote_matrix = np.full(shape, fill_value=np.nan)
+        vote_matrix[rows_idx, cols_idx] = values
+
+    user_index = {user_id: i for i, user_id in enumerate(user_ids)}
+    comment_index = {comment_id: i for i, comment_id in enumerate(comment_ids)}
 
     return vote_matrix, user_index, comment_index
 
 
+def get_vote_counts(conversation: models.Conversation, db: Session):
+    """
+    Returns the conversation's vote counts per (cluster, comment), aggregated
+    by the database, indexed like the rows and columns of `get_vote_matrix`.
+    Users without a cluster are labelled -1.
+    """
+    user_cluster = models.UserCluster.cluster
+    votes = (
+        select(models.Vote.user_id, models.Vote.comment_id, models.Vote.value)
+        .join(models.Comment, models.Comment.id == models.Vote.comment_id)
+        .where(models.Comment.conversation_id == conversation.id)
+        .subquery()
+    )
+    cluster_join = (models.UserCluster.user_id == votes.c.user_id) & (
+        models.UserCluster.conversation_id == conversation.id
+    )
+
+    comment_ids = db.scalars(
+        select(models.Comment.id)
+        .where(models.Comment.conversation_id == conversation.id)
+        .order_by(models.Comment.date_created, models.Comment.id)
+    ).all()
+    users = sorted(
+        db.execute(
+            select(votes.c.user_id, user_cluster)
+            .distinct()
+            .outerjoin(models.UserCluster, cluster_join)
+        ).all()
+    )
+    grouped = db.execute(
+        select(votes.c.comment_id, user_cluster, votes.c.value, func.count())
+        .outerjoin(models.UserCluster, cluster_join)
+        .group_by(votes.c.comment_id, user_cluster, votes.c.value)
+    ).all()
+
+    user_index = {user_id: i for i, (user_id, _) in enumerate(users)}
+    comment_index = {comment_id: i for i, comment_id in enumerate(comment_ids)}
+
+    cluster_labels = [-1 if cluster is None else cluster for _, cluster in users]
+    vote_counts = VoteCounts.empty(cluster_labels, len(comment_ids))
+    if grouped:
+        comment_col, cluster_col, value_col, count_col = zip(*grouped)
+        vote_counts.add_votes(
+            [-1 if cluster is None else cluster for cluster in cluster_col],
+            [comment_index[comment_id] for comment_id in comment_col],
+            value_col,
+            count_col,
+        )
+
+    return vote_counts, user_index, comment_index
+
+
+def dialect_insert(db: Session):
+    """
+    Returns the insert construct supporting ON CONFLICT for the bound database.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
+
+
+def upsert_rows(
+    db: Session,
+    model: type[Base],
+    rows: list[dict],
+    index_elements: list[str],
+    update_columns: list[str],
+):
+    if not rows:
+        return
+
+    stmt = dialect_insert(db)(model)
+    set_ = {column: stmt.excluded[column] for column in update_columns}
+    if "date_updated" in model.__table__.columns:
+        set_["date_updated"] = func.now()
+    stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=set_)
+
+    # executemany: one statement, batched by the driver
+    db.execute(stmt, rows)
+
+
+def bump_data_version(db: Session, conversation_id: UUID):
+    """
+    Marks the conversation's comments or analysis as changed, which
+    invalidates snapshots and ETags derived from its data version. Votes are
+    versioned per comment instead, so they never update the conversation row.
+    The caller is responsible for committing.
+    """
+    db.execute(
+        update(models.Conversation)
+        .where(models.Conversation.id == conversation_id)
+        .values(data_version=models.Conversation.data_version + 1)
+    )
+
+
+def bump_queue_version(db: Session, conversation_id: UUID):
+    """
+    Marks the conversation's comment queues as stale after a write that changes
+    which comments participants can see. The caller is responsible for
+    committing.
+    """
+    db.execute(
+        update(models.Conversation)
+        .where(models.Conversation.id == conversation_id)
+        .values(queue_version=models.Conversation.queue_version + 1)
+    )
+
+
+vote_count_columns = {1: "agree", -1: "disagree", 0: "skip"}
+
+
+def get_vote_count_deltas(value: int, previous: int | None = None) -> dict[str, int]:
+    """
+    Returns the changes to a comment's vote counts when a vote is cast with
+    `value`, or changed from its `previous` value.
+    """
+    deltas = dict.fromkeys(vote_count_columns.values(), 0)
+    if value in vote_count_columns:
+        deltas[vote_count_columns[value]] += 1
+    if previous in vote_count_columns:
+        deltas[vote_count_columns[previous]] -= 1
+    return deltas
+
+
+def increment_comment_vote_counts(db: Session, rows: list[dict]):
+    """
+    Adds the deltas of each row, keyed by `comment_id` and `conversation_id`,
+    to the comments' vote counts in one statement. Counter rows are created on
+    the first vote and updated in place, so concurrent votes do not overwrite
+    each other. The caller is responsible for committing.
+    """
+    rows = [
+        row
+        for row in rows
+        if any(row[column] for column in vote_count_columns.values())
+    ]
+    if not rows:
+        return
+
+    stmt = dialect_insert(db)(models.CommentVoteCount)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["comment_id"],
+        set_={
+            column: getattr(models.CommentVoteCount, column) + stmt.excluded[column]
+            for column in [*vote_count_columns.values(), "version"]
+        },
+    )
+    db.execute(stmt, [{**row, "version": 1} for row in rows])
+
+
+def lock_user_votes(db: Session, user_id: UUID):
+    """
+    Serializes the user's vote writes until the end of the transaction, so
+    that the previous votes read by the following statements include every
+    vote of the user committed by other transactions. Otherwise, under READ
+    COMMITTED, a concurrent vote committed after the statement's snapshot is
+    updated through ON CONFLICT but read as missing, and counted twice.
+    SQLite already serializes writing transactions.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        # FOR NO KEY UPDATE, which does not block foreign key checks on the user
+        db.execute(
+            select(models.User.id)
+            .where(models.User.id == user_id)
+            .with_for_update(key_share=True)
+        )
+
+
+def upsert_vote(db: Session, comment_id: UUID, user_id: UUID, value: int):
+    """
+    Adds or changes the user's vote on the comment if the comment exists and
+    its conversation allows votes, and counts it. Returns the vote's id and
+    the comment's conversation id, or None when nothing was written. The
+    caller is responsible for committing.
+    """
+    target = (
+        select(models.Comment.id, models.Comment.conversation_id)
+        .join(models.Conversation)
+        .where(models.Comment.id == comment_id, models.Conversation.allow_votes)
+        .cte("target")
+    )
+    previous = select(models.Vote.value).where(
+        models.Vote.comment_id == comment_id, models.Vote.user_id == user_id
+    )
+
+    stmt = dialect_insert(db)(models.Vote).from_select(
+        ["id", "comment_id", "user_id", "value"],
+        select(
+            # cast, as Postgres would infer untyped parameters to be text
+            cast(uuid4(), models.Vote.id.type),
+            target.c.id,
+            cast(user_id, models.Vote.user_id.type),
+            cast(value, models.Vote.value.type),
+        )
+        # without a WHERE clause, SQLite parses ON CONFLICT as a join constraint
+        .where(true()),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["comment_id", "user_id"],
+        set_={"value": stmt.excluded.value},
+    )
+    returning = [
+        models.Vote.id,
+        select(target.c.conversation_id).scalar_subquery(),
+    ]
+
+    lock_user_votes(db, user_id)
+    if db.get_bind().dialect.name == "postgresql":
+        # the CTE reads the vote before the upsert, and after any concurrent
+        # vote of the user has committed
+        previous = previous.cte("previous")
+        row = db.execute(
+            stmt.add_cte(target, previous).returning(
+                *returning, select(previous.c.value).scalar_subquery()
+            )
+        ).first()
+    else:
+        # SQLite evaluates CTEs lazily, after the upsert, so the previous vote
+        # is read first within the same transaction
+        previous_value = db.scalar(previous)
+        row = db.execute(stmt.add_cte(target).returning(*returning)).first()
+        if row is not None:
+            row = (*row, previous_value)
+
+    if row is None:
+        return None
+
+    vote_id, conversation_id, previous_value = row
+    increment_comment_vote_counts(
+        db,
+        [
+            {
+                "comment_id": comment_id,
+                "conversation_id": conversation_id,
+                **get_vote_count_deltas(value, previous_value),
+            }
+        ],
+    )
+    return vote_id, conversation_id
+
+
+def upsert_votes(
+    db: Session, conversation_id: UUID, user_id: UUID, values: dict[UUID, int]
+) -> dict[UUID, tuple[UUID, bool]]:
+    """
+    Adds or changes the user's votes on comments of the conversation, given
+    as a mapping from comment id to value, and counts them, in one statement
+    as with `upsert_vote`. The comments must belong to the conversation.
+    Returns, for each comment, the vote's id and whether it was created. The
+    caller is responsible for committing.
+    """
+    if not values:
+        return {}
+
+    previous = select(models.Vote.comment_id, models.Vote.value).where(
+        models.Vote.user_id == user_id, models.Vote.comment_id.in_(values)
+    )
+
+    stmt = dialect_insert(db)(models.Vote)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["comment_id", "user_id"],
+        set_={"value": stmt.excluded.value},
+    )
+    rows = [
+        {"id": uuid4(), "comment_id": comment_id, "user_id": user_id, "value": value}
+        for comment_id, value in values.items()
+    ]
+    returning = [models.Vote.id, models.Vote.comment_id]
+
+    lock_user_votes(db, user_id)
+    if db.get_bind().dialect.name == "postgresql":
+        # the CTE reads the votes before the upsert, and after any concurrent
+        # vote of the user has committed
+        previous = previous.cte("previous")
+        recorded = db.execute(
+            stmt.add_cte(previous).returning(
+                *returning,
+                # SQLAlchemy does not correlate subqueries in RETURNING, so
+                # the written row's column is named literally
+                select(previous.c.value)
+                .where(
+                    previous.c.comment_id
+                    == literal_column(f"{models.Vote.__tablename__}.comment_id")
+                )
+                .scalar_subquery(),
+            ),
+            rows,
+        ).all()
+    else:
+        previous_values = dict(db.execute(previous).all())
+        recorded = [
+            (vote_id, comment_id, previous_values.get(comment_id))
+            for vote_id, comment_id in db.execute(stmt.returning(*returning), rows)
+        ]
+
+    new_ids = {row["comment_id"]: row["id"] for row in rows}
+    increment_comment_vote_counts(
+        db,
+        [
+            {
+                "comment_id": comment_id,
+                "conversation_id": conversation_id,
+                **get_vote_count_deltas(values[comment_id], previous_value),
+            }
+            for _, comment_id, previous_value in recorded
+        ],
+    )
+    # an existing vote keeps its id on conflict
+    return {
+        comment_id: (vote_id, vote_id == new_ids[comment_id])
+        for vote_id, comment_id, _ in recorded
+    }
+
+
+def rebuild_comment_vote_counts(db: Session, conversation_id: UUID):
+    """
+    Recomputes the conversation's comment vote counts from its votes, after
+    bulk writes or to reconcile drift. The caller is responsible for committing.
+    """
+    # the rebuilt rows restart their versions, so the data version moves on
+    bump_data_version(db, conversation_id)
+    db.execute(
+        delete(models.CommentVoteCount).where(
+            models.CommentVoteCount.conversation_id == conversation_id
+        )
+    )
+
+    counts = db.execute(
+        select(
+            models.Vote.comment_id,
+            *(
+                func.sum(case((models.Vote.value == value, 1), else_=0)).label(column)
+                for value, column in vote_count_columns.items()
+            ),
+        )
+        .join(models.Comment, models.Comment.id == models.Vote.comment_id)
+        .where(models.Comment.conversation_id == conversation_id)
+        .group_by(models.Vote.comment_id)
+    ).all()
+
+    upsert_rows(
+        db,
+        models.CommentVoteCount,
+        [{"conversation_id": conversation_id, **row._asdict()} for row in counts],
+        index_elements=["comment_id"],
+        update_columns=list(vote_count_columns.values()),
+    )
+
+
+def get_cluster_priors(db: Session, conversation_id: UUID) -> dict[int, ClusterPrior]:
+    cluster_models = db.scalars(
+        select(models.ClusterModel).where(
+            models.ClusterModel.conversation_id == conversation_id
+        )
+    )
+    return {
+        cluster_model.n_clusters: ClusterPrior(
+            centroids=np.array(cluster_model.centroids),
+            inertia=cluster_model.inertia,
+            silhouette=cluster_model.silhouette,
+        )
+        for cluster_model in cluster_models
+    }
+
+
 def update_conversation_analysis(conversation: models.Conversation, db: Session):
-    vote_matrix, user_index, _ = get_vote_matrix(conversation)
+    vote_matrix, user_index, comment_index = get_vote_matrix(
+        conversation, db, sparse=True
+    )
     if min(vote_matrix.shape) < 2:
         return
 
-    pca = decompose_votes(vote_matrix)
-    if len(np.unique(vote_matrix)) <= 1:
+    pca = decompose_votes(vote_matrix, solver=settings.analysis_pca_solver)
+    loadings = get_comment_loadings(vote_matrix, pca)
+    # distinct vote values, counting missing votes as one more value
+    num_values = len(np.unique(vote_matrix.data)) + (
+        vote_matrix.nnz < np.prod(vote_matrix.shape)
+    )
+    if num_values <= 1:
         # Not enough diversity in votes to form clusters
-        cluster = None
+        candidates = {}
     else:
-        cluster = cluster_users(pca)
+        candidates = get_cluster_candidates(
+            pca,
+            priors=get_cluster_priors(db, conversation.id),
+            criterion=settings.analysis_cluster_criterion,
+            sample_size=settings.analysis_silhouette_sample_size,
+            init_batches=settings.analysis_cluster_init_batches,
+            n_jobs=settings.analysis_cluster_jobs,
+            method=settings.analysis_cluster_method,
+        )
+    best_candidate = select_cluster_candidate(candidates)
+    cluster = best_candidate.kmeans if best_candidate is not None else None
 
-    index_to_user = {i: user for user, i in user_index.items()}
+    user_ids = sorted(user_index, key=lambda uid: user_index[uid])
 
-    for i, pca_values in enumerate(pca):
-        user_pca = (
-            db.query(models.UserPca)
-            .filter(
-                models.UserPca.user == index_to_user[i],
-                models.UserPca.conversation == conversation,
-            )
-            .first()
-        )
-        if user_pca is None:
-            user_pca = models.UserPca(user=index_to_user[i], conversation=conversation)
-            db.add(user_pca)
-        user_pca.x, user_pca.y = pca_values.astype(float).tolist()
+    upsert_rows(
+        db,
+        models.UserPca,
+        [
+            {"user_id": user_id, "conversation_id": conversation.id, "x": x, "y": y}
+            for user_id, (x, y) in zip(user_ids, pca.astype(float).tolist())
+        ],
+        index_elements=["user_id", "conversation_id"],
+        update_columns=["x", "y"],
+    )
 
-    if cluster is None:
-        db.commit()
-        return
+    comment_ids = sorted(comment_index, key=lambda cid: comment_index[cid])
 
-    for i, label in enumerate(cluster.labels_):
-        user_cluster = (
-            db.query(models.UserCluster)
-            .filter(
-                models.UserCluster.user == index_to_user[i],
-                models.UserCluster.conversation == conversation,
-            )
-            .first()
+    # cached for comment routing
+    upsert_rows(
+        db,
+        models.CommentPca,
+        [
+            {
+                "comment_id": comment_id,
+                "conversation_id": conversation.id,
+                "x": x,
+                "y": y,
+            }
+            for comment_id, (x, y) in zip(comment_ids, loadings.astype(float).tolist())
+        ],
+        index_elements=["comment_id"],
+        update_columns=["x", "y"],
+    )
+
+    if cluster is not None:
+        upsert_rows(
+            db,
+            models.UserCluster,
+            [
+                {
+                    "user_id": user_id,
+                    "conversation_id": conversation.id,
+                    "cluster": label,
+                }
+                for user_id, label in zip(user_ids, cluster.labels_.tolist())
+            ],
+            index_elements=["user_id", "conversation_id"],
+            update_columns=["cluster"],
         )
-        if user_cluster is None:
-            user_cluster = models.UserCluster(
-                user=index_to_user[i], conversation=conversation
-            )
-            db.add(user_cluster)
-        user_cluster.cluster = int(label)
 
+    # keep the fitted centroids to warm-start the next refresh, with the
+    # scores of the last full search to compare it against
+    priors = {
+        n_clusters: candidate.prior for n_clusters, candidate in candidates.items()
+    }
+    upsert_rows(
+        db,
+        models.ClusterModel,
+        [
+            {
+                "conversation_id": conversation.id,
+                "n_clusters": n_clusters,
+                "centroids": prior.centroids.tolist(),
+                "inertia": float(prior.inertia),
+                "silhouette": float(prior.silhouette),
+            }
+            for n_clusters, prior in priors.items()
+        ],
+        index_elements=["conversation_id", "n_clusters"],
+        update_columns=["centroids", "inertia", "silhouette"],
+    )
+
+    bump_data_version(db, conversation.id)
     db.commit()
@@ -0,0 +1,72 @@
+from math import log
+import numpy as np
+from sqlalchemy import Integer, func
+from chorus_engine.math import get_top_k_indices
+
+
+def get_comment_priorities(
+    agree: np.ndarray,
+    disagree: np.ndarray,
+    skip: np.ndarray,
+    extremity: np.ndarray,
+    exp=np.exp,
+) -> np.ndarray:
+    """
+    Scores comments by how much one more vote is expected to tell about the
+    opinion groups, following the comment routing of Polis. Comments that are
+    rarely skipped, often agreed with and load strongly on the principal axes
+    (high extremity) separate groups best; comments with few votes get a
+    novelty boost that halves every 5 votes, so that new comments quickly
+    collect enough votes to be placed at all.
+
+    With exp=func.exp, the same score is built as an SQL expression of count
+    and loading columns, so that comments can be ordered by the database.
+    """
+    total = agree + disagree + skip
+    agree_rate = (1.0 + agree) / (2.0 + total)
+    skip_rate = (1.0 + skip) / (2.0 + total)
+
+    importance = (1 - skip_rate) * (1 + extremity) * agree_rate
+    # 2 ** (-total / 5), written with exp, which SQL databases all provide
+    novelty = 1 + 8 * exp(total * (-log(2) / 5))
+    priority = importance * novelty
+    return priority * priority
+
+
+def route_comments(
+    priorities: np.ndarray,
+    limit: int | None = None,
+    random_state: int | np.random.Generator | None = None,
+) -> np.ndarray:
+    """
+    Returns the indices of the comments to serve, in order: a random
+    permutation in which every next comment is drawn with probability
+    proportional to its priority (Efraimidis & Spirakis, 2006). Drawing rather
+    than sorting spreads concurrent participants over the top comments instead
+    of sending all of them to the same one.
+    """
+    rng = np.random.default_rng(random_state)
+    # log(u) / w orders like u^(1 / w) without underflowing for small weights
+    keys = np.log(rng.random(len(priorities))) / np.maximum(priorities, 1e-300)
+    return get_top_k_indices(keys, limit)
+
+
+def get_random_uniform(dialect_name: str):
+    """
+    Returns an SQL expression drawing a number uniformly from (0, 1] for every
+    row, so that its logarithm is always defined.
+    """
+    if dialect_name == "postgresql":
+        return 1 - func.random()
+    # SQLite's random() returns a signed 64-bit integer, reduced to 52 bits so
+    # that the quotient is exact in double precision
+    return (func.abs(func.random(type_=Integer) % 2**52) + 1) / float(2**52 + 1)
+
+
+def get_routing_key(priority, dialect_name: str):
+    """
+    Returns the SQL expression of the Efraimidis-Spirakis keys drawn by
+    `route_comments`, so that ordering by it in descending order and limiting
+    the query selects the routed comments in one statement.
+    """
+    return func.ln(get_random_uniform(dialect_name)) / priority
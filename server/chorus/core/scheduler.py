@@ -0,0 +1,74 @@
+from uuid import UUID
+from sqlalchemy.orm import Session
+from chorus.core.jobs import (
+    claim_next_job,
+    enqueue_analysis,
+    get_analysis_stats,
+    run_job,
+)
+from chorus.settings import settings
+
+
+class AnalysisScheduler:
+    """
+    Coalesces analysis triggers for each conversation into a single pending job.
+
+    A trigger delays the job by window_seconds, so a burst of votes results in
+    one computation once the burst settles, but a job is never delayed more
+    than max_staleness_seconds after its first trigger. At most one job runs
+    per conversation at a time.
+    """
+
+    def __init__(self, window_seconds: float, max_staleness_seconds: float):
+        self.window_seconds = window_seconds
+        self.max_staleness_seconds = max_staleness_seconds
+
+    def trigger(self, db: Session, conversation_id: UUID):
+        """
+        Schedules a debounced refresh. The caller is responsible for committing.
+        """
+        enqueue_analysis(
+            db, conversation_id, self.window_seconds, self.max_staleness_seconds
+        )
+
+    def trigger_and_commit(self, db: Session, conversation_id: UUID):
+        """
+        Schedules a debounced refresh in its own short transaction, once the
+        caller has committed its writes. Concurrent votes then hold the lock on
+        the pending job's row for this one statement rather than for their
+        whole transaction.
+        """
+        self.trigger(db, conversation_id)
+        db.commit()
+
+    def refresh(self, db: Session, conversation_id: UUID):
+        """
+        Schedules an immediate refresh, run by the worker on its next poll.
+        """
+        enqueue_analysis(db, conversation_id)
+        db.commit()
+
+    def run_pending(
+        self,
+        db: Session,
+        conversation_id: UUID | None = None,
+        due_only: bool = True,
+    ) -> int:
+        num_jobs = 0
+        while (job := claim_next_job(db, conversation_id, due_only)) is not None:
+            run_job(db, job)
+            num_jobs += 1
+
+        return num_jobs
+
+    def stats(self, db: Session, conversation_id: UUID) -> dict:
+        """
+        Reads the conversation's counters from the job table, so that they
+        cover triggers from every API process and jobs from every worker.
+        """
+        return get_analysis_stats(db, conversation_id)
+
+
+scheduler = AnalysisScheduler(
+    settings.analysis_debounce_seconds, settings.analysis_max_staleness_seconds
+)
@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from chorus.routers import (
@@ -11,9 +12,20 @@ from chorus.routers import (
 from chorus.settings import settings
 from chorus.database import db
 from chorus.models import *
+from chorus.worker import start_background_worker
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # without a separate worker, analysis jobs run on a background thread,
+    # never inside requests
+    stop = None if settings.analysis_worker else start_background_worker()
+    yield
+    if stop is not None:
+        stop.set()
+
+
+app = FastAPI(lifespan=lifespan)
 
 allowed_origins = [settings.client_origin]
 
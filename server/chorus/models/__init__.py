@@ -1,2 +1,3 @@
 from .conversations import *
 from .users import *
+from .jobs import *
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional
 from uuid import uuid4, UUID
-from sqlalchemy import String, ForeignKey, func
+from sqlalchemy import JSON, String, ForeignKey, UniqueConstraint, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from chorus.database import Base
 
@@ -27,6 +27,11 @@ class Conversation(Base):
     header_name: Mapped[Optional[str]] = mapped_column(String(200), nullable=True)
     knowledge_base_content: Mapped[Optional[str]] = mapped_column(nullable=True)
 
+    # bumped by every write that changes what the conversation's reports show
+    data_version: Mapped[int] = mapped_column(default=0, server_default="0")
+    # bumped by every write that changes which comments participants can see
+    queue_version: Mapped[int] = mapped_column(default=0, server_default="0")
+
     author = relationship("User")
     comments = relationship("Comment", backref="conversation")
     pcas = relationship("UserPca", backref="conversation")
@@ -37,7 +42,9 @@ class Comment(Base):
     __tablename__ = "comments"
 
     id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
-    conversation_id: Mapped[UUID] = mapped_column(ForeignKey("conversations.id"))
+    conversation_id: Mapped[UUID] = mapped_column(
+        ForeignKey("conversations.id"), index=True
+    )
     user_id: Mapped[UUID] = mapped_column(ForeignKey("users.id"))
     content: Mapped[str] = mapped_column()
     approved: Mapped[bool] = mapped_column(nullable=True)
@@ -49,22 +56,49 @@ class Comment(Base):
 
 class Vote(Base):
     __tablename__ = "votes"
+    __table_args__ = (
+        # also serves lookups by comment_id alone
+        UniqueConstraint("comment_id", "user_id", name="uq_votes_comment_id_user_id"),
+    )
 
     id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
     comment_id: Mapped[UUID] = mapped_column(ForeignKey("comments.id"))
-    user_id: Mapped[UUID] = mapped_column(ForeignKey("users.id"))
+    user_id: Mapped[UUID] = mapped_column(ForeignKey("users.id"), index=True)
     value: Mapped[int] = mapped_column()
     date_created: Mapped[datetime] = mapped_column(server_default=func.now())
 
     user = relationship("User")
 
 
+# per-comment vote totals, maintained on every vote and rebuilt from votes
+class CommentVoteCount(Base):
+    __tablename__ = "comment_vote_counts"
+
+    id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
+    comment_id: Mapped[UUID] = mapped_column(ForeignKey("comments.id"), unique=True)
+    conversation_id: Mapped[UUID] = mapped_column(
+        ForeignKey("conversations.id"), index=True
+    )
+    agree: Mapped[int] = mapped_column(default=0, server_default="0")
+    disagree: Mapped[int] = mapped_column(default=0, server_default="0")
+    skip: Mapped[int] = mapped_column(default=0, server_default="0")
+    # bumped by every counted vote, summed into the conversation's vote version
+    version: Mapped[int] = mapped_column(default=0, server_default="0")
+
+
 class UserPca(Base):
     __tablename__ = "user_pca"
+    __table_args__ = (
+        UniqueConstraint(
+            "user_id", "conversation_id", name="uq_user_pca_user_id_conversation_id"
+        ),
+    )
 
     id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
     user_id: Mapped[UUID] = mapped_column(ForeignKey("users.id"))
-    conversation_id: Mapped[UUID] = mapped_column(ForeignKey("conversations.id"))
+    conversation_id: Mapped[UUID] = mapped_column(
+        ForeignKey("conversations.id"), index=True
+    )
     x: Mapped[float] = mapped_column()
     y: Mapped[float] = mapped_column()
     date_updated: Mapped[datetime] = mapped_column(server_default=func.now())
@@ -72,13 +106,91 @@ class UserPca(Base):
     user = relationship("User")
 
 
+# loadings of each comment on the principal axes of the user projections
+class CommentPca(Base):
+    __tablename__ = "comment_pca"
+
+    id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
+    comment_id: Mapped[UUID] = mapped_column(ForeignKey("comments.id"), unique=True)
+    conversation_id: Mapped[UUID] = mapped_column(
+        ForeignKey("conversations.id"), index=True
+    )
+    x: Mapped[float] = mapped_column()
+    y: Mapped[float] = mapped_column()
+    date_updated: Mapped[datetime] = mapped_column(server_default=func.now())
+
+
 class UserCluster(Base):
     __tablename__ = "user_cluster"
+    __table_args__ = (
+        UniqueConstraint(
+            "user_id",
+            "conversation_id",
+            name="uq_user_cluster_user_id_conversation_id",
+        ),
+    )
 
     id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
     user_id: Mapped[UUID] = mapped_column(ForeignKey("users.id"))
-    conversation_id: Mapped[UUID] = mapped_column(ForeignKey("conversations.id"))
+    conversation_id: Mapped[UUID] = mapped_column(
+        ForeignKey("conversations.id"), index=True
+    )
     cluster: Mapped[int] = mapped_column()
     date_updated: Mapped[datetime] = mapped_column(server_default=func.now())
 
     user = relationship("User")
+
+
+class ClusterModel(Base):
+    __tablename__ = "cluster_models"
+    __table_args__ = (
+        UniqueConstraint(
+            "conversation_id",
+            "n_clusters",
+            name="uq_cluster_models_conversation_id_n_clusters",
+        ),
+    )
+
+    id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
+    conversation_id: Mapped[UUID] = mapped_column(ForeignKey("conversations.id"))
+    n_clusters: Mapped[int] = mapped_column()
+    centroids: Mapped[list] = mapped_column(JSON)
+    # scores of the last full k-means search, which warm starts are compared to
+    inertia: Mapped[float] = mapped_column()
+    silhouette: Mapped[float] = mapped_column()
+    date_updated: Mapped[datetime] = mapped_column(server_default=func.now())
+
+
+# the comments a participant has left to vote on, in the order they are served
+class CommentQueue(Base):
+    __tablename__ = "comment_queues"
+    __table_args__ = (
+        UniqueConstraint(
+            "user_id",
+            "conversation_id",
+            name="uq_comment_queues_user_id_conversation_id",
+        ),
+    )
+
+    id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
+    user_id: Mapped[UUID] = mapped_column(ForeignKey("users.id"))
+    conversation_id: Mapped[UUID] = mapped_column(
+        ForeignKey("conversations.id"), index=True
+    )
+    queue_version: Mapped[int] = mapped_column()
+    comment_ids: Mapped[list] = mapped_column(JSON)
+    date_updated: Mapped[datetime] = mapped_column(server_default=func.now())
+
+
+class AnalysisSnapshot(Base):
+    __tablename__ = "analysis_snapshots"
+
+    id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
+    conversation_id: Mapped[UUID] = mapped_column(
+        ForeignKey("conversations.id"), unique=True
+    )
+    data_version: Mapped[int] = mapped_column()
+    vote_version: Mapped[int] = mapped_column(default=0, server_default="0")
+    num_representative_comments: Mapped[Optional[int]] = mapped_column(nullable=True)
+    payload: Mapped[dict] = mapped_column(JSON)
+    date_updated: Mapped[datetime] = mapped_column(server_default=func.now())
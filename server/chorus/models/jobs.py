@@ -0,0 +1,51 @@
+from datetime import datetime
+from enum import StrEnum
+from typing import Optional
+from uuid import uuid4, UUID
+from sqlalchemy import Index, String, ForeignKey, func, text
+from sqlalchemy.orm import Mapped, mapped_column
+from chorus.database import Base
+
+
+class JobStatus(StrEnum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+def one_job_per_conversation(status: JobStatus) -> Index:
+    where = text(f"status = '{status}'")
+    return Index(
+        f"uq_analysis_jobs_{status}_conversation_id",
+        "conversation_id",
+        unique=True,
+        postgresql_where=where,
+        sqlite_where=where,
+    )
+
+
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+    __table_args__ = (
+        # triggers coalesce into the pending job, and at most one job runs at a time
+        one_job_per_conversation(JobStatus.PENDING),
+        one_job_per_conversation(JobStatus.RUNNING),
+    )
+
+    id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
+    conversation_id: Mapped[UUID] = mapped_column(
+        ForeignKey("conversations.id"), index=True
+    )
+    status: Mapped[str] = mapped_column(String(20), default=JobStatus.PENDING)
+    error: Mapped[Optional[str]] = mapped_column(nullable=True)
+    trigger_count: Mapped[int] = mapped_column(default=1)
+    # running totals for the conversation, carried over from the previous
+    # finished job, which is deleted once this one finishes
+    triggers_processed: Mapped[int] = mapped_column(default=0, server_default="0")
+    computations_run: Mapped[int] = mapped_column(default=0, server_default="0")
+    run_after: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    deadline: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    date_created: Mapped[datetime] = mapped_column(server_default=func.now())
+    date_started: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    date_finished: Mapped[Optional[datetime]] = mapped_column(nullable=True)
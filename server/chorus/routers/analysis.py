@@ -1,17 +1,23 @@
 from dataclasses import dataclass
+from datetime import datetime
 from typing import Annotated
 from uuid import UUID
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 from chorus import models
 from chorus.auth.user import CurrentUser
+from chorus.core.etag import etag_matches, get_data_version, make_etag
 from chorus.database import Database
 from pydantic import BaseModel
+from sqlalchemy import select
 import numpy as np
 from chorus_engine.math import (
-    get_comment_consensus,
-    get_group_comment_representativeness,
+    CommentStatistics,
+    VoteCounts,
+    get_top_k_indices,
 )
-from chorus.core.routines import get_vote_matrix, update_conversation_analysis
+from chorus.core.jobs import get_analysis_status
+from chorus.core.scheduler import scheduler
+from chorus.core.routines import get_vote_counts, upsert_rows
 
 
 router = APIRouter(prefix="/analysis")
@@ -56,7 +62,7 @@ class ConversationAnalysisRawData:
     conversation_id: UUID
     comment_ids: list[UUID]
     user_ids: list[UUID]
-    vote_matrix: np.ndarray
+    vote_counts: VoteCounts
     cluster_labels: np.ndarray | None = None
 
 
@@ -93,28 +99,8 @@ class ConversationAnalysisResponse(BaseModel):
     comments_by_consensus: list[CommentAnalysisResponse] | None = None
     groups: list[GroupAnalysisResponse] | None = None
 
-
-def get_comment_vote_probabilities(votes: np.ndarray):
-    total_votes = np.sum(~np.isnan(votes))
-    if total_votes == 0:
-        return CommentVoteProbabilities(agree=0.0, disagree=0.0, skip=0.0)
-
-    agree = np.sum(votes == 1)
-    disagree = np.sum(votes == -1)
-    skip = np.sum(votes == 0)
-
-    return CommentVoteProbabilities(
-        agree=agree / total_votes,
-        disagree=disagree / total_votes,
-        skip=skip / total_votes,
-    )
-
-
-def calculate_participation_rate(votes: np.ndarray):
-    total_votes = np.sum(~np.isnan(votes))
-    if votes.size == 0:
-        return 0.0
-    return total_votes / votes.size
+    job_status: str | None = None
+    computed_at: datetime | None = None
 
 
 def get_cluster_labels(
@@ -124,20 +110,17 @@ def get_cluster_labels(
     if user_clusters is None:
         return None
 
-    cluster_map = {cluster.user.id: cluster.cluster for cluster in user_clusters}
+    cluster_map = {cluster.user_id: cluster.cluster for cluster in user_clusters}
     return np.array([cluster_map.get(user_id, -1) for user_id in user_ids])
 
 
 def get_conversation_analysis_raw_data(
     db: Database, conversation: models.Conversation
 ) -> ConversationAnalysisRawData:
-    vote_matrix, user_idx, comment_idx = get_vote_matrix(conversation)
+    vote_counts, user_idx, comment_idx = get_vote_counts(conversation, db)
 
-    users = sorted(user_idx, key=lambda uid: user_idx[uid])
-    comments = sorted(comment_idx.keys(), key=lambda cid: comment_idx[cid])
-
-    user_ids = [user.id for user in users]
-    comment_ids = [comment.id for comment in comments]
+    user_ids = sorted(user_idx, key=lambda uid: user_idx[uid])
+    comment_ids = sorted(comment_idx, key=lambda cid: comment_idx[cid])
 
     cluster_labels = get_cluster_labels(db, conversation, user_ids)
 
@@ -145,7 +128,7 @@ def get_conversation_analysis_raw_data(
         conversation_id=conversation.id,
         comment_ids=comment_ids,
         user_ids=user_ids,
-        vote_matrix=vote_matrix,
+        vote_counts=vote_counts,
         cluster_labels=cluster_labels,
     )
 
@@ -175,66 +158,46 @@ def get_conversation_groups(db: Database, raw_data: ConversationAnalysisRawData)
     ]
 
 
-def get_comment_analysis(
-    db: Database,
-    comment: models.Comment,
-    raw_data: ConversationAnalysisRawData,
-):
-    if comment.id not in raw_data.comment_ids:
-        raise ValueError("Comment ID not found in raw data")
-
-    comment_idx = raw_data.comment_ids.index(comment.id)
-    votes = raw_data.vote_matrix[:, comment_idx]
-
-    consensus = get_comment_consensus(votes, raw_data.cluster_labels)
-    if np.isnan(consensus):
-        consensus = 0.0
-    if consensus is None:
-        consensus = 0.0
-    participation_rate = calculate_participation_rate(votes)
-    vote_probabilities = get_comment_vote_probabilities(votes)
-
-    representativeness = []
-    if raw_data.cluster_labels is not None:
-        unique_clusters = set(raw_data.cluster_labels)
-        for cluster_id in unique_clusters:
-            if cluster_id == -1:
-                continue
-            rep = get_group_comment_representativeness(
-                votes, raw_data.cluster_labels, cluster_id
-            )
-            representativeness.append(
-                CommentRepresentativeness(
-                    group_id=int(cluster_id), representativeness=rep
-                )
-            )
-
-    return CommentAnalysis(
-        comment_id=comment.id,
-        content=comment.content,
-        total_votes=int(np.sum(~np.isnan(votes))),
-        consensus=float(consensus),
-        participation_rate=participation_rate,
-        vote_probabilities=vote_probabilities,
-        representativeness=representativeness,
-    )
-
-
 def get_conversation_comments(
     db: Database,
     conversation: models.Conversation,
     raw_data: ConversationAnalysisRawData,
+    statistics: CommentStatistics,
 ) -> list[CommentAnalysis]:
     comments = conversation.comments
     comment_map = {comment.id: comment for comment in comments}
 
+    # vote probabilities are zero for comments without votes
+    total_votes = np.maximum(statistics.total, 1)
+    agree = (statistics.agree / total_votes).tolist()
+    disagree = (statistics.disagree / total_votes).tolist()
+    skip = (statistics.skip / total_votes).tolist()
+
+    consensus = np.nan_to_num(statistics.consensus).tolist()
+    participation = statistics.participation.tolist()
+    group_ids = statistics.clusters.tolist()
+    representativeness = statistics.representativeness.T.tolist()
+
     comment_analyses = []
     for idx, comment_id in enumerate(raw_data.comment_ids):
         comment = comment_map.get(comment_id)
         if comment is None:
             continue
 
-        comment_analysis = get_comment_analysis(db, comment, raw_data)
+        comment_analysis = CommentAnalysis(
+            comment_id=comment.id,
+            content=comment.content,
+            total_votes=int(statistics.total[idx]),
+            consensus=consensus[idx],
+            participation_rate=participation[idx],
+            vote_probabilities=CommentVoteProbabilities(
+                agree=agree[idx], disagree=disagree[idx], skip=skip[idx]
+            ),
+            representativeness=[
+                CommentRepresentativeness(group_id=group_id, representativeness=rep)
+                for group_id, rep in zip(group_ids, representativeness[idx])
+            ],
+        )
         comment_analyses.append(comment_analysis)
 
     return comment_analyses
@@ -253,10 +216,34 @@ def refresh_conversation_analysis(
             status_code=403, detail="Not authorized to refresh this conversation"
         )
 
-    update_conversation_analysis(conversation, db)
+    scheduler.refresh(db, conversation.id)
     return {"status": "completed"}
 
 
+class AnalysisStats(BaseModel):
+    triggers_received: int
+    triggers_processed: int
+    computations_run: int
+
+
+@router.get("/conversation/{conversation_id}/stats", response_model=AnalysisStats)
+def read_analysis_stats(conversation_id: UUID, current_user: CurrentUser, db: Database):
+    """
+    Reports how many analysis triggers were coalesced into how many
+    computations, across all API processes and workers.
+    """
+    conversation = db.get(models.Conversation, conversation_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    if conversation.author_id != current_user.id:
+        raise HTTPException(
+            status_code=403, detail="Not authorized to access this conversation"
+        )
+
+    return scheduler.stats(db, conversation.id)
+
+
 def process_comment_analyses_by_consensus(
     comments: list[CommentAnalysis],
 ) -> list[CommentAnalysisResponse]:
@@ -276,6 +263,8 @@ def process_group_representative_comments(
     group: GroupAnalysis,
     comments: list[CommentAnalysis],
     raw_data: ConversationAnalysisRawData,
+    statistics: CommentStatistics,
+    num_representative_comments: int | None = None,
 ) -> list[GroupCommentRepresentativeness]:
     if not comments or group.group_id is None:
         return []
@@ -283,56 +272,45 @@ def process_group_representative_comments(
     if raw_data.cluster_labels is None:
         return []
 
-    representative_comments = []
-    for comment in comments:
-        for rep in comment.representativeness:
-            if rep.group_id == group.group_id:
-                comment_id_to_idx = {
-                    cid: idx for idx, cid in enumerate(raw_data.comment_ids)
-                }
-                user_indices = [
-                    i
-                    for i, cluster_id in enumerate(raw_data.cluster_labels)
-                    if cluster_id == group.group_id
-                ]
-
-                agree_percentage = None
-                if comment.comment_id in comment_id_to_idx:
-                    comment_idx = comment_id_to_idx[comment.comment_id]
-                    votes = raw_data.vote_matrix[user_indices, comment_idx]
-                    total_votes = len(votes)
-                    agree_votes = np.sum(votes == 1)
-                    agree_percentage = (
-                        agree_votes / total_votes if total_votes > 0 else None
-                    )
-
-                representative_comments.append(
-                    GroupCommentRepresentativeness(
-                        group_id=group.group_id,
-                        comment_id=comment.comment_id,
-                        content=comment.content,
-                        agree_percentage=agree_percentage,
-                        representativeness=rep.representativeness,
-                    )
-                )
-
-    representative_comments.sort(
-        key=lambda x: (x.representativeness is not None, x.representativeness),
-        reverse=True,
+    cluster_idx = np.flatnonzero(statistics.clusters == group.group_id)
+    if len(cluster_idx) == 0:
+        return []
+    cluster_idx = cluster_idx[0]
+
+    comment_id_to_idx = {cid: idx for idx, cid in enumerate(raw_data.comment_ids)}
+    comment_indices = [comment_id_to_idx[comment.comment_id] for comment in comments]
+
+    representativeness = statistics.representativeness[cluster_idx, comment_indices]
+    group_size = statistics.cluster_sizes[cluster_idx]
+    agree_percentages = (
+        statistics.cluster_agree[cluster_idx, comment_indices] / group_size
+        if group_size > 0
+        else np.full(len(comments), None)
     )
 
-    return representative_comments
+    return [
+        GroupCommentRepresentativeness(
+            group_id=group.group_id,
+            comment_id=comments[idx].comment_id,
+            content=comments[idx].content,
+            agree_percentage=agree_percentages[idx],
+            representativeness=representativeness[idx],
+        )
+        for idx in get_top_k_indices(representativeness, num_representative_comments)
+    ]
 
 
 def process_analysis_response(
     analysis: ConversationAnalysis,
     raw_data: ConversationAnalysisRawData,
+    statistics: CommentStatistics,
     params: dict = {},
 ) -> ConversationAnalysisResponse:
     comments_by_consensus = None
     if analysis.comments is not None:
         comments_by_consensus = process_comment_analyses_by_consensus(analysis.comments)
 
+    num_representative_comments = params.get("num_representative_comments", 3)
     processed_groups = [
         GroupAnalysisResponse.model_validate(group, from_attributes=True)
         for group in (analysis.groups or [])
@@ -340,18 +318,14 @@ def process_analysis_response(
     if analysis.groups is not None and analysis.comments is not None:
         for idx, group in enumerate(analysis.groups):
             representative_comments = process_group_representative_comments(
-                group, analysis.comments, raw_data
+                group,
+                analysis.comments,
+                raw_data,
+                statistics,
+                num_representative_comments,
             )
             processed_groups[idx].representative_comments = representative_comments
 
-    num_representative_comments = params.get("num_representative_comments", 3)
-    if num_representative_comments is not None:
-        for idx, group in enumerate(processed_groups):
-            if group.representative_comments is not None:
-                processed_groups[idx].representative_comments = (
-                    group.representative_comments[:num_representative_comments]
-                )
-
     # increment group ID by 1 for frontend compatibility
     for idx, group in enumerate(processed_groups):
         processed_groups[idx].group_id = group.group_id + 1
@@ -365,6 +339,82 @@ def process_analysis_response(
     )
 
 
+def compute_analysis_response(
+    db: Database,
+    conversation: models.Conversation,
+    num_representative_comments: int | None,
+) -> ConversationAnalysisResponse:
+    raw_data = get_conversation_analysis_raw_data(db, conversation)
+    statistics = raw_data.vote_counts.statistics()
+    comments = get_conversation_comments(db, conversation, raw_data, statistics)
+    groups = get_conversation_groups(db, raw_data)
+
+    analysis = ConversationAnalysis(
+        conversation_id=conversation.id,
+        comment_ids=raw_data.comment_ids,
+        user_ids=raw_data.user_ids,
+        comments=comments,
+        groups=groups,
+    )
+
+    params = {"num_representative_comments": num_representative_comments}
+
+    return process_analysis_response(analysis, raw_data, statistics, params)
+
+
+def get_analysis_snapshot(
+    db: Database,
+    conversation_id: UUID,
+    data_version: tuple[int, int],
+    num_representative_comments: int | None,
+) -> ConversationAnalysisResponse | None:
+    snapshot = db.scalars(
+        select(models.AnalysisSnapshot).where(
+            models.AnalysisSnapshot.conversation_id == conversation_id
+        )
+    ).first()
+
+    if (
+        snapshot is None
+        or (snapshot.data_version, snapshot.vote_version) != data_version
+        or snapshot.num_representative_comments != num_representative_comments
+    ):
+        return None
+
+    return ConversationAnalysisResponse.model_validate(snapshot.payload)
+
+
+def save_analysis_snapshot(
+    db: Database,
+    conversation_id: UUID,
+    data_version: tuple[int, int],
+    num_representative_comments: int | None,
+    response: ConversationAnalysisResponse,
+):
+    payload = response.model_dump(mode="json", exclude={"job_status", "computed_at"})
+    upsert_rows(
+        db,
+        models.AnalysisSnapshot,
+        [
+            {
+                "conversation_id": conversation_id,
+                "data_version": data_version[0],
+                "vote_version": data_version[1],
+                "num_representative_comments": num_representative_comments,
+                "payload": payload,
+            }
+        ],
+        index_elements=["conversation_id"],
+        update_columns=[
+            "data_version",
+            "vote_version",
+            "num_representative_comments",
+            "payload",
+        ],
+    )
+    db.commit()
+
+
 @router.get(
     "/conversation/{conversation_id}", response_model=ConversationAnalysisResponse
 )
@@ -372,8 +422,10 @@ def analyze_conversation(
     conversation_id: UUID,
     current_user: CurrentUser,
     db: Database,
-    refresh: bool = True,
+    response: Response,
+    refresh: bool = False,
     num_representative_comments: int = 3,
+    if_none_match: Annotated[str | None, Header()] = None,
 ):
     conversation = db.get(models.Conversation, conversation_id)
     if conversation is None:
@@ -384,21 +436,38 @@ def analyze_conversation(
             status_code=403, detail="Not authorized to access this conversation"
         )
 
+    # only persisted results are read, jobs are left to the worker
     if refresh:
-        update_conversation_analysis(conversation, db)
-
-    raw_data = get_conversation_analysis_raw_data(db, conversation)
-    comments = get_conversation_comments(db, conversation, raw_data)
-    groups = get_conversation_groups(db, raw_data)
+        scheduler.refresh(db, conversation.id)
+
+    # read before computing, so that concurrent writes invalidate the snapshot
+    data_version = get_data_version(db, conversation.id)
+    job_status, computed_at = get_analysis_status(db, conversation.id)
+
+    etag = make_etag(
+        "analysis",
+        conversation.id,
+        data_version,
+        num_representative_comments,
+        job_status,
+        computed_at,
+    )
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
 
-    analysis = ConversationAnalysis(
-        conversation_id=conversation.id,
-        comment_ids=raw_data.comment_ids,
-        user_ids=raw_data.user_ids,
-        comments=comments,
-        groups=groups,
+    analysis = get_analysis_snapshot(
+        db, conversation.id, data_version, num_representative_comments
     )
+    if analysis is None:
+        analysis = compute_analysis_response(
+            db, conversation, num_representative_comments
+        )
+        save_analysis_snapshot(
+            db, conversation.id, data_version, num_representative_comments, analysis
+        )
 
-    params = {"num_representative_comments": num_representative_comments}
+    analysis.job_status, analysis.computed_at = job_status, computed_at
 
-    return process_analysis_response(analysis, raw_data, params)
+    return analysis
@@ -1,12 +1,29 @@
 from datetime import datetime
-from typing import Optional
+from typing import Annotated, Literal, Optional
 from uuid import UUID
-from fastapi import APIRouter, HTTPException
-from sqlalchemy import false, true
+from fastapi import APIRouter, Body, Header, HTTPException, Query, Response
+from sqlalchemy import exists, false, func, select, true
+from sqlalchemy.orm import aliased
 import urllib
 from chorus import models
 from chorus.auth.user import CurrentUser, RegisteredUser
+from chorus.core.etag import (
+    etag_matches,
+    get_data_version,
+    get_queue_version,
+    make_etag,
+)
+from chorus.core.routines import (
+    bump_data_version,
+    bump_queue_version,
+    upsert_rows,
+    upsert_vote,
+    upsert_votes,
+)
+from chorus.core.routing import get_comment_priorities, get_routing_key
+from chorus.core.scheduler import scheduler
 from chorus.database import Database
+from chorus.settings import settings
 from pydantic import BaseModel
 
 
@@ -64,6 +81,46 @@ class CommentWithUserInfo(CommentDetail):
     vote: Optional[int] = None
 
 
+class CommentVoteCounts(BaseModel):
+    comment_id: UUID
+    agree: int
+    disagree: int
+    skip: int
+    total: int
+
+
+class RemainingComment(Comment):
+    conversation_id: UUID
+    user_id: UUID
+    approved: Optional[bool] = None
+    date_created: datetime
+
+
+class VoteAndNextResponse(BaseModel):
+    id: UUID
+    num_votes: int
+    comments: list[RemainingComment]
+
+
+class BatchVote(BaseModel):
+    comment_id: UUID
+    value: int
+
+
+class BatchVoteResult(BaseModel):
+    comment_id: UUID
+    # superseded: a later item in the batch votes on the same comment
+    status: Literal["created", "updated", "superseded", "not_found"]
+    id: Optional[UUID] = None
+
+
+class CommentQueuePage(BaseModel):
+    num_votes: int
+    comments: list[RemainingComment]
+    # passed back to fetch the next page, None once the queue is exhausted
+    cursor: Optional[str] = None
+
+
 class ConversationUpdate(ConversationBase):
     name: Optional[str] = None
 
@@ -155,12 +212,32 @@ async def read_comments(
     conversation_id: UUID,
     db: Database,
     current_user: CurrentUser,
+    response: Response,
     include_user_info: bool = False,
+    if_none_match: Annotated[Optional[str], Header()] = None,
 ):
-    conversation = db.query(models.Conversation).get(conversation_id)
-    if conversation is None:
+    if include_user_info:
+        # the user's votes are included, so any vote can change the list
+        version = get_data_version(db, conversation_id)
+    else:
+        # the plain list only changes with the comments participants can see
+        version = get_queue_version(db, conversation_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
+    # votes are user specific, so the tag also depends on the current user
+    etag = make_etag(
+        "comments",
+        conversation_id,
+        version,
+        current_user.id if include_user_info else None,
+    )
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+    conversation = db.query(models.Conversation).get(conversation_id)
     comments = conversation.comments
 
     if conversation.display_unmoderated:
@@ -178,6 +255,63 @@ async def read_comments(
         return comments
 
 
+@router.get(
+    "/conversations/{conversation_id}/comments/vote-counts",
+    response_model=list[CommentVoteCounts],
+)
+async def read_comment_vote_counts(
+    conversation_id: UUID,
+    db: Database,
+    current_user: CurrentUser,
+    response: Response,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+):
+    data_version = get_data_version(db, conversation_id)
+    if data_version is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    etag = make_etag("vote-counts", conversation_id, data_version)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+    conversation = db.query(models.Conversation).get(conversation_id)
+
+    # comments without votes have no counter row yet
+    query = (
+        db.query(
+            models.Comment.id,
+            func.coalesce(models.CommentVoteCount.agree, 0),
+            func.coalesce(models.CommentVoteCount.disagree, 0),
+            func.coalesce(models.CommentVoteCount.skip, 0),
+        )
+        .outerjoin(
+            models.CommentVoteCount,
+            models.CommentVoteCount.comment_id == models.Comment.id,
+        )
+        .filter(models.Comment.conversation_id == conversation_id)
+    )
+
+    if conversation.display_unmoderated:
+        query = query.filter(
+            (models.Comment.approved == True) | (models.Comment.approved == None)
+        )
+    else:
+        query = query.filter(models.Comment.approved == True)
+
+    return [
+        CommentVoteCounts(
+            comment_id=comment_id,
+            agree=agree,
+            disagree=disagree,
+            skip=skip,
+            total=agree + disagree + skip,
+        )
+        for comment_id, agree, disagree, skip in query.all()
+    ]
+
+
 def check_url_safety_and_uniqueness(
     conversation: ConversationCreate | ConversationUpdate,
     db: Database,
@@ -238,6 +372,8 @@ async def update_conversation(
     for key, value in conversation.model_dump(exclude_unset=True).items():
         setattr(conversation_db, key, value)
 
+    bump_data_version(db, conversation_db.id)
+    bump_queue_version(db, conversation_db.id)
     db.commit()
 
     return {"id": conversation_db.id}
@@ -263,11 +399,116 @@ async def create_comment(
         **comment.model_dump(), conversation=conversation, user=current_user
     )
     db.add(db_comment)
+    bump_data_version(db, conversation.id)
+    if conversation.display_unmoderated:
+        bump_queue_version(db, conversation.id)
     db.commit()
 
     return {"id": db_comment.id}
 
 
+def voted_on(comment, user: models.User):
+    return exists().where(
+        models.Vote.comment_id == comment.id, models.Vote.user_id == user.id
+    )
+
+
+def count_user_votes(conversation: models.Conversation, user: models.User):
+    """
+    Returns a scalar subquery counting the user's votes in the conversation.
+    """
+    voted_comment = aliased(models.Comment)
+    return (
+        select(func.count())
+        .select_from(voted_comment)
+        .where(
+            voted_comment.conversation_id == conversation.id,
+            voted_on(voted_comment, user),
+        )
+        .scalar_subquery()
+    )
+
+
+def get_remaining_comments_query(
+    db: Database, conversation: models.Conversation, current_user: CurrentUser
+):
+    """
+    Returns a query of (comment, num_votes) rows for the comments the user can
+    still vote on, where num_votes counts the user's votes in the conversation.
+    """
+    # both lookups probe the (comment_id, user_id) key once per comment in the
+    # conversation, so their cost does not grow with the user's vote history
+    num_votes = count_user_votes(conversation, current_user)
+
+    query = db.query(models.Comment, num_votes).filter(
+        models.Comment.conversation_id == conversation.id,
+        models.Comment.user_id != current_user.id,
+        ~voted_on(models.Comment, current_user),
+    )
+
+    if conversation.display_unmoderated:
+        query = query.filter(
+            (models.Comment.approved == True) | (models.Comment.approved == None)
+        )
+    else:
+        query = query.filter(models.Comment.approved == True)
+
+    return query
+
+
+def order_remaining_comments(query):
+    """
+    Orders a remaining comments query as set by `settings.comment_routing`:
+    "sequential" serves comments oldest first, and "priority" draws them by
+    their expected information from the cached vote counts and loadings.
+    The ordering is done by the database, so that a limit on the returned
+    query selects the routed comments in a single statement.
+    """
+    if settings.comment_routing == "sequential":
+        return query.order_by(models.Comment.date_created, models.Comment.id)
+
+    if settings.comment_routing != "priority":
+        raise ValueError(
+            f"Unknown comment routing: {settings.comment_routing}. "
+            "Use 'priority' or 'sequential'."
+        )
+
+    # comments without votes or analysis yet have no cached rows
+    x = func.coalesce(models.CommentPca.x, 0.0)
+    y = func.coalesce(models.CommentPca.y, 0.0)
+    priority = get_comment_priorities(
+        func.coalesce(models.CommentVoteCount.agree, 0),
+        func.coalesce(models.CommentVoteCount.disagree, 0),
+        func.coalesce(models.CommentVoteCount.skip, 0),
+        func.sqrt(x * x + y * y),
+        exp=func.exp,
+    )
+    key = get_routing_key(priority, query.session.get_bind().dialect.name)
+
+    return (
+        query.outerjoin(
+            models.CommentVoteCount,
+            models.CommentVoteCount.comment_id == models.Comment.id,
+        )
+        .outerjoin(models.CommentPca, models.CommentPca.comment_id == models.Comment.id)
+        .order_by(key.desc())
+    )
+
+
+def get_routed_comments(
+    db: Database,
+    conversation: models.Conversation,
+    current_user: CurrentUser,
+    limit: int | None = None,
+):
+    """
+    Returns (comment, num_votes) rows for up to `limit` comments the user can
+    still vote on, in routing order.
+    """
+    query = get_remaining_comments_query(db, conversation, current_user)
+    return order_remaining_comments(query).limit(limit).all()
+
+
 @router.get("/conversations/{conversation_id}/comments/remaining")
 async def get_next_remaining_comment(
     conversation_id: UUID,
@@ -278,57 +519,258 @@ async def get_next_remaining_comment(
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
-    user_votes = db.query(models.Vote).filter(models.Vote.user == current_user).all()
-    user_voted_comments = {vote.comment_id for vote in user_votes}
+    rows = get_routed_comments(db, conversation, current_user, limit=1)
 
-    query = db.query(models.Comment).filter(
-        models.Comment.conversation == conversation,
-        models.Comment.user != current_user,
-        models.Comment.id.notin_(user_voted_comments),
-    )
+    if not rows:
+        raise HTTPException(status_code=404, detail="No remaining comments found")
 
-    if conversation.display_unmoderated:
-        query = query.filter(
-            (models.Comment.approved == True) | (models.Comment.approved == None)
+    remaining_comment, num_votes = rows[0]
+    return {"num_votes": num_votes, "comment": remaining_comment}
+
+
+def get_comment_queue(
+    db: Database, conversation: models.Conversation, current_user: CurrentUser
+) -> tuple[list[str], bool]:
+    """
+    Returns the ids of the comments queued for the user, and whether the queue
+    was rebuilt because it was missing or stale. The caller is responsible for
+    committing a rebuilt queue.
+    """
+    queue = db.scalars(
+        select(models.CommentQueue).where(
+            models.CommentQueue.user_id == current_user.id,
+            models.CommentQueue.conversation_id == conversation.id,
         )
-    else:
-        query = query.filter(models.Comment.approved == True)
+    ).first()
+    if queue is not None and queue.queue_version == conversation.queue_version:
+        return queue.comment_ids, False
+
+    query = get_remaining_comments_query(db, conversation, current_user)
+    comment_ids = [
+        str(comment_id)
+        for comment_id, in order_remaining_comments(query).with_entities(
+            models.Comment.id
+        )
+    ]
+    upsert_rows(
+        db,
+        models.CommentQueue,
+        [
+            {
+                "user_id": current_user.id,
+                "conversation_id": conversation.id,
+                "queue_version": conversation.queue_version,
+                "comment_ids": comment_ids,
+            }
+        ],
+        index_elements=["user_id", "conversation_id"],
+        update_columns=["queue_version", "comment_ids"],
+    )
+    return comment_ids, True
 
-    remaining_comment = query.first()
 
-    if remaining_comment is None:
-        raise HTTPException(status_code=404, detail="No remaining comments found")
+@router.get(
+    "/conversations/{conversation_id}/comments/queue",
+    response_model=CommentQueuePage,
+)
+async def read_comment_queue(
+    conversation_id: UUID,
+    db: Database,
+    current_user: CurrentUser,
+    cursor: Optional[str] = None,
+    page_size: Annotated[int, Query(ge=1, le=100)] = 20,
+):
+    """
+    Serves the comments the user has left to vote on, in pages of page_size,
+    so that the client can step through a page without further requests. The
+    queue is built on the first request and rebuilt when moderation or new
+    comments change which comments are visible; a cursor from a previous queue
+    then starts over from the first comment not yet voted on.
+    """
+    conversation = db.query(models.Conversation).get(conversation_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
 
-    return {"num_votes": len(user_voted_comments), "comment": remaining_comment}
+    comment_ids, rebuilt = get_comment_queue(db, conversation, current_user)
+
+    offset = 0
+    if cursor is not None and not rebuilt:
+        try:
+            version, offset = map(int, cursor.split("."))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if version != conversation.queue_version:
+            offset = 0
+
+    page_ids = comment_ids[offset : offset + page_size]
+    next_offset = offset + page_size
+    next_cursor = (
+        f"{conversation.queue_version}.{next_offset}"
+        if next_offset < len(comment_ids)
+        else None
+    )
+
+    # drops queued comments that were voted on or hidden since the queue was built
+    rows = (
+        get_remaining_comments_query(db, conversation, current_user)
+        .filter(models.Comment.id.in_([UUID(comment_id) for comment_id in page_ids]))
+        .all()
+    )
+    if rows:
+        num_votes = rows[0][1]
+    else:
+        num_votes = db.scalar(select(count_user_votes(conversation, current_user)))
+
+    positions = {comment_id: i for i, comment_id in enumerate(page_ids)}
+    rows.sort(key=lambda row: positions[str(row[0].id)])
+
+    # built before committing, which would expire the loaded comments
+    page = CommentQueuePage(
+        num_votes=num_votes,
+        comments=[
+            RemainingComment.model_validate(comment, from_attributes=True)
+            for comment, _ in rows
+        ],
+        cursor=next_cursor,
+    )
+    if rebuilt:
+        db.commit()
+
+    return page
+
+
+def record_vote(
+    db: Database, comment_id: UUID, current_user: CurrentUser, value: int
+) -> tuple[UUID, UUID]:
+    """
+    Adds or changes the user's vote on the comment and returns the vote's id
+    and the comment's conversation id. The caller is responsible for
+    committing.
+    """
+    recorded = upsert_vote(db, comment_id, current_user.id, value)
+    if recorded is None:
+        # nothing was written, find out why
+        if db.get(models.Comment, comment_id) is None:
+            raise HTTPException(status_code=404, detail="Comment not found")
+        raise HTTPException(
+            status_code=403, detail="Voting is not allowed in this conversation"
+        )
+
+    return recorded
 
 
 @router.post("/comments/{comment_id}/vote")
 async def vote_on_comment(
     comment_id: UUID, vote: Vote, db: Database, current_user: CurrentUser
 ):
-    comment = db.query(models.Comment).get(comment_id)
-    if comment is None:
-        raise HTTPException(status_code=404, detail="Comment not found")
+    vote_id, conversation_id = record_vote(db, comment_id, current_user, vote.value)
+    db.commit()
+    scheduler.trigger_and_commit(db, conversation_id)
 
-    if not comment.conversation.allow_votes:
+    return {"id": vote_id}
+
+
+@router.post("/comments/{comment_id}/vote-and-next", response_model=VoteAndNextResponse)
+async def vote_and_get_next_comments(
+    comment_id: UUID,
+    vote: Vote,
+    db: Database,
+    current_user: CurrentUser,
+    num_comments: Annotated[int, Query(ge=1, le=100)] = 1,
+):
+    """
+    Records a vote and returns the next comments the user can vote on, with
+    their updated vote count, in a single request and transaction.
+    """
+    vote_id, conversation_id = record_vote(db, comment_id, current_user, vote.value)
+
+    conversation = db.get(models.Conversation, conversation_id)
+    rows = get_routed_comments(db, conversation, current_user, limit=num_comments)
+    if rows:
+        num_votes = rows[0][1]
+    else:
+        num_votes = db.scalar(select(count_user_votes(conversation, current_user)))
+
+    # built before committing, which would expire the loaded comments
+    response = VoteAndNextResponse(
+        id=vote_id,
+        num_votes=num_votes,
+        comments=[
+            RemainingComment.model_validate(remaining, from_attributes=True)
+            for remaining, _ in rows
+        ],
+    )
+    db.commit()
+    scheduler.trigger_and_commit(db, conversation_id)
+
+    return response
+
+
+@router.post(
+    "/conversations/{conversation_id}/votes:batch",
+    response_model=list[BatchVoteResult],
+)
+async def vote_on_comments(
+    conversation_id: UUID,
+    votes: Annotated[list[BatchVote], Body(max_length=1000)],
+    db: Database,
+    current_user: CurrentUser,
+):
+    """
+    Records a batch of votes, as gathered by offline clients, in a single
+    transaction and returns the status of each item in order. When several
+    items vote on the same comment, the last one wins.
+    """
+    conversation = db.query(models.Conversation).get(conversation_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    if not conversation.allow_votes:
         raise HTTPException(
             status_code=403, detail="Voting is not allowed in this conversation"
         )
 
-    db_vote = (
-        db.query(models.Vote)
-        .filter(models.Vote.comment == comment, models.Vote.user == current_user)
-        .first()
+    latest = {vote.comment_id: index for index, vote in enumerate(votes)}
+    comment_ids = set(
+        db.scalars(
+            select(models.Comment.id).where(
+                models.Comment.conversation_id == conversation.id,
+                models.Comment.id.in_(latest),
+            )
+        )
     )
 
-    if db_vote is not None:
-        db_vote.value = vote.value
-    else:
-        db_vote = models.Vote(**vote.model_dump(), comment=comment, user=current_user)
-        db.add(db_vote)
-    db.commit()
+    # previous votes are read by the upsert itself, not by a separate query
+    # that a concurrent vote could invalidate before the write
+    recorded = upsert_votes(
+        db,
+        conversation.id,
+        current_user.id,
+        {
+            vote.comment_id: vote.value
+            for index, vote in enumerate(votes)
+            if vote.comment_id in comment_ids and latest[vote.comment_id] == index
+        },
+    )
 
-    return {"id": db_vote.id}
+    results = []
+    for index, vote in enumerate(votes):
+        if vote.comment_id not in comment_ids:
+            status, vote_id = "not_found", None
+        elif latest[vote.comment_id] != index:
+            status, vote_id = "superseded", None
+        else:
+            vote_id, created = recorded[vote.comment_id]
+            status = "created" if created else "updated"
+        results.append(
+            BatchVoteResult(comment_id=vote.comment_id, status=status, id=vote_id)
+        )
+
+    if recorded:
+        db.commit()
+        scheduler.trigger_and_commit(db, conversation_id)
+
+    return results
 
 
 @router.delete("/conversations/{conversation_id}")
@@ -347,6 +789,24 @@ async def delete_conversation(
     db.query(models.UserCluster).filter(
         models.UserCluster.conversation_id == conversation.id
     ).delete(synchronize_session=False)
+    db.query(models.AnalysisJob).filter(
+        models.AnalysisJob.conversation_id == conversation.id
+    ).delete(synchronize_session=False)
+    db.query(models.AnalysisSnapshot).filter(
+        models.AnalysisSnapshot.conversation_id == conversation.id
+    ).delete(synchronize_session=False)
+    db.query(models.ClusterModel).filter(
+        models.ClusterModel.conversation_id == conversation.id
+    ).delete(synchronize_session=False)
+    db.query(models.CommentVoteCount).filter(
+        models.CommentVoteCount.conversation_id == conversation.id
+    ).delete(synchronize_session=False)
+    db.query(models.CommentQueue).filter(
+        models.CommentQueue.conversation_id == conversation.id
+    ).delete(synchronize_session=False)
+    db.query(models.CommentPca).filter(
+        models.CommentPca.conversation_id == conversation.id
+    ).delete(synchronize_session=False)
 
     db.query(models.Vote).filter(
         models.Vote.comment_id.in_(
@@ -6,7 +6,8 @@ from fastapi import APIRouter, HTTPException, UploadFile
 from chorus import models
 from chorus.auth.user import RegisteredUser
 from chorus.database import Database
-from chorus.core.routines import update_conversation_analysis
+from chorus.core.routines import rebuild_comment_vote_counts
+from chorus.core.scheduler import scheduler
 from pydantic import BaseModel
 
 
@@ -78,6 +79,12 @@ def process_votes_file(
     try:
         df = pd.read_csv(file.file)
 
+        # the export is a vote history; only the latest vote per comment counts
+        df["datetime"] = process_datetime(df["datetime"])
+        df = df.sort_values("datetime", kind="stable").drop_duplicates(
+            subset=["comment-id", "voter-id"], keep="last"
+        )
+
         voter_ids = df["voter-id"].unique()
         voter_ids_to_uuid = {
             vid: author_ids_to_uuid.get(vid, uuid4()) for vid in voter_ids
@@ -86,7 +93,7 @@ def process_votes_file(
         comment_uuids = df["comment-id"].map(comment_ids_to_uuid)
         voter_uuids = df["voter-id"].map(voter_ids_to_uuid)
         values = df["vote"]
-        date_created = process_datetime(df["datetime"])
+        date_created = df["datetime"]
 
         votes = [
             models.Vote(
@@ -161,10 +168,12 @@ async def import_data(
             )
             db.add(user)
 
+        db.flush()
+        rebuild_comment_vote_counts(db, conversation.id)
         db.commit()
 
     if refresh_analysis:
-        update_conversation_analysis(conversation, db)
+        scheduler.refresh(db, conversation.id)
 
     return {"status": "success"}
 
@@ -190,6 +199,26 @@ async def delete_imported_conversation(
         models.UserCluster.conversation_id == conversation_id
     ).delete(synchronize_session=False)
 
+    db.query(models.AnalysisJob).filter(
+        models.AnalysisJob.conversation_id == conversation_id
+    ).delete(synchronize_session=False)
+
+    db.query(models.AnalysisSnapshot).filter(
+        models.AnalysisSnapshot.conversation_id == conversation_id
+    ).delete(synchronize_session=False)
+    db.query(models.ClusterModel).filter(
+        models.ClusterModel.conversation_id == conversation_id
+    ).delete(synchronize_session=False)
+    db.query(models.CommentVoteCount).filter(
+        models.CommentVoteCount.conversation_id == conversation_id
+    ).delete(synchronize_session=False)
+    db.query(models.CommentQueue).filter(
+        models.CommentQueue.conversation_id == conversation_id
+    ).delete(synchronize_session=False)
+    db.query(models.CommentPca).filter(
+        models.CommentPca.conversation_id == conversation_id
+    ).delete(synchronize_session=False)
+
     db.query(models.Vote).filter(
         models.Vote.comment_id.in_(
             db.query(models.Comment.id).filter(
@@ -2,6 +2,7 @@ from uuid import UUID
 from fastapi import APIRouter, Depends, HTTPException
 from chorus import models
 from chorus.auth.user import RegisteredUser
+from chorus.core.routines import bump_data_version, bump_queue_version
 from chorus.database import Database
 from pydantic import BaseModel
 from typing import Optional
@@ -66,6 +67,8 @@ def get_comment_for_moderation(
 async def approve_comment(comment_id: UUID, db: Database, current_user: RegisteredUser):
     comment_db = get_comment_for_moderation(comment_id, db, current_user)
     comment_db.approved = True
+    bump_data_version(db, comment_db.conversation_id)
+    bump_queue_version(db, comment_db.conversation_id)
     db.commit()
     return {"success": True}
 
@@ -74,5 +77,7 @@ async def approve_comment(comment_id: UUID, db: Database, current_user: Register
 async def reject_comment(comment_id: UUID, db: Database, current_user: RegisteredUser):
     comment_db = get_comment_for_moderation(comment_id, db, current_user)
     comment_db.approved = False
+    bump_data_version(db, comment_db.conversation_id)
+    bump_queue_version(db, comment_db.conversation_id)
     db.commit()
     return {"success": True}
@@ -11,6 +11,18 @@ class Settings(BaseSettings):
     algorithm: str = "HS256"
     expires_delta_seconds: int = 3600
     cookie_secure: bool = True
+    analysis_worker: bool = False
+    analysis_poll_seconds: float = 1.0
+    analysis_debounce_seconds: float = 2.0
+    analysis_max_staleness_seconds: float = 30.0
+    analysis_job_timeout_seconds: float = 3600.0
+    analysis_pca_solver: str = "auto"
+    analysis_cluster_criterion: str = "silhouette"
+    analysis_silhouette_sample_size: int | None = 5000
+    analysis_cluster_jobs: int = 1
+    analysis_cluster_init_batches: int = 1
+    analysis_cluster_method: str = "auto"
+    comment_routing: str = "sequential"
 
     class Config:
         env_file = os.getenv("ENV_FILE", ".env")
@@ -33,6 +33,25 @@ def db():
         Base.metadata.drop_all(bind=test_engine)
 
 
+@pytest.fixture(scope="function")
+def postgres_sessions():
+    """
+    Yields a session factory on the Postgres database at TEST_POSTGRES_URL, for
+    tests of concurrent writes, which SQLite serializes. Skips without it.
+    """
+    url = os.getenv("TEST_POSTGRES_URL")
+    if url is None:
+        pytest.skip("TEST_POSTGRES_URL is not set")
+
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    try:
+        yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    finally:
+        Base.metadata.drop_all(bind=engine)
+        engine.dispose()
+
+
 @pytest.fixture(scope="function")
 def client(db):
     def override_get_db():
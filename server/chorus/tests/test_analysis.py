@@ -2,8 +2,36 @@ from uuid import UUID, uuid4
 from pydantic import BaseModel, ConfigDict
 from typing import Optional
 from datetime import datetime
+import time
+import numpy as np
 import pytest
-from chorus.models import Conversation, Comment
+from sqlalchemy import event
+from chorus_engine.math import get_comment_statistics
+from chorus.core import jobs
+from chorus.core.etag import get_data_version
+from chorus.core.jobs import utcnow
+from chorus.core.scheduler import AnalysisScheduler, scheduler
+from chorus.core.routines import (
+    get_cluster_priors,
+    get_vote_counts,
+    get_vote_matrix,
+    update_conversation_analysis,
+)
+from chorus.models import (
+    AnalysisJob,
+    AnalysisSnapshot,
+    ClusterModel,
+    CommentPca,
+    Conversation,
+    Comment,
+    JobStatus,
+    User,
+    UserCluster,
+    UserPca,
+)
+from chorus.routers import analysis as analysis_router
+from chorus.settings import settings
+from chorus.worker import start_background_worker
 
 
 class TestConversationAnalysis:
@@ -11,6 +39,7 @@ class TestConversationAnalysis:
     @pytest.mark.parametrize("users_per_group", [3, 4])
     def test_get_conversation_analysis(
         self,
+        db,
         authenticated_clients,
         create_conversation,
         create_comment,
@@ -50,6 +79,7 @@ class TestConversationAnalysis:
             f"/analysis/conversation/{conversation_id}/refresh"
         )
         assert response.status_code == 204
+        scheduler.run_pending(db)
 
         # Fetch conversation analysis
         response = conversation_owner_client.get(
@@ -67,3 +97,522 @@ class TestConversationAnalysis:
 
         assert "comments_by_consensus" in analysis
         assert len(analysis["comments_by_consensus"]) == len(comment_ids)
+
+    @pytest.mark.parametrize("num_representative_comments", [1, 2, 5])
+    def test_representative_comments_are_top_k(
+        self,
+        db,
+        authenticated_clients,
+        create_voted_conversation,
+        num_representative_comments,
+    ):
+        clients = authenticated_clients(7)
+        owner = clients["user1"]
+        conversation_id = create_voted_conversation(
+            clients, [f"user{i}" for i in range(2, 8)], num_comments=4
+        )
+        scheduler.run_pending(db, due_only=False)
+
+        analysis = owner.get(
+            f"/analysis/conversation/{conversation_id}",
+            params={"num_representative_comments": num_representative_comments},
+        ).json()
+
+        for group in analysis["groups"]:
+            comments = group["representative_comments"]
+            assert len(comments) == min(num_representative_comments, 4)
+
+            representativeness = [c["representativeness"] for c in comments]
+            assert representativeness == sorted(representativeness, reverse=True)
+            for comment in comments:
+                assert 0 <= comment["agree_percentage"] <= 1
+
+
+class TestVoteMatrix:
+    def test_get_vote_matrix(
+        self, db, authenticated_clients, create_conversation, create_comment
+    ):
+        clients = authenticated_clients(3)
+        owner = clients["user1"]
+
+        conversation_id = create_conversation(owner).json()["id"]
+        comment_ids = [
+            create_comment(owner, conversation_id, f"Comment {i}").json()["id"]
+            for i in range(3)
+        ]
+        # created within the same second, so spread them out explicitly
+        for i, comment_id in enumerate(comment_ids):
+            db.get(Comment, UUID(comment_id)).date_created = datetime(2024, 1, 1, 0, i)
+        db.commit()
+
+        # the last comment receives no votes but still gets a column
+        expected = {
+            ("user2", comment_ids[0]): 1,
+            ("user2", comment_ids[1]): 0,
+            ("user3", comment_ids[0]): -1,
+        }
+        for (username, comment_id), value in expected.items():
+            clients[username].post(
+                f"/comments/{comment_id}/vote", json={"value": value}
+            )
+
+        conversation = db.get(Conversation, UUID(conversation_id))
+        vote_matrix, user_index, comment_index = get_vote_matrix(conversation, db)
+
+        assert vote_matrix.shape == (2, 3)
+        # columns follow the comments' creation order
+        assert comment_index == {UUID(cid): i for i, cid in enumerate(comment_ids)}
+        assert np.sum(~np.isnan(vote_matrix)) == len(expected)
+
+        for (username, comment_id), value in expected.items():
+            user = db.query(User).filter_by(username=username).one()
+            row = user_index[user.id]
+            assert vote_matrix[row, comment_index[UUID(comment_id)]] == value
+
+        sparse_matrix, sparse_user_index, sparse_comment_index = get_vote_matrix(
+            conversation, db, sparse=True
+        )
+        assert sparse_user_index == user_index
+        assert sparse_comment_index == comment_index
+        # pass votes are kept as explicit zeros
+        assert sparse_matrix.nnz == len(expected)
+        np.testing.assert_array_equal(
+            sparse_matrix.toarray(), np.nan_to_num(vote_matrix, nan=0)
+        )
+
+        compact_matrix, compact_user_index, _ = get_vote_matrix(
+            conversation, db, compact=True
+        )
+        assert compact_user_index == user_index
+        np.testing.assert_array_equal(compact_matrix.to_dense(), vote_matrix)
+
+    def test_get_vote_counts(
+        self, db, authenticated_clients, create_voted_conversation
+    ):
+        clients = authenticated_clients(9)
+        voters = [f"user{i}" for i in range(2, 9)]
+        conversation_id = create_voted_conversation(clients, voters)
+        update_conversation_analysis(db.get(Conversation, conversation_id), db)
+
+        # a vote after the refresh comes from a user without a cluster
+        comment = db.query(Comment).filter_by(conversation_id=conversation_id).first()
+        clients["user9"].post(f"/comments/{comment.id}/vote", json={"value": 0})
+
+        conversation = db.get(Conversation, conversation_id)
+        vote_counts, user_index, comment_index = get_vote_counts(conversation, db)
+        vote_matrix, *expected_index = get_vote_matrix(conversation, db)
+        assert [user_index, comment_index] == expected_index
+
+        cluster_map = {
+            cluster.user_id: cluster.cluster for cluster in conversation.clusters
+        }
+        cluster_labels = [cluster_map.get(user_id, -1) for user_id in user_index]
+        assert -1 in cluster_labels
+
+        stats = vote_counts.statistics()
+        expected = get_comment_statistics(vote_matrix, cluster_labels)
+        np.testing.assert_array_equal(stats.cluster_sizes, expected.cluster_sizes)
+        np.testing.assert_array_equal(stats.cluster_agree, expected.cluster_agree)
+        np.testing.assert_array_equal(stats.skip, expected.skip)
+        np.testing.assert_allclose(stats.participation, expected.participation)
+        np.testing.assert_allclose(
+            stats.representativeness, expected.representativeness
+        )
+
+
+@pytest.fixture(scope="function")
+def create_voted_conversation(create_conversation, create_comment):
+    def _create(clients, voters, num_comments=3):
+        owner = clients["user1"]
+        conversation_id = create_conversation(owner).json()["id"]
+        comment_ids = [
+            create_comment(owner, conversation_id, f"Comment {i}").json()["id"]
+            for i in range(num_comments)
+        ]
+        for i, voter in enumerate(voters):
+            for j, comment_id in enumerate(comment_ids):
+                value = 1 if (i + j) % 2 == 0 else -1
+                clients[voter].post(
+                    f"/comments/{comment_id}/vote", json={"value": value}
+                )
+        return UUID(conversation_id)
+
+    return _create
+
+
+class TestUpdateConversationAnalysis:
+    def count_statements(self, db, conversation_id):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db.get_bind()
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            conversation = db.get(Conversation, conversation_id)
+            update_conversation_analysis(conversation, db)
+        finally:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+        return len(statements)
+
+    def test_refresh_upserts_results(
+        self, db, authenticated_clients, create_voted_conversation
+    ):
+        clients = authenticated_clients(5)
+        voters = ["user2", "user3", "user4", "user5"]
+        conversation_id = create_voted_conversation(clients, voters)
+
+        for _ in range(2):
+            conversation = db.get(Conversation, conversation_id)
+            update_conversation_analysis(conversation, db)
+
+            assert db.query(UserPca).filter_by(
+                conversation_id=conversation_id
+            ).count() == len(voters)
+            assert db.query(UserCluster).filter_by(
+                conversation_id=conversation_id
+            ).count() == len(voters)
+            # one row of loadings per comment, for comment routing
+            assert db.query(CommentPca).filter_by(
+                conversation_id=conversation_id
+            ).count() == len(conversation.comments)
+
+    def test_refresh_warm_starts_from_cluster_models(
+        self, db, authenticated_clients, create_voted_conversation
+    ):
+        clients = authenticated_clients(9)
+        voters = [f"user{i}" for i in range(2, 10)]
+        conversation_id = create_voted_conversation(clients, voters)
+
+        labels = []
+        for _ in range(2):
+            conversation = db.get(Conversation, conversation_id)
+            update_conversation_analysis(conversation, db)
+
+            clusters = db.query(UserCluster).filter_by(conversation_id=conversation_id)
+            labels.append(
+                {cluster.user_id: cluster.cluster for cluster in clusters.all()}
+            )
+
+        priors = get_cluster_priors(db, conversation_id)
+        assert sorted(priors) == [2, 3]
+        for n_clusters, prior in priors.items():
+            assert prior.centroids.shape == (n_clusters, 2)
+        assert db.query(ClusterModel).filter_by(
+            conversation_id=conversation_id
+        ).count() == len(priors)
+        assert labels[0] == labels[1]
+
+    def test_refresh_statement_count_is_constant(
+        self, db, authenticated_clients, create_voted_conversation
+    ):
+        clients = authenticated_clients(9)
+        small = create_voted_conversation(clients, ["user2", "user3", "user4"])
+        large = create_voted_conversation(clients, [f"user{i}" for i in range(2, 10)])
+
+        # first refresh inserts, second refresh updates existing rows
+        for _ in range(2):
+            assert self.count_statements(db, small) == self.count_statements(db, large)
+
+
+class TestAnalysisJobs:
+    def test_votes_enqueue_a_single_job(
+        self, db, authenticated_clients, create_voted_conversation
+    ):
+        clients = authenticated_clients(4)
+        conversation_id = create_voted_conversation(
+            clients, ["user2", "user3", "user4"]
+        )
+
+        jobs = db.query(AnalysisJob).filter_by(conversation_id=conversation_id).all()
+        assert len(jobs) == 1
+        assert jobs[0].status == JobStatus.PENDING
+        assert jobs[0].trigger_count == 9  # 3 voters x 3 comments
+
+    def test_get_does_not_run_jobs(
+        self, db, monkeypatch, authenticated_clients, create_voted_conversation
+    ):
+        clients = authenticated_clients(5)
+        conversation_id = create_voted_conversation(
+            clients, ["user2", "user3", "user4", "user5"]
+        )
+
+        def fail(*args, **kwargs):
+            raise AssertionError("analysis should not be computed in a request")
+
+        with monkeypatch.context() as m:
+            m.setattr(jobs, "update_conversation_analysis", fail)
+            for params in [{}, {"refresh": True}]:
+                response = clients["user1"].get(
+                    f"/analysis/conversation/{conversation_id}", params=params
+                )
+                assert response.status_code == 200
+                assert response.json()["job_status"] == JobStatus.PENDING
+
+        job = db.query(AnalysisJob).filter_by(conversation_id=conversation_id).one()
+        assert job.status == JobStatus.PENDING
+
+    def test_worker_drains_queue(
+        self, db, authenticated_clients, create_voted_conversation
+    ):
+        clients = authenticated_clients(5)
+        owner = clients["user1"]
+        conversation_id = create_voted_conversation(
+            clients, ["user2", "user3", "user4", "user5"]
+        )
+
+        response = owner.put(f"/analysis/conversation/{conversation_id}/refresh")
+        assert response.status_code == 204
+
+        analysis = owner.get(f"/analysis/conversation/{conversation_id}").json()
+        assert analysis["job_status"] == JobStatus.PENDING
+        assert analysis["computed_at"] is None
+        assert analysis["groups"] == []
+
+        assert scheduler.run_pending(db) == 1
+
+        analysis = owner.get(f"/analysis/conversation/{conversation_id}").json()
+        assert analysis["job_status"] == JobStatus.COMPLETED
+        assert analysis["computed_at"] is not None
+        assert len(analysis["groups"]) > 0
+
+    def test_background_worker_runs_jobs(
+        self, db, monkeypatch, authenticated_clients, create_voted_conversation
+    ):
+        monkeypatch.setattr(settings, "analysis_poll_seconds", 0.05)
+
+        clients = authenticated_clients(4)
+        conversation_id = create_voted_conversation(
+            clients, ["user2", "user3", "user4"]
+        )
+        scheduler.refresh(db, conversation_id)
+
+        stop = start_background_worker()
+        try:
+            for _ in range(200):
+                db.expire_all()
+                job = db.query(AnalysisJob).filter_by(conversation_id=conversation_id)
+                if job.one().status == JobStatus.COMPLETED:
+                    break
+                time.sleep(0.05)
+        finally:
+            stop.set()
+
+        assert job.one().status == JobStatus.COMPLETED
+
+
+class TestAnalysisScheduler:
+    def test_triggers_are_debounced(
+        self, db, authenticated_clients, create_voted_conversation
+    ):
+        clients = authenticated_clients(4)
+        conversation_id = create_voted_conversation(
+            clients, ["user2", "user3", "user4"]
+        )
+        db.query(AnalysisJob).delete()
+
+        debounced = AnalysisScheduler(window_seconds=60, max_staleness_seconds=120)
+        for _ in range(5):
+            debounced.trigger(db, conversation_id)
+        db.commit()
+
+        # nothing is due until the window has passed
+        assert debounced.run_pending(db) == 0
+
+        job = db.query(AnalysisJob).filter_by(conversation_id=conversation_id).one()
+        assert job.trigger_count == 5
+        assert job.run_after > utcnow()
+
+        # the staleness bound caps how far further triggers can push the job back
+        job.deadline = utcnow()
+        db.commit()
+        debounced.trigger(db, conversation_id)
+        db.commit()
+
+        assert debounced.run_pending(db) == 1
+        assert debounced.stats(db, conversation_id) == {
+            "triggers_received": 6,
+            "triggers_processed": 6,
+            "computations_run": 1,
+        }
+
+    def test_stats_are_shared_across_schedulers(
+        self, db, authenticated_clients, create_voted_conversation
+    ):
+        clients = authenticated_clients(4)
+        owner = clients["user1"]
+        conversation_id = create_voted_conversation(
+            clients, ["user2", "user3", "user4"]
+        )
+
+        # the API process triggers, a separate worker process runs the job
+        worker = AnalysisScheduler(window_seconds=0, max_staleness_seconds=0)
+        assert worker.run_pending(db, due_only=False) == 1
+        clients["user2"].post(
+            f"/comments/{db.query(Comment).first().id}/vote", json={"value": 0}
+        )
+
+        response = owner.get(f"/analysis/conversation/{conversation_id}/stats")
+        assert response.status_code == 200
+        assert response.json() == {
+            "triggers_received": 10,  # 3 voters x 3 comments, then one more
+            "triggers_processed": 9,
+            "computations_run": 1,
+        }
+
+        response = clients["user2"].get(
+            f"/analysis/conversation/{conversation_id}/stats"
+        )
+        assert response.status_code == 403
+
+    def test_one_computation_per_conversation(
+        self, db, authenticated_clients, create_voted_conversation
+    ):
+        clients = authenticated_clients(4)
+        conversation_id = create_voted_conversation(
+            clients, ["user2", "user3", "user4"]
+        )
+
+        db.add(AnalysisJob(conversation_id=conversation_id, status=JobStatus.RUNNING))
+        db.commit()
+
+        # the pending job cannot start while another one is running
+        assert scheduler.run_pending(db, conversation_id, due_only=False) == 0
+
+        statuses = sorted(
+            job.status
+            for job in db.query(AnalysisJob).filter_by(conversation_id=conversation_id)
+        )
+        assert statuses == [JobStatus.PENDING, JobStatus.RUNNING]
+
+
+class TestAnalysisSnapshot:
+    def test_repeated_loads_are_served_from_snapshot(
+        self, db, monkeypatch, authenticated_clients, create_voted_conversation
+    ):
+        clients = authenticated_clients(5)
+        owner = clients["user1"]
+        conversation_id = create_voted_conversation(
+            clients, ["user2", "user3", "user4", "user5"]
+        )
+
+        first = owner.get(f"/analysis/conversation/{conversation_id}")
+        assert first.status_code == 200
+
+        def fail(*args, **kwargs):
+            raise AssertionError("analysis should be served from the snapshot")
+
+        with monkeypatch.context() as m:
+            m.setattr(analysis_router, "compute_analysis_response", fail)
+            second = owner.get(f"/analysis/conversation/{conversation_id}")
+            assert second.status_code == 200
+            assert second.json() == first.json()
+
+        snapshot = db.query(AnalysisSnapshot).filter_by(conversation_id=conversation_id)
+        assert snapshot.count() == 1
+
+    def test_writes_bump_data_version(
+        self,
+        db,
+        authenticated_clients,
+        create_conversation,
+        create_comment,
+        approve_comment,
+        vote_on_comment,
+    ):
+        clients = authenticated_clients(2)
+        owner, user_2 = clients["user1"], clients["user2"]
+        conversation_id = create_conversation(owner).json()["id"]
+
+        def data_version():
+            return get_data_version(db, UUID(conversation_id))
+
+        versions = [data_version()]
+
+        comment_id = create_comment(owner, conversation_id).json()["id"]
+        versions.append(data_version())
+
+        approve_comment(owner, comment_id)
+        versions.append(data_version())
+
+        vote_on_comment(user_2, comment_id, 1)
+        versions.append(data_version())
+
+        vote_on_comment(user_2, comment_id, -1)
+        versions.append(data_version())
+
+        assert versions == sorted(set(versions))
+        # votes are versioned per comment, the conversation row is untouched
+        assert versions[-1][0] == versions[-3][0]
+
+    def test_snapshot_is_recomputed_after_vote(
+        self, authenticated_clients, create_voted_conversation, create_comment
+    ):
+        clients = authenticated_clients(5)
+        owner = clients["user1"]
+        conversation_id = create_voted_conversation(
+            clients, ["user2", "user3", "user4", "user5"]
+        )
+
+        analysis = owner.get(f"/analysis/conversation/{conversation_id}").json()
+        num_comments = len(analysis["comments_by_consensus"])
+
+        comment_id = create_comment(owner, conversation_id).json()["id"]
+        clients["user2"].post(f"/comments/{comment_id}/vote", json={"value": 1})
+
+        analysis = owner.get(f"/analysis/conversation/{conversation_id}").json()
+        assert len(analysis["comments_by_consensus"]) == num_comments + 1
+
+
+class TestAnalysisETag:
+    def test_unchanged_analysis_is_not_modified(
+        self, authenticated_clients, create_voted_conversation
+    ):
+        clients = authenticated_clients(5)
+        owner = clients["user1"]
+        conversation_id = create_voted_conversation(
+            clients, ["user2", "user3", "user4", "user5"]
+        )
+
+        response = owner.get(f"/analysis/conversation/{conversation_id}")
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+
+        response = owner.get(
+            f"/analysis/conversation/{conversation_id}",
+            headers={"If-None-Match": etag},
+        )
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert response.content == b""
+
+        # different parameters produce a different representation
+        response = owner.get(
+            f"/analysis/conversation/{conversation_id}",
+            params={"num_representative_comments": 1},
+            headers={"If-None-Match": etag},
+        )
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+    def test_vote_changes_etag(
+        self, authenticated_clients, create_voted_conversation, create_comment
+    ):
+        clients = authenticated_clients(5)
+        owner = clients["user1"]
+        conversation_id = create_voted_conversation(
+            clients, ["user2", "user3", "user4", "user5"]
+        )
+
+        etag = owner.get(f"/analysis/conversation/{conversation_id}").headers["ETag"]
+
+        comment_id = create_comment(owner, conversation_id).json()["id"]
+        clients["user2"].post(f"/comments/{comment_id}/vote", json={"value": 1})
+
+        response = owner.get(
+            f"/analysis/conversation/{conversation_id}",
+            headers={"If-None-Match": etag},
+        )
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
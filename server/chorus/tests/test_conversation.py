@@ -2,8 +2,12 @@ from uuid import UUID, uuid4
 from pydantic import BaseModel, ConfigDict
 from typing import Optional
 from datetime import datetime
+from threading import Thread
 import pytest
-from chorus.models import Conversation, Comment
+from sqlalchemy import select
+from chorus.core.routines import rebuild_comment_vote_counts, upsert_vote, upsert_votes
+from chorus.models import Conversation, Comment, CommentVoteCount, User
+from chorus.routers import conversation as conversation_router
 
 
 class UserBasic(BaseModel):
@@ -1044,6 +1048,90 @@ class TestReadComments:
         assert "id" in response.json()
 
 
+class TestReadCommentsETag:
+    def test_unchanged_comments_are_not_modified(
+        self, authenticated_client, create_conversation, create_comment
+    ):
+        conversation_id = create_conversation(authenticated_client).json()["id"]
+        create_comment(authenticated_client, conversation_id, "Comment")
+
+        response = authenticated_client.get(
+            f"/conversations/{conversation_id}/comments"
+        )
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+
+        response = authenticated_client.get(
+            f"/conversations/{conversation_id}/comments",
+            headers={"If-None-Match": f"W/{etag}"},
+        )
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+
+    def test_new_comment_changes_etag(
+        self, authenticated_client, create_conversation, create_comment
+    ):
+        conversation_id = create_conversation(authenticated_client).json()["id"]
+        create_comment(authenticated_client, conversation_id, "Comment 1")
+
+        etag = authenticated_client.get(
+            f"/conversations/{conversation_id}/comments"
+        ).headers["ETag"]
+
+        create_comment(authenticated_client, conversation_id, "Comment 2")
+
+        response = authenticated_client.get(
+            f"/conversations/{conversation_id}/comments",
+            headers={"If-None-Match": etag},
+        )
+        assert response.status_code == 200
+        assert len(response.json()) == 2
+        assert response.headers["ETag"] != etag
+
+    def test_votes_only_change_user_info_etag(
+        self, authenticated_clients, create_conversation, create_comment
+    ):
+        clients = authenticated_clients(2)
+        user_1, user_2 = clients["user1"], clients["user2"]
+        conversation_id = create_conversation(user_1).json()["id"]
+        comment_id = create_comment(user_1, conversation_id, "Comment").json()["id"]
+
+        url = f"/conversations/{conversation_id}/comments"
+        params = {"include_user_info": True}
+        etag = user_2.get(url).headers["ETag"]
+        user_info_etag = user_2.get(url, params=params).headers["ETag"]
+
+        user_2.post(f"/comments/{comment_id}/vote", json={"value": 1})
+
+        response = user_2.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
+        response = user_2.get(
+            url, params=params, headers={"If-None-Match": user_info_etag}
+        )
+        assert response.status_code == 200
+        assert response.json()[0]["vote"] == 1
+
+    def test_user_info_etag_depends_on_user(
+        self, authenticated_clients, create_conversation, create_comment
+    ):
+        clients = authenticated_clients(2)
+        user_1, user_2 = clients["user1"], clients["user2"]
+        conversation_id = create_conversation(user_1).json()["id"]
+        create_comment(user_1, conversation_id, "Comment")
+
+        url = f"/conversations/{conversation_id}/comments"
+        params = {"include_user_info": True}
+        etag = user_1.get(url, params=params).headers["ETag"]
+
+        response = user_2.get(url, params=params, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+
+    def test_missing_conversation(self, authenticated_client):
+        response = authenticated_client.get(f"/conversations/{uuid4()}/comments")
+        assert response.status_code == 404
+
+
 class TestVoteOnComment:
     def test_can_vote_on_another_users_comment_first_time(
         self, authenticated_clients, create_conversation, create_comment
@@ -1142,6 +1230,29 @@ class TestVoteOnComment:
         assert response.status_code == 404
         assert response.json() == {"detail": "Comment not found"}
 
+    def test_vote_on_comment_when_votes_are_not_allowed(
+        self, authenticated_client, create_conversation, create_comment
+    ):
+        conversation_id = create_conversation(authenticated_client).json()["id"]
+        comment_id = create_comment(authenticated_client, conversation_id).json()["id"]
+        authenticated_client.put(
+            f"/conversations/{conversation_id}", json={"allow_votes": False}
+        )
+
+        response = authenticated_client.post(
+            f"/comments/{comment_id}/vote", json={"value": 1}
+        )
+        assert response.status_code == 403
+        assert response.json() == {
+            "detail": "Voting is not allowed in this conversation"
+        }
+
+        # nothing was recorded or counted
+        response = authenticated_client.get(
+            f"/conversations/{conversation_id}/comments/vote-counts"
+        )
+        assert response.json()[0]["total"] == 0
+
     def test_vote_on_comment_unauthenticated(
         self, create_conversation, create_comment, authenticated_client
     ):
@@ -1209,6 +1320,84 @@ class TestVoteOnComment:
         assert user_2_vote_response.json()["id"] != user_3_vote_response.json()["id"]
 
 
+class TestCommentVoteCounts:
+    def read_counts(self, client, conversation_id):
+        response = client.get(f"/conversations/{conversation_id}/comments/vote-counts")
+        assert response.status_code == 200
+        return {counts.pop("comment_id"): counts for counts in response.json()}
+
+    def test_votes_update_counts(
+        self, authenticated_clients, create_conversation, create_comment
+    ):
+        clients = authenticated_clients(3)
+        owner = clients["user1"]
+        conversation_id = create_conversation(owner).json()["id"]
+        comment_ids = [
+            create_comment(owner, conversation_id, f"Comment {i}").json()["id"]
+            for i in range(2)
+        ]
+
+        clients["user2"].post(f"/comments/{comment_ids[0]}/vote", json={"value": 1})
+        clients["user3"].post(f"/comments/{comment_ids[0]}/vote", json={"value": 1})
+        # a changed vote moves from its old value to the new one
+        clients["user3"].post(f"/comments/{comment_ids[0]}/vote", json={"value": -1})
+        clients["user2"].post(f"/comments/{comment_ids[1]}/vote", json={"value": 0})
+
+        counts = self.read_counts(owner, conversation_id)
+        assert counts == {
+            comment_ids[0]: {"agree": 1, "disagree": 1, "skip": 0, "total": 2},
+            comment_ids[1]: {"agree": 0, "disagree": 0, "skip": 1, "total": 1},
+        }
+
+    def test_comments_without_votes_have_zero_counts(
+        self, authenticated_client, create_conversation, create_comment
+    ):
+        conversation_id = create_conversation(authenticated_client).json()["id"]
+        comment_id = create_comment(
+            authenticated_client, conversation_id, "Comment"
+        ).json()["id"]
+
+        counts = self.read_counts(authenticated_client, conversation_id)
+        assert counts == {
+            comment_id: {"agree": 0, "disagree": 0, "skip": 0, "total": 0}
+        }
+
+    def test_rebuild_matches_maintained_counts(
+        self, db, authenticated_clients, create_conversation, create_comment
+    ):
+        clients = authenticated_clients(4)
+        owner = clients["user1"]
+        conversation_id = create_conversation(owner).json()["id"]
+        comment_ids = [
+            create_comment(owner, conversation_id, f"Comment {i}").json()["id"]
+            for i in range(3)
+        ]
+        for i, username in enumerate(["user2", "user3", "user4"]):
+            for j, comment_id in enumerate(comment_ids):
+                value = (i + j) % 3 - 1
+                clients[username].post(
+                    f"/comments/{comment_id}/vote", json={"value": value}
+                )
+        expected = self.read_counts(owner, conversation_id)
+
+        db.query(CommentVoteCount).delete()
+        db.commit()
+        assert all(
+            counts["total"] == 0
+            for counts in self.read_counts(owner, conversation_id).values()
+        )
+
+        rebuild_comment_vote_counts(db, UUID(conversation_id))
+        db.commit()
+        assert self.read_counts(owner, conversation_id) == expected
+
+    def test_missing_conversation(self, authenticated_client):
+        response = authenticated_client.get(
+            f"/conversations/{uuid4()}/comments/vote-counts"
+        )
+        assert response.status_code == 404
+
+
 class TestGetNextRemainingComment:
     def test_get_next_remaining_comment_success(
         self,
@@ -1363,6 +1552,42 @@ class TestGetNextRemainingComment:
         assert response.status_code == 404
         assert response.json() == {"detail": "No remaining comments found"}
 
+    def test_get_next_remaining_comment_counts_votes_in_conversation(
+        self,
+        authenticated_clients,
+        create_conversation,
+        create_comment,
+        approve_comment,
+        vote_on_comment,
+    ):
+        clients = authenticated_clients(3)
+        conversation_owner = clients["user1"]
+        user_2 = clients["user2"]
+        user_3 = clients["user3"]
+
+        conversation_ids = [
+            create_conversation(conversation_owner).json()["id"] for _ in range(2)
+        ]
+        comment_ids = {}
+        for conversation_id in conversation_ids:
+            comment_ids[conversation_id] = [
+                create_comment(user_2, conversation_id, f"Comment {i}").json()["id"]
+                for i in range(2)
+            ]
+            for comment_id in comment_ids[conversation_id]:
+                approve_comment(conversation_owner, comment_id)
+
+        # votes in the other conversation are not counted
+        other_id, conversation_id = conversation_ids
+        for comment_id in comment_ids[other_id]:
+            vote_on_comment(user_3, comment_id, 1)
+        vote_on_comment(user_3, comment_ids[conversation_id][0], -1)
+
+        response = user_3.get(f"/conversations/{conversation_id}/comments/remaining")
+        assert response.status_code == 200
+        assert response.json()["num_votes"] == 1
+        assert response.json()["comment"]["id"] == comment_ids[conversation_id][1]
+
     def test_get_next_remaining_comment_skips_rejected_comments(
         self,
         authenticated_clients,
@@ -1435,3 +1660,419 @@ class TestGetNextRemainingComment:
         response = client.get(f"/conversations/{conversation_id}/comments/remaining")
         assert response.status_code == 401
         assert response.json()["detail"] == "Invalid token"
+
+
+class TestVoteAndGetNextComments:
+    def create_comments(
+        self, clients, create_conversation, create_comment, approve_comment
+    ):
+        conversation_owner = clients["user1"]
+        conversation_id = create_conversation(conversation_owner).json()["id"]
+        comment_ids = [
+            create_comment(clients["user2"], conversation_id, f"Comment {i}").json()[
+                "id"
+            ]
+            for i in range(3)
+        ]
+        for comment_id in comment_ids:
+            approve_comment(conversation_owner, comment_id)
+        return conversation_id, comment_ids
+
+    def test_vote_and_get_next_comments(
+        self,
+        authenticated_clients,
+        create_conversation,
+        create_comment,
+        approve_comment,
+    ):
+        clients = authenticated_clients(3)
+        user_3 = clients["user3"]
+        conversation_id, comment_ids = self.create_comments(
+            clients, create_conversation, create_comment, approve_comment
+        )
+
+        response = user_3.post(
+            f"/comments/{comment_ids[0]}/vote-and-next?num_comments=5",
+            json={"value": 1},
+        )
+        assert response.status_code == 200
+        assert response.json()["num_votes"] == 1
+        next_comments = response.json()["comments"]
+        assert {comment["id"] for comment in next_comments} == set(comment_ids[1:])
+        for comment in next_comments:
+            CommentResponse.model_validate(comment)
+
+        # the vote is recorded like one cast through the vote endpoint
+        response = user_3.get(
+            f"/conversations/{conversation_id}/comments?include_user_info=true"
+        )
+        votes = {comment["id"]: comment["vote"] for comment in response.json()}
+        assert votes[comment_ids[0]] == 1
+
+    def test_vote_on_last_comment_returns_no_comments(
+        self,
+        authenticated_clients,
+        create_conversation,
+        create_comment,
+        approve_comment,
+        vote_on_comment,
+    ):
+        clients = authenticated_clients(3)
+        user_3 = clients["user3"]
+        _, comment_ids = self.create_comments(
+            clients, create_conversation, create_comment, approve_comment
+        )
+        for comment_id in comment_ids[:2]:
+            vote_on_comment(user_3, comment_id, 1)
+
+        response = user_3.post(
+            f"/comments/{comment_ids[2]}/vote-and-next", json={"value": -1}
+        )
+        assert response.status_code == 200
+        assert response.json()["num_votes"] == 3
+        assert response.json()["comments"] == []
+
+    def test_vote_and_get_next_comments_not_allowed(
+        self,
+        authenticated_clients,
+        create_conversation,
+        create_comment,
+        approve_comment,
+    ):
+        clients = authenticated_clients(3)
+        conversation_id, comment_ids = self.create_comments(
+            clients, create_conversation, create_comment, approve_comment
+        )
+        clients["user1"].put(
+            f"/conversations/{conversation_id}", json={"allow_votes": False}
+        )
+
+        response = clients["user3"].post(
+            f"/comments/{comment_ids[0]}/vote-and-next", json={"value": 1}
+        )
+        assert response.status_code == 403
+
+    def test_vote_and_get_next_comments_not_found(self, authenticated_client):
+        response = authenticated_client.post(
+            f"/comments/{uuid4()}/vote-and-next", json={"value": 1}
+        )
+        assert response.status_code == 404
+        assert response.json() == {"detail": "Comment not found"}
+
+
+class TestReadCommentQueue:
+    def create_comments(
+        self, clients, create_conversation, create_comment, approve_comment, count
+    ):
+        conversation_owner = clients["user1"]
+        conversation_id = create_conversation(conversation_owner).json()["id"]
+        comment_ids = [
+            create_comment(clients["user2"], conversation_id, f"Comment {i}").json()[
+                "id"
+            ]
+            for i in range(count)
+        ]
+        for comment_id in comment_ids:
+            approve_comment(conversation_owner, comment_id)
+        return conversation_id, comment_ids
+
+    def read_page(self, client, conversation_id, cursor=None, page_size=2):
+        params = {"page_size": page_size}
+        if cursor is not None:
+            params["cursor"] = cursor
+        response = client.get(
+            f"/conversations/{conversation_id}/comments/queue", params=params
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    def test_pages_cover_queue_in_order(
+        self,
+        authenticated_clients,
+        create_conversation,
+        create_comment,
+        approve_comment,
+    ):
+        clients = authenticated_clients(3)
+        conversation_id, comment_ids = self.create_comments(
+            clients, create_conversation, create_comment, approve_comment, 5
+        )
+
+        served, cursor = [], None
+        while True:
+            page = self.read_page(clients["user3"], conversation_id, cursor)
+            served += [comment["id"] for comment in page["comments"]]
+            cursor = page["cursor"]
+            if cursor is None:
+                break
+        # each comment is served exactly once
+        assert sorted(served) == sorted(comment_ids)
+
+    def test_voted_comments_are_dropped(
+        self,
+        authenticated_clients,
+        create_conversation,
+        create_comment,
+        approve_comment,
+        vote_on_comment,
+    ):
+        clients = authenticated_clients(3)
+        user_3 = clients["user3"]
+        conversation_id, comment_ids = self.create_comments(
+            clients, create_conversation, create_comment, approve_comment, 4
+        )
+
+        page = self.read_page(user_3, conversation_id)
+        served = [comment["id"] for comment in page["comments"]]
+        queued = served + [
+            comment_id for comment_id in comment_ids if comment_id not in served
+        ]
+
+        # votes on the next page, cast before it is fetched, are skipped
+        for comment_id in served:
+            vote_on_comment(user_3, comment_id, 1)
+        vote_on_comment(user_3, queued[2], 1)
+        page = self.read_page(user_3, conversation_id, page["cursor"])
+        assert [comment["id"] for comment in page["comments"]] == [queued[3]]
+        assert page["num_votes"] == 3
+        assert page["cursor"] is None
+
+    def test_moderation_rebuilds_queue(
+        self,
+        authenticated_clients,
+        create_conversation,
+        create_comment,
+        approve_comment,
+        reject_comment,
+        vote_on_comment,
+    ):
+        clients = authenticated_clients(3)
+        user_3 = clients["user3"]
+        conversation_id, comment_ids = self.create_comments(
+            clients, create_conversation, create_comment, approve_comment, 3
+        )
+
+        page = self.read_page(user_3, conversation_id)
+        served = [comment["id"] for comment in page["comments"]]
+        for comment_id in served:
+            vote_on_comment(user_3, comment_id, 1)
+
+        new_comment_id = create_comment(
+            clients["user2"], conversation_id, "New comment"
+        ).json()["id"]
+        approve_comment(clients["user1"], new_comment_id)
+        (unserved_id,) = set(comment_ids) - set(served)
+        reject_comment(clients["user1"], unserved_id)
+
+        # the cursor belongs to the old queue, the new one starts over
+        page = self.read_page(user_3, conversation_id, page["cursor"])
+        assert [comment["id"] for comment in page["comments"]] == [new_comment_id]
+        assert page["num_votes"] == 2
+
+    def test_invalid_cursor(
+        self,
+        authenticated_clients,
+        create_conversation,
+        create_comment,
+        approve_comment,
+    ):
+        clients = authenticated_clients(3)
+        conversation_id, _ = self.create_comments(
+            clients, create_conversation, create_comment, approve_comment, 1
+        )
+        self.read_page(clients["user3"], conversation_id)
+
+        response = clients["user3"].get(
+            f"/conversations/{conversation_id}/comments/queue",
+            params={"cursor": "not-a-cursor"},
+        )
+        assert response.status_code == 400
+        assert response.json() == {"detail": "Invalid cursor"}
+
+    def test_conversation_not_found(self, authenticated_client):
+        response = authenticated_client.get(f"/conversations/{uuid4()}/comments/queue")
+        assert response.status_code == 404
+        assert response.json() == {"detail": "Conversation not found"}
+
+
+class TestBatchVote:
+    def test_batch_records_votes_and_counts(
+        self, authenticated_clients, create_conversation, create_comment
+    ):
+        clients = authenticated_clients(2)
+        owner = clients["user1"]
+        voter = clients["user2"]
+        conversation_id = create_conversation(owner).json()["id"]
+        comment_ids = [
+            create_comment(owner, conversation_id, f"Comment {i}").json()["id"]
+            for i in range(3)
+        ]
+        vote_id = voter.post(
+            f"/comments/{comment_ids[0]}/vote", json={"value": 1}
+        ).json()["id"]
+        missing_id = str(uuid4())
+
+        response = voter.post(
+            f"/conversations/{conversation_id}/votes:batch",
+            json=[
+                {"comment_id": comment_ids[0], "value": -1},
+                {"comment_id": comment_ids[1], "value": 1},
+                {"comment_id": missing_id, "value": 1},
+                {"comment_id": comment_ids[1], "value": 0},
+            ],
+        )
+        assert response.status_code == 200
+        results = response.json()
+        assert [(result["comment_id"], result["status"]) for result in results] == [
+            (comment_ids[0], "updated"),
+            (comment_ids[1], "superseded"),
+            (missing_id, "not_found"),
+            (comment_ids[1], "created"),
+        ]
+        assert results[0]["id"] == vote_id
+        assert results[1]["id"] is None and results[2]["id"] is None
+
+        # the created vote keeps its id when voted on again
+        response = voter.post(f"/comments/{comment_ids[1]}/vote", json={"value": 0})
+        assert response.json()["id"] == results[3]["id"]
+
+        response = owner.get(f"/conversations/{conversation_id}/comments/vote-counts")
+        counts = {counts.pop("comment_id"): counts for counts in response.json()}
+        assert counts == {
+            comment_ids[0]: {"agree": 0, "disagree": 1, "skip": 0, "total": 1},
+            comment_ids[1]: {"agree": 0, "disagree": 0, "skip": 1, "total": 1},
+            comment_ids[2]: {"agree": 0, "disagree": 0, "skip": 0, "total": 0},
+        }
+
+    def test_batch_interleaved_with_single_vote(
+        self, monkeypatch, authenticated_clients, create_conversation, create_comment
+    ):
+        clients = authenticated_clients(2)
+        owner = clients["user1"]
+        voter = clients["user2"]
+        conversation_id = create_conversation(owner).json()["id"]
+        comment_id = create_comment(owner, conversation_id).json()["id"]
+
+        # a single vote lands after the batch is validated, before it is written
+        single_vote = {}
+
+        def upsert_votes_after_vote(db, conversation_id, user_id, values):
+            single_vote["id"], _ = upsert_vote(db, UUID(comment_id), user_id, -1)
+            return upsert_votes(db, conversation_id, user_id, values)
+
+        monkeypatch.setattr(
+            conversation_router, "upsert_votes", upsert_votes_after_vote
+        )
+        response = voter.post(
+            f"/conversations/{conversation_id}/votes:batch",
+            json=[{"comment_id": comment_id, "value": 1}],
+        )
+        assert response.status_code == 200
+        assert response.json() == [
+            {
+                "comment_id": comment_id,
+                "status": "updated",
+                "id": str(single_vote["id"]),
+            }
+        ]
+
+        # the batch replaced the single vote instead of counting both
+        response = owner.get(f"/conversations/{conversation_id}/comments/vote-counts")
+        assert response.json() == [
+            {
+                "comment_id": comment_id,
+                "agree": 1,
+                "disagree": 0,
+                "skip": 0,
+                "total": 1,
+            }
+        ]
+
+    @pytest.mark.parametrize("single", [False, True])
+    def test_concurrent_votes_count_once(self, postgres_sessions, single):
+        with postgres_sessions() as db:
+            user = User(username="voter")
+            conversation = Conversation(name="Race", description="", author=user)
+            comment = Comment(conversation=conversation, user=user, content="Race")
+            db.add_all([user, conversation, comment])
+            db.commit()
+            user_id, conversation_id = user.id, conversation.id
+            comment_id = comment.id
+
+        def vote(db, value):
+            if single:
+                upsert_vote(db, comment_id, user_id, value)
+            else:
+                upsert_votes(db, conversation_id, user_id, {comment_id: value})
+
+        # the first vote is held uncommitted while the second one runs, as
+        # with a double submit
+        first = postgres_sessions()
+        vote(first, -1)
+
+        def vote_again():
+            with postgres_sessions() as second:
+                vote(second, 1)
+                second.commit()
+
+        thread = Thread(target=vote_again)
+        thread.start()
+        try:
+            # the second vote waits for the first one's transaction
+            thread.join(timeout=0.5)
+            assert thread.is_alive()
+        finally:
+            first.commit()
+            first.close()
+            thread.join()
+
+        # the second vote changed the first one rather than adding one
+        with postgres_sessions() as db:
+            counts = db.scalars(
+                select(CommentVoteCount).where(
+                    CommentVoteCount.comment_id == comment_id
+                )
+            ).one()
+            assert (counts.agree, counts.disagree, counts.skip) == (1, 0, 0)
+
+    def test_comments_of_other_conversations_are_not_found(
+        self, authenticated_client, create_conversation, create_comment
+    ):
+        conversation_id = create_conversation(authenticated_client).json()["id"]
+        other_id = create_conversation(authenticated_client).json()["id"]
+        comment_id = create_comment(authenticated_client, other_id).json()["id"]
+
+        response = authenticated_client.post(
+            f"/conversations/{conversation_id}/votes:batch",
+            json=[{"comment_id": comment_id, "value": 1}],
+        )
+        assert response.status_code == 200
+        assert response.json() == [
+            {"comment_id": comment_id, "status": "not_found", "id": None}
+        ]
+
+    def test_votes_not_allowed(
+        self, authenticated_client, create_conversation, create_comment
+    ):
+        conversation_id = create_conversation(authenticated_client).json()["id"]
+        comment_id = create_comment(authenticated_client, conversation_id).json()["id"]
+        authenticated_client.put(
+            f"/conversations/{conversation_id}", json={"allow_votes": False}
+        )
+
+        response = authenticated_client.post(
+            f"/conversations/{conversation_id}/votes:batch",
+            json=[{"comment_id": comment_id, "value": 1}],
+        )
+        assert response.status_code == 403
+        assert response.json() == {
+            "detail": "Voting is not allowed in this conversation"
+        }
+
+    def test_conversation_not_found(self, authenticated_client):
+        response = authenticated_client.post(
+            f"/conversations/{uuid4()}/votes:batch",
+            json=[{"comment_id": str(uuid4()), "value": 1}],
+        )
+        assert response.status_code == 404
+        assert response.json() == {"detail": "Conversation not found"}
@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+from sqlalchemy import func, literal, select
+from chorus.core.routing import (
+    get_comment_priorities,
+    get_routing_key,
+    route_comments,
+)
+from chorus.settings import settings
+
+
+def test_comment_priorities():
+    # columns: fresh, well voted, mostly skipped, extreme
+    agree = np.array([0, 20, 2, 20])
+    disagree = np.array([0, 20, 2, 20])
+    skip = np.array([0, 0, 36, 0])
+    extremity = np.array([0.0, 0.0, 0.0, 2.0])
+
+    fresh, voted, skipped, extreme = get_comment_priorities(
+        agree, disagree, skip, extremity
+    )
+    assert fresh > voted > skipped
+    assert extreme > voted
+
+
+def test_route_comments():
+    priorities = np.array([1.0, 100.0, 1e-6, 10.0])
+
+    order = route_comments(priorities, random_state=0)
+    assert sorted(order) == [0, 1, 2, 3]
+    assert len(route_comments(priorities, limit=2, random_state=0)) == 2
+
+    # comments are drawn in proportion to their priority
+    first = [route_comments(priorities, 1, random_state=seed)[0] for seed in range(200)]
+    counts = np.bincount(first, minlength=4)
+    assert counts[1] > counts[3] > counts[2]
+    assert counts[2] == 0
+
+
+def test_comment_priorities_in_sql(db):
+    agree = [0, 20, 2, 20, 3]
+    disagree = [0, 20, 2, 20, 1]
+    skip = [0, 0, 36, 0, 7]
+    extremity = [0.0, 0.0, 0.0, 2.0, 0.5]
+
+    expected = get_comment_priorities(
+        *(np.array(column) for column in (agree, disagree, skip, extremity))
+    )
+    priorities = [
+        db.scalar(
+            select(
+                get_comment_priorities(
+                    literal(a), literal(d), literal(s), literal(e), exp=func.exp
+                )
+            )
+        )
+        for a, d, s, e in zip(agree, disagree, skip, extremity)
+    ]
+    assert np.allclose(priorities, expected)
+
+
+def test_routing_key_in_sql(db):
+    priorities = np.array([1.0, 100.0, 1e-6, 10.0])
+    keys = select(
+        *(
+            get_routing_key(literal(priority), db.get_bind().dialect.name)
+            for priority in priorities
+        )
+    )
+
+    # as in route_comments, the top key is drawn in proportion to the priority
+    first = [np.argmax(db.execute(keys).one()) for _ in range(200)]
+    counts = np.bincount(first, minlength=4)
+    assert counts[1] > counts[3] > counts[2]
+    assert counts[2] == 0
+
+
+class TestRoutedRemainingComments:
+    @pytest.mark.parametrize("routing", ["priority", "sequential"])
+    def test_remaining_comments_are_routed(
+        self,
+        monkeypatch,
+        authenticated_clients,
+        create_conversation,
+        create_comment,
+        approve_comment,
+        vote_on_comment,
+        routing,
+    ):
+        monkeypatch.setattr(settings, "comment_routing", routing)
+        clients = authenticated_clients(3)
+        owner, user_2, user_3 = clients["user1"], clients["user2"], clients["user3"]
+
+        conversation_id = create_conversation(owner).json()["id"]
+        comment_ids = [
+            create_comment(owner, conversation_id, f"Comment {i}").json()["id"]
+            for i in range(3)
+        ]
+        for comment_id in comment_ids:
+            approve_comment(owner, comment_id)
+
+        served = []
+        for _ in comment_ids:
+            response = user_3.get(
+                f"/conversations/{conversation_id}/comments/remaining"
+            )
+            assert response.status_code == 200
+            served.append(response.json()["comment"]["id"])
+            vote_on_comment(user_3, served[-1], 1)
+        assert sorted(served) == sorted(comment_ids)
+
+        response = user_3.get(f"/conversations/{conversation_id}/comments/remaining")
+        assert response.status_code == 404
+
+        response = user_2.post(
+            f"/comments/{comment_ids[0]}/vote-and-next?num_comments=5",
+            json={"value": 1},
+        )
+        assert sorted(comment["id"] for comment in response.json()["comments"]) == (
+            sorted(comment_ids[1:])
+        )
@@ -0,0 +1,54 @@
+import logging
+from threading import Event, Thread
+from sqlalchemy.orm import Session
+from chorus.core.jobs import fail_stale_jobs
+from chorus.core.scheduler import scheduler
+from chorus.database import db
+from chorus.settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def work(once: bool = False, stop: Event | None = None):
+    """
+    Drains due analysis jobs, polling for new ones unless once is set, until
+    stop is set.
+    """
+    stop = stop or Event()
+    while True:
+        with Session(db) as session:
+            num_stale = fail_stale_jobs(session, settings.analysis_job_timeout_seconds)
+            if num_stale:
+                logger.warning("Marked %d stale analysis jobs as failed", num_stale)
+
+            num_jobs = scheduler.run_pending(session)
+            if num_jobs:
+                logger.info("Ran %d analysis jobs", num_jobs)
+
+        if once or stop.wait(settings.analysis_poll_seconds):
+            return
+
+
+def start_background_worker() -> Event:
+    """
+    Runs the worker loop on a daemon thread of the current process, for
+    deployments without a separate worker. Returns the event that stops it.
+    """
+    stop = Event()
+    Thread(target=work, kwargs={"stop": stop}, daemon=True).start()
+    return stop
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run queued analysis jobs.")
+    parser.add_argument(
+        "--once", action="store_true", help="Exit once no jobs are due."
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    work(once=args.once)
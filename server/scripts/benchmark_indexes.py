@@ -0,0 +1,308 @@
+"""
+Seeds a large database and compares query plans and latency of the hot-path
+queries before and after the indexes added in revision 8c4e1a7f2b90.
+
+Run from the server directory, e.g.:
+
+    ENV_FILE=test.env PYTHONPATH=. python scripts/benchmark_indexes.py
+"""
+
+from pathlib import Path
+import time
+from uuid import uuid4
+import numpy as np
+from sqlalchemy import (
+    Index,
+    MetaData,
+    UniqueConstraint,
+    create_engine,
+    insert,
+    select,
+)
+from chorus import models
+from chorus.database import Base
+
+
+UNIQUE_VOTE_KEY = "uq_votes_comment_id_user_id"
+
+
+def create_schema(engine, indexed: bool):
+    """
+    Creates all tables, leaving out the hot-path indexes when indexed is False.
+    """
+    metadata = MetaData()
+    for table in Base.metadata.sorted_tables:
+        copy = table.to_metadata(metadata)
+        if not indexed:
+            copy.indexes.clear()
+            for constraint in list(copy.constraints):
+                if (
+                    isinstance(constraint, UniqueConstraint)
+                    and constraint.name == UNIQUE_VOTE_KEY
+                ):
+                    copy.constraints.remove(constraint)
+    metadata.create_all(engine)
+
+
+def create_indexes(engine):
+    votes = models.Vote.__table__
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn)
+        Index(UNIQUE_VOTE_KEY, votes.c.comment_id, votes.c.user_id, unique=True).create(
+            conn
+        )
+        conn.exec_driver_sql("ANALYZE")
+
+
+def insert_chunked(conn, table, rows: list[dict], chunk_size: int = 10000):
+    for start in range(0, len(rows), chunk_size):
+        conn.execute(insert(table), rows[start : start + chunk_size])
+
+
+def seed(
+    engine,
+    num_conversations: int,
+    num_comments: int,
+    num_participants: int,
+    vote_fraction: float,
+    random_state: int,
+):
+    """
+    Seeds conversations where every participant votes on a random fraction of
+    the comments. Returns sample (conversation_id, comment_ids, user_ids) tuples.
+    """
+    rng = np.random.default_rng(random_state)
+
+    users = [uuid4() for _ in range(num_participants)]
+    author = users[0]
+
+    samples = []
+    with engine.begin() as conn:
+        insert_chunked(
+            conn,
+            models.User.__table__,
+            [{"id": uid, "username": f"user_{uid.hex[:12]}"} for uid in users],
+        )
+
+        for c in range(num_conversations):
+            conversation_id = uuid4()
+            conn.execute(
+                insert(models.Conversation.__table__),
+                [
+                    {
+                        "id": conversation_id,
+                        "name": f"Conversation {c}",
+                        "description": "",
+                        "author_id": author,
+                    }
+                ],
+            )
+
+            comment_ids = [uuid4() for _ in range(num_comments)]
+            comment_authors = rng.integers(0, num_participants, size=num_comments)
+            insert_chunked(
+                conn,
+                models.Comment.__table__,
+                [
+                    {
+                        "id": cid,
+                        "conversation_id": conversation_id,
+                        "user_id": users[a],
+                        "content": f"Comment {i}",
+                        "approved": True,
+                    }
+                    for i, (cid, a) in enumerate(zip(comment_ids, comment_authors))
+                ],
+            )
+
+            voted = rng.random((num_participants, num_comments)) < vote_fraction
+            values = rng.integers(-1, 2, size=voted.shape)
+            user_idx, comment_idx = np.nonzero(voted)
+            insert_chunked(
+                conn,
+                models.Vote.__table__,
+                [
+                    {
+                        "id": uuid4(),
+                        "comment_id": comment_ids[j],
+                        "user_id": users[i],
+                        "value": int(values[i, j]),
+                    }
+                    for i, j in zip(user_idx.tolist(), comment_idx.tolist())
+                ],
+            )
+
+            points = rng.normal(size=(num_participants, 2))
+            labels = rng.integers(0, 3, size=num_participants)
+            insert_chunked(
+                conn,
+                models.UserPca.__table__,
+                [
+                    {"user_id": uid, "conversation_id": conversation_id, "x": x, "y": y}
+                    for uid, (x, y) in zip(users, points.tolist())
+                ],
+            )
+            insert_chunked(
+                conn,
+                models.UserCluster.__table__,
+                [
+                    {"user_id": uid, "conversation_id": conversation_id, "cluster": k}
+                    for uid, k in zip(users, labels.tolist())
+                ],
+            )
+
+            samples.append((conversation_id, comment_ids, users))
+
+    return samples
+
+
+def get_queries(conversation_id, comment_id, user_id):
+    Vote, Comment = models.Vote, models.Comment
+    return {
+        "vote lookup": select(Vote.id).where(
+            Vote.comment_id == comment_id, Vote.user_id == user_id
+        ),
+        "user votes": select(Vote.comment_id).where(Vote.user_id == user_id),
+        "remaining comment": select(Comment.id)
+        .where(
+            Comment.conversation_id == conversation_id,
+            Comment.user_id != user_id,
+            Comment.approved == True,
+            ~select(Vote.id)
+            .where(Vote.comment_id == Comment.id, Vote.user_id == user_id)
+            .exists(),
+        )
+        .limit(1),
+        "vote matrix": select(Comment.id, Vote.user_id, Vote.value)
+        .outerjoin(Vote, Vote.comment_id == Comment.id)
+        .where(Comment.conversation_id == conversation_id),
+        "user pca": select(models.UserPca.x, models.UserPca.y).where(
+            models.UserPca.conversation_id == conversation_id
+        ),
+        "user clusters": select(models.UserCluster.cluster).where(
+            models.UserCluster.conversation_id == conversation_id
+        ),
+    }
+
+
+def explain(conn, query) -> list[str]:
+    sql = str(
+        query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+    )
+    if conn.dialect.name == "sqlite":
+        return [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+    return [row[0] for row in conn.exec_driver_sql(f"EXPLAIN {sql}")]
+
+
+def measure(engine, samples, repeats: int, random_state: int):
+    """
+    Returns plans and latency percentiles (ms) for each hot-path query.
+    """
+    rng = np.random.default_rng(random_state)
+    latencies = {}
+    plans = {}
+
+    with engine.connect() as conn:
+        for _ in range(repeats):
+            conversation_id, comment_ids, user_ids = samples[rng.integers(len(samples))]
+            comment_id = comment_ids[rng.integers(len(comment_ids))]
+            user_id = user_ids[rng.integers(len(user_ids))]
+
+            for name, query in get_queries(
+                conversation_id, comment_id, user_id
+            ).items():
+                if name not in plans:
+                    plans[name] = explain(conn, query)
+
+                start = time.perf_counter()
+                conn.execute(query).all()
+                latencies.setdefault(name, []).append(
+                    (time.perf_counter() - start) * 1000
+                )
+
+    return plans, {
+        name: (np.percentile(values, 50), np.percentile(values, 99))
+        for name, values in latencies.items()
+    }
+
+
+def benchmark(
+    database_url: str,
+    num_conversations: int,
+    num_comments: int,
+    num_participants: int,
+    vote_fraction: float,
+    repeats: int,
+    random_state: int,
+):
+    engine = create_engine(database_url)
+    Base.metadata.drop_all(engine)
+    create_schema(engine, indexed=False)
+
+    start = time.perf_counter()
+    samples = seed(
+        engine,
+        num_conversations,
+        num_comments,
+        num_participants,
+        vote_fraction,
+        random_state,
+    )
+    print(f"Seeded database in {time.perf_counter() - start:.1f}s")
+
+    before_plans, before = measure(engine, samples, repeats, random_state)
+    create_indexes(engine)
+    after_plans, after = measure(engine, samples, repeats, random_state)
+
+    for name in before:
+        print()
+        print(f"== {name}")
+        print("   before: " + " | ".join(before_plans[name]))
+        print("   after:  " + " | ".join(after_plans[name]))
+
+    print()
+    print(
+        f"{'query':<20}{'p50 before':>12}{'p50 after':>12}"
+        f"{'p99 before':>12}{'p99 after':>12}"
+    )
+    for name in before:
+        print(
+            f"{name:<20}{before[name][0]:>12.3f}{after[name][0]:>12.3f}"
+            f"{before[name][1]:>12.3f}{after[name][1]:>12.3f}"
+        )
+
+    Base.metadata.drop_all(engine)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark hot-path queries before and after adding indexes."
+    )
+    parser.add_argument(
+        "--database_url",
+        type=str,
+        default=f"sqlite:///{Path('benchmark.db').absolute()}",
+        help="Database to seed. All tables in it are dropped.",
+    )
+    parser.add_argument("--conversations", type=int, default=5)
+    parser.add_argument("--comments", type=int, default=300)
+    parser.add_argument("--participants", type=int, default=1000)
+    parser.add_argument("--vote_fraction", type=float, default=0.3)
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--random_state", type=int, default=42)
+
+    args = parser.parse_args()
+
+    benchmark(
+        args.database_url,
+        args.conversations,
+        args.comments,
+        args.participants,
+        args.vote_fraction,
+        args.repeats,
+        args.random_state,
+    )
@@ -0,0 +1,145 @@
+"""
+Measures vote latency under concurrent load: participants, each with their own
+test client, vote on the comments of a new conversation from parallel threads,
+and the p50/p99 latencies of POST /comments/{comment_id}/vote are reported.
+
+Run from the server directory against a migrated database, e.g.:
+
+    ENV_FILE=test.env PYTHONPATH=. python scripts/benchmark_votes.py
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from uuid import uuid4
+import numpy as np
+from fastapi.testclient import TestClient
+from chorus.main import app
+
+
+def make_client():
+    # failed requests are counted rather than raised
+    client = TestClient(app, raise_server_exceptions=False)
+    username, password = f"benchmark-{uuid4()}", "benchmark"
+    client.post("/register", json={"username": username, "password": password})
+    client.post("/token", data={"username": username, "password": password})
+    return client
+
+
+def vote(client: TestClient, comment_ids: list[str], num_votes: int, seed: int):
+    """
+    Casts `num_votes` random votes, some of which change earlier ones, and
+    returns the latency of each request and the number of failed requests.
+    """
+    rng = np.random.default_rng(seed)
+    latencies = []
+    num_failed = 0
+    for _ in range(num_votes):
+        comment_id = comment_ids[rng.integers(len(comment_ids))]
+        value = int(rng.integers(-1, 2))
+        start = perf_counter()
+        response = client.post(f"/comments/{comment_id}/vote", json={"value": value})
+        latencies.append(perf_counter() - start)
+        num_failed += response.status_code != 200
+    return latencies, num_failed
+
+
+def benchmark_votes(
+    num_participants: int = 16,
+    num_comments: int = 100,
+    votes_per_participant: int = 100,
+    random_state: int = 42,
+):
+    owner = make_client()
+    conversation_id = owner.post(
+        "/conversations",
+        json={
+            "name": "Vote benchmark",
+            "description": "Votes cast by the benchmark.",
+            "display_unmoderated": True,
+        },
+    ).json()["id"]
+    comment_ids = [
+        owner.post(
+            f"/conversations/{conversation_id}/comments",
+            json={"content": f"Comment {i}"},
+        ).json()["id"]
+        for i in range(num_comments)
+    ]
+    clients = [make_client() for _ in range(num_participants)]
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=num_participants) as executor:
+        results = list(
+            executor.map(
+                vote,
+                clients,
+                [comment_ids] * num_participants,
+                [votes_per_participant] * num_participants,
+                range(random_state, random_state + num_participants),
+            )
+        )
+    elapsed = perf_counter() - start
+
+    owner.delete(f"/conversations/{conversation_id}")
+
+    latencies = np.concatenate([latencies for latencies, _ in results]) * 1000
+    return {
+        "num_participants": num_participants,
+        "num_votes": len(latencies),
+        "num_failed": sum(num_failed for _, num_failed in results),
+        "p50_ms": np.percentile(latencies, 50),
+        "p99_ms": np.percentile(latencies, 99),
+        "votes_per_second": len(latencies) / elapsed,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Measure vote latency under concurrent load from test clients."
+    )
+    parser.add_argument(
+        "--num_participants",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16],
+        help="Numbers of concurrent participants to benchmark.",
+    )
+    parser.add_argument(
+        "--num_comments",
+        type=int,
+        default=100,
+        help="Number of comments in the conversation (default: 100).",
+    )
+    parser.add_argument(
+        "--votes_per_participant",
+        type=int,
+        default=100,
+        help="Number of votes cast by each participant (default: 100).",
+    )
+    parser.add_argument(
+        "--random_state",
+        type=int,
+        default=42,
+        help="Random state for reproducibility (default: 42).",
+    )
+
+    args = parser.parse_args()
+
+    print(
+        f"{'participants':>12} {'votes':>6} {'failed':>6} {'p50 (ms)':>9}"
+        f" {'p99 (ms)':>9} {'votes/s':>8}"
+    )
+    for num_participants in args.num_participants:
+        result = benchmark_votes(
+            num_participants,
+            args.num_comments,
+            args.votes_per_participant,
+            args.random_state,
+        )
+        print(
+            f"{result['num_participants']:>12} {result['num_votes']:>6}"
+            f" {result['num_failed']:>6} {result['p50_ms']:>9.2f}"
+            f" {result['p99_ms']:>9.2f} {result['votes_per_second']:>8.1f}"
+        )
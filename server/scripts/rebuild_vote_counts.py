@@ -0,0 +1,66 @@
+"""
+Rebuilds the comment_vote_counts table from votes, for every conversation or
+only the given ones, and reports the conversations whose counts had drifted.
+
+Run from the server directory, e.g.:
+
+    ENV_FILE=test.env PYTHONPATH=. python scripts/rebuild_vote_counts.py
+"""
+
+from uuid import UUID
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from chorus import models
+from chorus.core.routines import rebuild_comment_vote_counts, vote_count_columns
+from chorus.database import db
+
+
+def get_counts(session: Session, conversation_id: UUID):
+    columns = [
+        getattr(models.CommentVoteCount, column)
+        for column in vote_count_columns.values()
+    ]
+    rows = session.execute(
+        select(models.CommentVoteCount.comment_id, *columns).where(
+            models.CommentVoteCount.conversation_id == conversation_id
+        )
+    )
+    # rows without votes are equivalent to missing rows
+    return {comment_id: tuple(counts) for comment_id, *counts in rows if any(counts)}
+
+
+def rebuild_vote_counts(conversation_ids: list[UUID] | None = None):
+    with Session(db) as session:
+        if not conversation_ids:
+            conversation_ids = session.scalars(select(models.Conversation.id)).all()
+
+        num_drifted = 0
+        for conversation_id in conversation_ids:
+            previous = get_counts(session, conversation_id)
+            rebuild_comment_vote_counts(session, conversation_id)
+            if get_counts(session, conversation_id) != previous:
+                num_drifted += 1
+                print(f"Rebuilt drifted counts of conversation {conversation_id}")
+            session.commit()
+
+        print(
+            f"Rebuilt {len(conversation_ids)} conversations, {num_drifted} had drifted."
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Rebuild per-comment vote counts from the votes table."
+    )
+    parser.add_argument(
+        "conversation_ids",
+        type=UUID,
+        nargs="*",
+        help="Conversations to rebuild (default: all).",
+    )
+
+    args = parser.parse_args()
+
+    rebuild_vote_counts(args.conversation_ids)
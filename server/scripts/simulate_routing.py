@@ -0,0 +1,153 @@
+"""
+Simulates participants voting on a synthetic conversation and compares how
+well the analysis recovers the true opinion groups when comments are routed
+sequentially, at random, or by priority, for several numbers of votes per
+participant.
+
+Run from the server directory, e.g.:
+
+    PYTHONPATH=. python scripts/simulate_routing.py
+"""
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+from chorus_engine.math import cluster_users, decompose_votes, get_comment_loadings
+from chorus.core.routing import get_comment_priorities, route_comments
+
+
+def make_conversation(
+    num_participants: int,
+    num_comments: int,
+    num_groups: int,
+    divisive_fraction: float,
+    rng: np.random.Generator,
+):
+    """
+    Returns the participants' true groups and the probabilities that each
+    group agrees, disagrees or skips on each comment. Divisive comments split
+    the groups, the others are met with broad agreement or indifference.
+    """
+    groups = rng.integers(0, num_groups, num_participants)
+
+    divisive = rng.random(num_comments) < divisive_fraction
+    agree = np.where(
+        divisive[:, None],
+        rng.choice([0.1, 0.9], size=(num_comments, num_groups)),
+        rng.uniform(0.3, 0.7, size=(num_comments, 1)),
+    )
+    skip = np.where(divisive, 0.1, rng.uniform(0.1, 0.6, num_comments))[:, None]
+    probabilities = np.stack(
+        [
+            agree * (1 - skip),
+            (1 - agree) * (1 - skip),
+            np.broadcast_to(skip, agree.shape),
+        ],
+        axis=-1,
+    )
+
+    return groups, probabilities
+
+
+def simulate(
+    strategy: str,
+    votes_per_participant: int,
+    num_participants: int = 300,
+    num_comments: int = 120,
+    num_groups: int = 3,
+    divisive_fraction: float = 0.3,
+    refresh_every: int = 25,
+    random_state: int = 42,
+):
+    """
+    Lets participants arrive one at a time and vote on up to
+    `votes_per_participant` of the comments posted so far, then returns the
+    adjusted Rand index between the analysis clusters and the true groups.
+    Comments are posted during the first half of the conversation, and the
+    cached statistics used by priority routing are refreshed every
+    `refresh_every` participants, as the analysis worker would.
+    """
+    rng = np.random.default_rng(random_state)
+    groups, probabilities = make_conversation(
+        num_participants, num_comments, num_groups, divisive_fraction, rng
+    )
+    posted_at = np.sort(rng.integers(0, num_participants // 2, num_comments))
+
+    votes = np.full((num_participants, num_comments), np.nan)
+    counts = np.zeros((num_comments, 3))
+    extremity = np.zeros(num_comments)
+    values = np.array([1, -1, 0])
+
+    for participant in range(num_participants):
+        if participant % refresh_every == 0 and participant > 1:
+            voted = votes[:participant]
+            voted = voted[~np.all(np.isnan(voted), axis=1)]
+            if len(voted) > 1:
+                loadings = get_comment_loadings(voted, decompose_votes(voted))
+                extremity = np.hypot(*loadings.T)
+
+        available = np.flatnonzero(posted_at <= participant)
+        if strategy == "sequential":
+            order = available
+        elif strategy == "random":
+            order = rng.permutation(available)
+        elif strategy == "priority":
+            priorities = get_comment_priorities(
+                *counts[available].T, extremity[available]
+            )
+            order = available[route_comments(priorities, random_state=rng)]
+        else:
+            raise ValueError(f"Unknown strategy: {strategy}.")
+
+        for comment in order[:votes_per_participant]:
+            kind = rng.choice(3, p=probabilities[comment, groups[participant]])
+            votes[participant, comment] = values[kind]
+            counts[comment, kind] += 1
+
+    kmeans = cluster_users(decompose_votes(votes), random_state=random_state)
+    return adjusted_rand_score(groups, kmeans.labels_)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Compare comment routing strategies on simulated conversations."
+    )
+    parser.add_argument(
+        "--votes_per_participant",
+        type=int,
+        nargs="+",
+        default=[5, 10, 20, 40],
+        help="Numbers of votes per participant to simulate.",
+    )
+    parser.add_argument(
+        "--num_runs",
+        type=int,
+        default=5,
+        help="Number of simulated conversations to average over (default: 5).",
+    )
+    parser.add_argument(
+        "--random_state",
+        type=int,
+        default=42,
+        help="Random state for reproducibility (default: 42).",
+    )
+
+    args = parser.parse_args()
+
+    strategies = ["sequential", "random", "priority"]
+    print(
+        f"{'votes':>6}"
+        + "".join(f" {strategy + ' ARI':>15}" for strategy in strategies)
+    )
+    for num_votes in args.votes_per_participant:
+        scores = [
+            np.mean(
+                [
+                    simulate(strategy, num_votes, random_state=args.random_state + run)
+                    for run in range(args.num_runs)
+                ]
+            )
+            for strategy in strategies
+        ]
+        print(f"{num_votes:>6}" + "".join(f" {score:>15.3f}" for score in scores))